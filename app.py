@@ -1,12 +1,12 @@
 # app.py
 import streamlit as st
-import sys
 import threading
-import queue
-import re
 import time
-from recipe_design import create_nutrition_crew
-import random
+import uuid
+from plan_inputs import ALL_THEMES, build_job_payload
+from resources import lazy_import, render_timings
+from run_logs import RunLog
+from jobs import JobRejected, get_job_queue
 
 # 设置页面配置
 st.set_page_config(
@@ -17,57 +17,35 @@ st.set_page_config(
 
 
 # =========================================================
-# 核心组件：日志重定向器
-# 用于捕获 CrewAI 的打印输出并显示在 Streamlit 界面上
+# 进程级预热
+# crewai / langchain 的导入与 LLM、工具、Crew 模板的构建放到后台线程，
+# 页面先渲染出来；Streamlit 重跑脚本时不会重复执行
 # =========================================================
-class QueueLogger:
-    """
-    一个线程安全的日志捕获器。
-    它替代 sys.stdout，将所有 print 内容放入队列，而不是直接操作 UI。
-    """
+@st.cache_resource
+def warm_up():
+    def run():
+        # Prometheus 指标端点 (METRICS_PORT，默认 9464，0 表示不启动)
+        lazy_import("instrumentation").serve_metrics()
+        try:
+            recipe_design = lazy_import("recipe_design")
+            with recipe_design.lease_nutrition_crew():
+                pass
+        except Exception as e:
+            print(f"Warm-up Error: {e}")
 
-    def __init__(self, log_queue):
-        self.log_queue = log_queue
-        self.terminal = sys.stdout  # 保留原终端输出
-        self.ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
 
-    def write(self, message):
-        # 1. 输出到控制台（方便调试）
-        self.terminal.write(message)
 
-        # 2. 放入队列（给UI显示）
-        if message.strip():
-            clean_text = self.ansi_escape.sub('', message)
-            self.log_queue.put(clean_text)
+warm_up()
 
-    def flush(self):
-        self.terminal.flush()
 
+# 运行中每次刷新最多推送的日志行数 / 刷新间隔 (秒)；日志与流式输出都只在有新内容时推送
+LOG_VIEW_LINES = 300
+LOG_REFRESH_SECONDS = 0.5
+STREAM_REFRESH_SECONDS = 0.2
 
-# =========================================================
-# 定义风味主题库 
-# =========================================================
-ALL_THEMES = [
-    # --- 西式/异域 ---
-    "地中海风味 (橄榄油/番茄/海鲜/原味)",
-    "东南亚清新 (柠檬草/酸辣/鱼露/椰浆)",
-    "日式极简 (味噌/烤物/昆布高汤)",
-    "法式轻食 (慢煮/香草/红酒醋汁)",
-
-    # --- 中式地域风味 ---
-    "粤式清淡 (清蒸/煲汤/白灼/讲究鲜味)",
-    "川渝麻辣 (花椒/辣椒/红油/开胃)",
-    "湘菜香辣 (鲜椒/小炒/入味下饭)",
-    "淮扬鲜甜 (炖煮/刀工/清鲜平和)",
-    "东北炖菜 (酱香/乱炖/量大豪爽)",
-    "西北风味 (面食/牛羊肉/孜然)",
-    "云南山野 (菌菇/酸木瓜/香料丰富)",
-
-    # --- 功能/创意类 ---
-    "多彩彩虹碗 (强调食材颜色的丰富度)",
-    "温暖治愈系 (砂锅/炖菜/软糯易消化)",
-    "低卡欺骗餐 (重口味但低热量的创意菜)"
-]
 
 # =========================================================
 # GUI 布局
@@ -110,6 +88,8 @@ with st.sidebar:
         style_options,
         index=0  # 默认选第一个
     )
+    # 多日计划：画像与处方只算一次，各天菜单并行生成，主题互不重复 (选定的口味作为第一天)
+    plan_days = st.slider("计划天数", min_value=1, max_value=7, value=1)
 
     btn_generate = st.button("🚀 生成专属食谱", type="primary", use_container_width=True)
 
@@ -129,97 +109,103 @@ with col_result:
 
 # =========================================================
 # 执行逻辑
+# 生成请求提交到进程内的任务队列 (见 jobs.JobQueue)，页面只订阅进度；
+# 匿名用户 id 与任务 id 放在 URL 参数里，刷新或重连后可以继续查看
 # =========================================================
+if "uid" not in st.query_params:
+    st.query_params["uid"] = uuid.uuid4().hex[:12]
+user_id = st.query_params["uid"]
+jobs = get_job_queue()
+
 if btn_generate:
-    # --- 确定最终风味主题 ---
-    if selected_style_option.startswith("🎲"):
-        # 如果用户选了随机，我们就从列表中抽一个
-        daily_theme = random.choice(ALL_THEMES)
-        is_random = True
-    else:
-        # 如果用户指定了，就用用户指定的
-        daily_theme = selected_style_option
-        is_random = False
-
-    # 构建全景 Context (Prompt Engineering)
-    user_context = f"""
-    【用户全景档案】
-    - 基础数据: 性别{gender}, {age}岁, {height}cm, {weight}kg
-    - 职业生活: {job_desc}
-    - 饮食场景: 早餐[{breakfast}], 午餐[{lunch}], 晚餐[{dinner}]
-    - 医学状况: {health_issues}
-    - 偏好禁忌: {preferences}
-    - 目标: {goals}
-    """
-
-    inputs = {
-        "user_input_context": user_context,
-        "creative_theme": daily_theme
+    # 随机选项交给 pick_theme 从主题库中抽一个
+    chosen_theme = None if selected_style_option.startswith("🎲") else selected_style_option
+    profile = {
+        "gender": gender, "age": age, "height": height, "weight": weight,
+        "job_desc": job_desc, "breakfast": breakfast, "lunch": lunch, "dinner": dinner,
+        "health_issues": health_issues, "preferences": preferences, "goals": goals,
     }
 
+    try:
+        job_id = jobs.submit(user_id, build_job_payload(profile, chosen_theme, plan_days))
+        st.query_params["job"] = job_id
+        st.session_state["job_id"] = job_id
+    except JobRejected as e:
+        st.warning(f"⏳ {e}")
+
+# =========================================================
+# 订阅任务进度 (提交后、刷新页面或断线重连后都会走到这里)
+# =========================================================
+job_id = st.query_params.get("job") or st.session_state.get("job_id")
+job = jobs.get(job_id) if job_id else None
+if job is not None:
+    payload = job["payload"]
+    daily_theme = payload["inputs"]["creative_theme"]
+
     # 在界面上展示选定的主题
-    if is_random:
+    if payload.get("days", 1) > 1:
+        st.info(f"📅 {payload['days']} 天计划，每天一个主题：\n\n" + payload["inputs"]["weekly_themes"])
+    elif payload.get("is_random"):
         st.info(f"✨ 既然您选择了随机，AI 为您挑选了灵感主题：**{daily_theme}**")
     else:
         st.success(f"👌 没问题，将为您定制 **{daily_theme}** 风格的食谱")
 
-    # 初始化环境
-    log_queue = queue.Queue()
-    # 临时替换标准输出，捕获所有 Agent 的 print
-    original_stdout = sys.stdout
-    sys.stdout = QueueLogger(log_queue)
-
-    full_logs = ""
-    result_holder = {"data": None, "error": None}
-
-    # 定义后台任务函数
-    def run_crew_task():
-        try:
-            crew = create_nutrition_crew()
-            result_holder["data"] = crew.kickoff(inputs=inputs)
-        except Exception as e:
-            result_holder["error"] = str(e)
-
-
-    # 启动后台线程运行 AI
-    # 注意：我们不在主线程跑 kickoff，因为它会阻塞 UI 刷新
-    thread = threading.Thread(target=run_crew_task)
-    thread.start()
+    with st.expander("🧮 营养处方 (计算引擎)", expanded=False):
+        st.markdown(payload.get("calculation_report", ""))
 
-    # 主线程循环：监听队列并更新 UI
-    # 只要线程还在跑，我们就不断刷新日志
+    # 按固定间隔刷新：排队时显示位置，运行中只在有新日志时推送最近的若干行
     with st.spinner("AI 专家团队正在协作中..."):
-        while thread.is_alive():
-            # 消费队列中的所有新日志
-            while not log_queue.empty():
-                new_line = log_queue.get()
-                full_logs += new_line + "\n"
-                # 更新 UI (这步在主线程，所以是安全的)
-                log_text_element.code(full_logs, language='text', line_numbers=False)
-
-            # 稍微休息一下，避免 CPU 占用过高
-            time.sleep(0.1)
-
-        # 线程结束后，检查队列，确保没有遗漏
-        while not log_queue.empty():
-            new_line = log_queue.get()
-            full_logs += new_line + "\n"
-            log_text_element.code(full_logs, language='text', line_numbers=False)
-
-    # 恢复标准输出 & 显示结果
-    sys.stdout = original_stdout
-    thread.join()
-
-    if result_holder["error"]:
-        st.error(f"运行出错: {result_holder['error']}")
-    elif result_holder["data"]:
-        result_container.markdown(result_holder["data"])
+        rendered_seq = streamed_seq = 0
+        log_rendered_at = 0.0
+        while job["status"] in ("queued", "running"):
+            if job["status"] == "queued":
+                position = jobs.position(job_id)
+                log_text_element.info(f"排队中，前面还有 {max(position, 0)} 个任务...")
+            else:
+                run_log = jobs.log(job_id)
+                if (isinstance(run_log, RunLog) and run_log.seq != rendered_seq
+                        and time.monotonic() - log_rendered_at >= LOG_REFRESH_SECONDS):
+                    rendered_seq, log_rendered_at = run_log.seq, time.monotonic()
+                    log_text_element.code(run_log.text(tail=LOG_VIEW_LINES), language='text', line_numbers=False)
+                # 最终交付文档边生成边显示
+                stream = jobs.stream(job_id)
+                if stream is not None and stream.seq != streamed_seq:
+                    streamed_seq = stream.seq
+                    partial = stream.final_text()
+                    if partial:
+                        result_container.markdown(partial + " ▌")
+            time.sleep(STREAM_REFRESH_SECONDS)
+            job = jobs.get(job_id)
+
+    # 结束后完整显示保存的日志
+    log_text_element.code(jobs.log(job_id) or "", language='text', line_numbers=False)
+
+    result = job["result"] or {}
+    if result.get("token_usage"):
+        with st.expander("📊 各阶段 Token 用量", expanded=False):
+            st.markdown(result["token_usage"])
+        if result.get("breakdown"):
+            with st.expander("🔍 耗时分布 (任务 / LLM / 工具)", expanded=False):
+                st.markdown(lazy_import("instrumentation").render_summary(result["breakdown"]))
+        with st.expander("⏱️ 模型路由延迟", expanded=False):
+            st.markdown(lazy_import("llm_router").render_router_stats())
+    with st.expander("⚙️ 资源加载耗时", expanded=False):
+        st.markdown(render_timings())
+
+    if job["status"] == "failed":
+        st.error(f"运行出错: {job['error']}")
+    elif result.get("markdown"):
+        result_container.markdown(result["markdown"])
         st.success("✅ 生成完成！")
         # 提供下载按钮
         st.download_button(
             label="📥 下载食谱 (Markdown)",
-            data=str(result_holder["data"]),
+            data=result["markdown"],
             file_name="my_diet_plan.md",
             mime="text/markdown"
         )
-        st.balloons()
+        # 每个任务只放一次气球 (重跑脚本时不重复)
+        celebrated = st.session_state.setdefault("celebrated_jobs", set())
+        if job_id not in celebrated:
+            celebrated.add(job_id)
+            st.balloons()
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from plan_inputs import build_job_payloads
+from resources import lazy_import
+from run_logs import RunLog, capture
+
+# 预取等待上限 (秒)：超时后直接开始生成，未预取到的食材由各 Crew 自行查询
+PREFETCH_TIMEOUT = 120
+
+_UNSAFE_NAME = re.compile(r"[^\w\-.]+")
+
+
+# ============================================================
+# 1. 读取档案
+# ============================================================
+def load_profiles(path: str):
+    """
+    每行一个 JSON 档案，字段与 app.py 侧边栏一致
+    (gender, age, height, weight, job_desc, breakfast, lunch, dinner, health_issues, preferences, goals)，
+    可选 id 与 theme (为空时随机挑选主题)。
+    """
+    profiles = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                profile = json.loads(line)
+            except ValueError as e:
+                print(f"Batch: skipping line {line_no}: {e}")
+                continue
+            profile.setdefault("id", str(line_no))
+            profiles.append(profile)
+    return profiles
+
+
+# ============================================================
+# 2. 批量生成
+# ============================================================
+def run_batch(profiles, workers: int = 4, out_path: str = None, markdown_dir: str = None, verbose: bool = False):
+    """
+    为每份档案生成食谱，最多 workers 个 Crew 同时运行 (LLM 调用为 IO 密集，线程池即可)。
+    - 营养处方一次性批量计算；所有档案用到的食材先合并预取一次，之后各 Crew 共享缓存
+    - 每完成一份立即追加写入 out_path (JSONL) 与 markdown_dir/<id>.md
+    返回汇总统计 (见 render_summary)。
+    """
+    recipe_design = lazy_import("recipe_design")
+    crew_runner = lazy_import("crew_runner")
+    tool = recipe_design.get_fatsecret_tool()
+
+    started = time.perf_counter()
+    payloads = build_job_payloads(profiles, [p.get("theme") for p in profiles])
+
+    terms = []
+    for payload in payloads:
+        for term in crew_runner.prefetch_terms(payload["inputs"]["creative_theme"], payload["preferences"]):
+            if term not in terms:
+                terms.append(term)
+    prefetch = crew_runner.start_prefetch(tool, terms)
+    if prefetch is not None:
+        prefetch.join(PREFETCH_TIMEOUT)
+    prepared = time.perf_counter() - started
+
+    cache_before = tool.cache_stats()
+    if markdown_dir:
+        os.makedirs(markdown_dir, exist_ok=True)
+    out = open(out_path, "a", encoding="utf-8") if out_path else None
+    write_lock = threading.Lock()
+
+    def run_one(profile, payload):
+        # 各档案的 Crew 输出收集到自己的日志里，不在终端交错刷屏
+        run_log = RunLog(echo=verbose)
+        job_started = time.perf_counter()
+        record = {"id": profile["id"], "theme": payload["inputs"]["creative_theme"]}
+        with capture(run_log):
+            try:
+                result = recipe_design.run_nutrition_job(payload)
+                record.update(status="done", markdown=result["markdown"], stages=result["stages"])
+            except Exception as e:
+                record.update(status="failed", error=str(e), log=run_log.text(tail=50))
+        record["seconds"] = round(time.perf_counter() - job_started, 3)
+        return record
+
+    records = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+        futures = [pool.submit(run_one, p, payload) for p, payload in zip(profiles, payloads)]
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            with write_lock:
+                if out is not None:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                if markdown_dir and record["status"] == "done":
+                    name = _UNSAFE_NAME.sub("_", str(record["id"])) or "plan"
+                    with open(os.path.join(markdown_dir, f"{name}.md"), "w", encoding="utf-8") as f:
+                        f.write(record["markdown"])
+            print(f"[Batch] {len(records)}/{len(profiles)} {record['id']}: {record['status']} "
+                  f"({record['seconds']:.1f}s)", file=sys.stderr)
+    if out is not None:
+        out.close()
+
+    cache_after = tool.cache_stats()
+    return summarize(records, time.perf_counter() - started, prepared, len(terms), cache_before, cache_after)
+
+
+# ============================================================
+# 3. 汇总统计
+# ============================================================
+def _latency(values) -> dict:
+    values = np.asarray([v for v in values if v is not None], dtype=float)
+    if not values.size:
+        return {"count": 0}
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+    }
+
+
+def summarize(records, wall: float, prepared: float, prefetched: int, cache_before: dict, cache_after: dict) -> dict:
+    done = [r for r in records if r["status"] == "done"]
+    stage_names = []
+    for r in done:
+        for name in r["stages"]:
+            if name not in stage_names:
+                stage_names.append(name)
+    hits = cache_after["hits"] - cache_before["hits"]
+    misses = cache_after["misses"] - cache_before["misses"]
+    return {
+        "profiles": len(records),
+        "done": len(done),
+        "failed": len(records) - len(done),
+        "wall_s": round(wall, 3),
+        "prepare_s": round(prepared, 3),
+        "plans_per_min": round(len(done) / wall * 60, 2) if wall else 0.0,
+        "plan_latency": _latency(r["seconds"] for r in done),
+        "stage_latency": {name: _latency(r["stages"].get(name) for r in done) for name in stage_names},
+        # 阶段耗时为 None 表示复用了检查点
+        "checkpoint_hits": {name: sum(1 for r in done if r["stages"].get(name) is None) for name in stage_names},
+        "prefetched_terms": prefetched,
+        "nutrient_cache": {
+            "hits": hits, "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        },
+    }
+
+
+def render_summary(summary: dict) -> str:
+    lines = [
+        f"profiles: {summary['profiles']} (done {summary['done']}, failed {summary['failed']})",
+        f"wall: {summary['wall_s']}s (prepare {summary['prepare_s']}s), throughput: {summary['plans_per_min']} plans/min",
+        f"plan latency: {summary['plan_latency']}",
+    ]
+    for name, stats in summary["stage_latency"].items():
+        lines.append(f"  stage {name}: {stats}, checkpoint hits: {summary['checkpoint_hits'][name]}")
+    cache = summary["nutrient_cache"]
+    lines.append(f"nutrient cache: {cache['hits']} hits / {cache['misses']} misses (hit rate {cache['hit_rate']:.1%}), "
+                 f"prefetched terms: {summary['prefetched_terms']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate nutrition plans for every profile in a JSONL file")
+    parser.add_argument("profiles", help="JSONL file, one profile per line (same fields as the app form)")
+    parser.add_argument("--out", default="plans.jsonl", help="append one JSON result per line")
+    parser.add_argument("--markdown-dir", default="", help="also write each plan to <dir>/<id>.md")
+    parser.add_argument("--workers", type=int, default=4, help="crews running at the same time")
+    parser.add_argument("--verbose", action="store_true", help="echo crew output to the terminal")
+    parser.add_argument("--summary-json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = run_batch(load_profiles(args.profiles), workers=args.workers, out_path=args.out,
+                        markdown_dir=args.markdown_dir or None, verbose=args.verbose)
+    print(json.dumps(summary, ensure_ascii=False, indent=2) if args.summary_json else render_summary(summary))
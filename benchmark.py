@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from fatsecret_stub import start_stub_server
+from food_query import canonicalize
+from resources import lazy_import, singleton
+from run_logs import RunLog, capture
+
+# 基准测试默认规模
+CONCURRENCY_LEVELS = (1, 2, 4, 8, 16)
+CACHE_SIZES = (10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5)
+ROUTER_MODELS = ("qwen3-max", "qwen-plus", "qwen-turbo")
+
+
+def _latency(samples) -> dict:
+    """耗时分布 (毫秒)"""
+    values = np.asarray(samples, dtype=float) * 1000
+    if not values.size:
+        return {"count": 0}
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def _timed_call(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def _unique_foods(count: int):
+    """互不相近的食材名 (随机单词)，避免被近似重复索引当成同一个查询"""
+    return [f"bench{uuid.uuid4().hex[:10]}" for _ in range(count)]
+
+
+def _make_tool(stub, workdir: str, name: str):
+    """指向替身服务的独立工具实例：单独的缓存库，关闭本地离线营养库"""
+    FatSecretSearchTool = lazy_import("tools_fatsecret").FatSecretSearchTool
+    return FatSecretSearchTool(
+        client_id="stub", client_secret="stub",
+        token_url=stub.token_url, api_url=stub.api_url,
+        cache_db=os.path.join(workdir, f"{name}.db"),
+        cache_file=os.path.join(workdir, f"{name}.json"),
+        reference_db=os.path.join(workdir, "no-reference"), reference_csv="",
+        # 同一组凭证共享一个客户端，限额只在首次创建时生效；放宽到不成为瓶颈
+        rate_limit=10000.0, burst=10000, max_concurrency=64,
+    )
+
+
+# ============================================================
+# 1. 工具吞吐 vs 并发
+# ============================================================
+def _overlapping_queries(calls: int, foods_per_call: int, overlap: float, seed: int):
+    """每个食材以 overlap 的概率取自一个小的公共池 (模拟多个会话同时查询相同食材)，否则互不重复"""
+    rng = random.Random(seed)
+    pool = _unique_foods(foods_per_call * 2)
+    queries = []
+    for _ in range(calls):
+        foods = [rng.choice(pool) if rng.random() < overlap else _unique_foods(1)[0] for _ in range(foods_per_call)]
+        queries.append(", ".join(foods))
+    return queries
+
+
+def bench_tool(stub, workdir: str, levels=CONCURRENCY_LEVELS, calls: int = 32, foods_per_call: int = 6,
+               overlap: float = 0.0) -> list:
+    """
+    每个并发度使用一个新的工具实例：先跑一遍 (除公共池重复项外全部联网)，
+    再原样重跑一遍 (全部命中内存缓存)。lookup 记录微批调度的合并比例与批大小。
+    """
+    results = []
+    for level in levels:
+        tool = _make_tool(stub, workdir, f"tool-{level}")
+        queries = _overlapping_queries(calls, foods_per_call, overlap, level)
+        row = {"concurrency": level, "calls": calls, "foods_per_call": foods_per_call, "overlap": overlap}
+        for phase in ("cold", "warm"):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                samples = list(pool.map(lambda q: _timed_call(tool._run, q), queries))
+            wall = time.perf_counter() - started
+            row[phase] = dict(_latency(samples), calls_per_s=round(calls / wall, 2),
+                              foods_per_s=round(calls * foods_per_call / wall, 2))
+        row["lookup"] = tool.lookup_stats()
+        results.append(row)
+        print(f"[Bench] tool concurrency={level}: cold {row['cold']['calls_per_s']} calls/s, "
+              f"warm {row['warm']['calls_per_s']} calls/s", file=sys.stderr)
+    return results
+
+
+# ============================================================
+# 2. 缓存命中 / 未命中耗时 vs 缓存规模
+# ============================================================
+def _write_legacy_cache(path: str, size: int):
+    """生成旧版 food_cache_db.json (键为规范化查询)，返回键列表"""
+    keys = []
+    cache = {}
+    for food in _unique_foods(size):
+        key = canonicalize(food).key
+        keys.append(key)
+        cache[key] = f"{food} | Kcal: 120 | P: 8.00g | C: 15.00g | F: 3.00g (per 100g)"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    return keys
+
+
+def bench_cache(stub, workdir: str, sizes=CACHE_SIZES, samples: int = 200) -> list:
+    """
+    缓存现在存放在 SQLite (nutrient_store)，旧 JSON 只在首次启动时迁移一次；
+    这里按规模生成旧 JSON，测量迁移耗时，以及 SQLite 命中 / 内存 LRU 命中 / 联网未命中的单次查询耗时。
+    第一次未命中会构建近似重复索引 (遍历全部缓存键)，单独记录。
+    """
+    results = []
+    for size in sizes:
+        name = f"cache-{size}"
+        keys = _write_legacy_cache(os.path.join(workdir, f"{name}.json"), size)
+        tool = _make_tool(stub, workdir, name)
+        row = {"entries": size}
+
+        started = time.perf_counter()
+        tool._get_store()
+        row["migrate_s"] = round(time.perf_counter() - started, 3)
+
+        picked = [keys[i] for i in np.random.default_rng(size).choice(size, min(samples, size), replace=False)]
+        row["sqlite_hit"] = _latency([_timed_call(tool._search_single_food, k) for k in picked])
+        row["memory_hit"] = _latency([_timed_call(tool._search_single_food, k) for k in picked])
+
+        misses = _unique_foods(min(samples, 50) + 1)
+        row["first_miss_s"] = round(_timed_call(tool._search_single_food, misses[0]), 3)
+        row["miss"] = _latency([_timed_call(tool._search_single_food, q) for q in misses[1:]])
+        results.append(row)
+        print(f"[Bench] cache entries={size}: migrate {row['migrate_s']}s, "
+              f"sqlite p50 {row['sqlite_hit']['p50_ms']}ms, memory p50 {row['memory_hit']['p50_ms']}ms, "
+              f"miss p50 {row['miss']['p50_ms']}ms", file=sys.stderr)
+    return results
+
+
+# ============================================================
+# 3. 端到端食谱生成
+# ============================================================
+def bench_e2e(stub, workdir: str, runs: int = 5, llm_latency=(0.05, 0.5), verbose: bool = False,
+              days: int = 1) -> dict:
+    """
+    用脚本化的假 LLM 驱动真实的 create_nutrition_crew (工具调用、份量求解、检查点、DAG 调度都走真实路径)。
+    每次运行使用不同的档案，检查点不会命中。days > 1 时测多日计划，额外给出每天的平均耗时。
+    """
+    recipe_design = lazy_import("recipe_design")
+    ScriptedLLM = lazy_import("fake_llm").ScriptedLLM
+    CheckpointStore = lazy_import("checkpoints").CheckpointStore
+    build_job_payload = lazy_import("plan_inputs").build_job_payload
+
+    singleton("tool:fatsecret", lambda: _make_tool(stub, workdir, "e2e"))
+    singleton("checkpoints", lambda: CheckpointStore(os.path.join(workdir, "checkpoints.db")))
+    for model in ROUTER_MODELS:
+        for stream in (False, True):
+            recipe_design.make_qwen_llm(model, stream).inner = ScriptedLLM(model=model, latency=llm_latency)
+
+    records = []
+    started = time.perf_counter()
+    for i in range(runs):
+        payload = build_job_payload({"age": 25 + i, "weight": 70.0 + i, "goals": "减脂"},
+                                    theme="粤式清淡 (清蒸/煲汤/白灼/讲究鲜味)", days=days)
+        run_log = RunLog(echo=verbose)
+        run_started = time.perf_counter()
+        with capture(run_log):
+            try:
+                result = recipe_design.run_nutrition_job(payload)
+            except Exception as e:
+                print(f"[Bench] e2e run {i} failed: {e}\n{run_log.text(tail=20)}", file=sys.stderr)
+                continue
+        records.append({"seconds": time.perf_counter() - run_started, "stages": result["stages"]})
+        print(f"[Bench] e2e run {i}: {records[-1]['seconds']:.2f}s", file=sys.stderr)
+    wall = time.perf_counter() - started
+
+    stage_names = []
+    for record in records:
+        for stage in record["stages"]:
+            if stage not in stage_names:
+                stage_names.append(stage)
+    return {
+        "runs": runs,
+        "done": len(records),
+        "days": days,
+        "llm_latency": list(llm_latency) if isinstance(llm_latency, (tuple, list)) else llm_latency,
+        "plans_per_min": round(len(records) / wall * 60, 2) if wall else 0.0,
+        "plan": _latency([r["seconds"] for r in records]),
+        "per_day": _latency([r["seconds"] / days for r in records]),
+        "stages": {stage: _latency([r["stages"][stage] for r in records if r["stages"].get(stage) is not None])
+                   for stage in stage_names},
+    }
+
+
+# ============================================================
+# 4. 汇总输出
+# ============================================================
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run_benchmarks(sections, stub_config: dict, levels=CONCURRENCY_LEVELS, cache_sizes=CACHE_SIZES,
+                   e2e_runs: int = 5, llm_latency=(0.05, 0.5), verbose: bool = False, days: int = 1,
+                   overlap: float = 0.0) -> dict:
+    stub = start_stub_server(**stub_config)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stub": stub_config,
+    }
+    with tempfile.TemporaryDirectory(prefix="nutrition-bench-") as workdir:
+        if "tool" in sections:
+            report["tool"] = bench_tool(stub, workdir, levels, overlap=overlap)
+        if "cache" in sections:
+            report["cache"] = bench_cache(stub, workdir, cache_sizes)
+        if "e2e" in sections:
+            report["e2e"] = bench_e2e(stub, workdir, e2e_runs, llm_latency, verbose, days)
+    report["stub_requests"] = stub.stats.snapshot()
+    stub.shutdown()
+    return report
+
+
+def render_report(report: dict) -> str:
+    lines = [f"benchmark @ {report['git'] or 'unknown'} (python {report['python']}), stub {report['stub']}"]
+    for row in report.get("tool", []):
+        lines.append(f"tool c={row['concurrency']:>2}: cold {row['cold']['calls_per_s']:>8} calls/s "
+                     f"(p50 {row['cold']['p50_ms']}ms, p95 {row['cold']['p95_ms']}ms) | "
+                     f"warm {row['warm']['calls_per_s']:>8} calls/s (p50 {row['warm']['p50_ms']}ms)")
+        if row.get("lookup"):
+            lines.append(f"  lookup batching: {row['lookup']['coalescing_ratio']} coalesced, "
+                         f"mean batch {row['lookup']['mean_batch']}, {row['lookup']['upstream']} upstream")
+    for row in report.get("cache", []):
+        lines.append(f"cache n={row['entries']:>6}: migrate {row['migrate_s']}s, "
+                     f"sqlite hit p50 {row['sqlite_hit']['p50_ms']}ms, memory hit p50 {row['memory_hit']['p50_ms']}ms, "
+                     f"miss p50 {row['miss']['p50_ms']}ms (first miss {row['first_miss_s']}s)")
+    e2e = report.get("e2e")
+    if e2e:
+        lines.append(f"e2e: {e2e['done']}/{e2e['runs']} plans of {e2e['days']} day(s), {e2e['plans_per_min']} plans/min, "
+                     f"plan {e2e['plan']}, per day {e2e['per_day']}")
+        for stage, stats in e2e["stages"].items():
+            lines.append(f"  stage {stage}: {stats}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the nutrition tools and crew against a local FatSecret stub")
+    parser.add_argument("--out", default="bench.json", help="write the machine-readable results here")
+    parser.add_argument("--sections", default="tool,cache,e2e", help="comma-separated: tool, cache, e2e")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--search-results", type=int, default=1, help="foods returned by foods.search")
+    parser.add_argument("--servings", type=int, default=1, help="servings per food in food.get.v2")
+    parser.add_argument("--concurrency", default=",".join(map(str, CONCURRENCY_LEVELS)),
+                        help="comma-separated concurrency levels for the tool benchmark")
+    parser.add_argument("--overlap", type=float, default=0.0,
+                        help="probability that a tool-benchmark food comes from a small shared pool")
+    parser.add_argument("--lookup-window-ms", type=float, default=None,
+                        help="lookup batching window (0 disables batching); defaults to LOOKUP_WINDOW_MS")
+    parser.add_argument("--cache-sizes", default=",".join(map(str, CACHE_SIZES)),
+                        help="comma-separated legacy cache sizes for the cache benchmark")
+    parser.add_argument("--e2e-runs", type=int, default=5)
+    parser.add_argument("--e2e-days", type=int, default=1, help="days per plan (multi-day mode when > 1)")
+    parser.add_argument("--llm-latency", type=float, nargs=2, default=(0.05, 0.5), metavar=("BASE", "PER_KTOK"),
+                        help="scripted LLM latency: seconds per call plus seconds per 1k output tokens")
+    parser.add_argument("--verbose", action="store_true", help="echo crew output to the terminal")
+    args = parser.parse_args()
+    if args.lookup_window_ms is not None:
+        os.environ["LOOKUP_WINDOW_MS"] = str(args.lookup_window_ms)
+
+    report = run_benchmarks(
+        [s.strip() for s in args.sections.split(",") if s.strip()],
+        {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+         "search_results": args.search_results, "servings": args.servings},
+        levels=[int(x) for x in args.concurrency.split(",")],
+        cache_sizes=[int(x) for x in args.cache_sizes.split(",")],
+        e2e_runs=args.e2e_runs, llm_latency=tuple(args.llm_latency), verbose=args.verbose, days=args.e2e_days,
+        overlap=args.overlap,
+    )
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(render_report(report))
+    print(f"results written to {args.out}")
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from crewai.tasks.task_output import TaskOutput
+
+# 提示词 / 存储格式变化时递增，使旧检查点全部失效
+CHECKPOINT_VERSION = 2
+
+# 环境变量：CHECKPOINT_MAX_AGE_DAYS=检查点保留天数 (打开时及此后每小时清理一次过期条目)
+ENV_MAX_AGE_DAYS = "CHECKPOINT_MAX_AGE_DAYS"
+PRUNE_INTERVAL = 3600
+
+
+# ============================================================
+# 1. 内容寻址键
+# ============================================================
+def task_fingerprint(task, upstream_outputs) -> str:
+    """
+    检查点键 = hash(插值后的任务描述、预期输出、Agent 设定、模型、工具、上游任务输出)。
+    任务描述在 kickoff 时已经插值，输入 (用户档案 / 主题 / 营养处方) 的变化会直接反映在键上。
+    """
+    agent = task.agent
+    llm = getattr(agent, "llm", None)
+    payload = {
+        "version": CHECKPOINT_VERSION,
+        "description": task.description,
+        "expected_output": task.expected_output,
+        "agent": [agent.role, agent.goal, agent.backstory] if agent else None,
+        "model": getattr(llm, "model", None) or getattr(llm, "model_name", None),
+        "tools": sorted(t.name for t in (task.tools or (agent.tools if agent else None) or [])),
+        "upstream": [o.raw for o in upstream_outputs],
+    }
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+# ============================================================
+# 2. 检查点存储 (SQLite WAL)
+# ============================================================
+class CheckpointStore:
+    """
+    按内容寻址保存每个任务的输出。
+    - 任务完成即写入，进程崩溃后重跑会从最后一个完成的阶段继续
+    - 只有输入或上游输出变化的任务 (及其下游) 会重新计算
+    - 超过 max_age 秒的检查点定期删除，库文件不会无限增长
+    """
+
+    def __init__(self, db_path: str = "crew_checkpoints.db", busy_timeout_ms: int = 5000, max_age: float = None):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.max_age = max_age or float(os.getenv(ENV_MAX_AGE_DAYS, "7")) * 24 * 3600
+        self._local = threading.local()
+        self._pruned_at = 0.0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " key TEXT PRIMARY KEY,"
+            " task_name TEXT,"
+            " agent TEXT,"
+            " raw TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._maybe_prune()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, task):
+        """命中时返回重建的 TaskOutput，否则返回 None"""
+        row = self._connect().execute(
+            "SELECT agent, raw FROM checkpoints WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return TaskOutput(
+            name=task.name or task.description,
+            description=task.description,
+            expected_output=task.expected_output,
+            raw=row[1],
+            agent=row[0] or "",
+            output_format=task._get_output_format(),
+        )
+
+    def put(self, key: str, task, output):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO checkpoints (key, task_name, agent, raw, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, task.name, output.agent, output.raw, time.time())
+        )
+        self._maybe_prune()
+
+    def _maybe_prune(self):
+        if time.time() - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = time.time()
+        try:
+            removed = self.prune(self.max_age)
+        except sqlite3.Error as e:
+            print(f"Checkpoint Prune Error: {e}")
+            return
+        if removed:
+            print(f"[Checkpoint] pruned {removed} entries older than {self.max_age / 86400:g} days")
+
+    def prune(self, max_age: float) -> int:
+        """删除超过 max_age 秒的检查点，返回删除条数"""
+        cur = self._connect().execute("DELETE FROM checkpoints WHERE created_at < ?", (time.time() - max_age,))
+        return cur.rowcount
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,25 @@
+import pytest
+from nutrient_cache import NutrientRecord
+
+MENU = """| 餐次 | 推荐菜品 | 核心食材及生重(g) | 热量估算 |
+|---|---|---|---|
+| 早餐 | 燕麦香蕉碗 | 燕麦 50g、香蕉 1根、牛奶 250ml | 1,050 kcal |
+| 午餐 | 外卖汉堡 | 汉堡 1个 | 560 |
+"""
+
+
+def _record(name, kcal):
+    return NutrientRecord(f"test:{name}", name, kcal, 10.0, 10.0, 10.0)
+
+
+@pytest.fixture
+def menu():
+    """早餐可完整计算、午餐含无法换算克数的计数项"""
+    return MENU
+
+
+@pytest.fixture
+def lookup():
+    """audit_menu / make_menu_callback 使用的查询函数：只认识燕麦、香蕉、牛奶"""
+    table = {"燕麦": _record("oats", 380), "香蕉": _record("banana", 90), "牛奶": _record("milk", 50)}
+    return lambda names: {name: table.get(name) for name in names}
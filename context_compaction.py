@@ -0,0 +1,188 @@
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel, ValidationError
+from menu_audit import audit_menu, render_audit
+from nutrition_math import CONDITION_RULES
+
+# 每个列表字段最多保留的条目数 / 每条最大长度
+MAX_ITEMS = 8
+MAX_ITEM_CHARS = 60
+MAX_NOTES_CHARS = 600
+
+# 画像 JSON 的键名 -> 压缩后的字段 (按顺序匹配，先命中者优先)
+_PROFILE_FIELDS = (
+    ("basics", ("基础", "生理", "basic", "身体")),
+    ("risks", ("风险", "risk", "异常", "疾病", "病史", "医学", "代谢")),
+    ("tags", ("标签", "tag", "生活")),
+    ("constraints", ("禁忌", "偏好", "过敏", "不吃", "场景", "constraint", "avoid", "prefer", "饮食")),
+    ("goals", ("目标", "goal", "需求", "心理")),
+)
+_JSON_BLOCK = re.compile(r"\{.*\}", re.DOTALL)
+
+
+# ============================================================
+# 1. 压缩后的上下文结构 (pydantic 校验)
+# ============================================================
+class ProfileDigest(BaseModel):
+    basics: List[str] = []
+    risks: List[str] = []
+    tags: List[str] = []
+    constraints: List[str] = []
+    goals: List[str] = []
+    other: List[str] = []
+
+
+class TargetsDigest(BaseModel):
+    kcal: int
+    protein_g: int
+    carbs_g: int
+    fat_g: int
+    servings: Dict[str, float]
+    meals: Dict[str, int]
+    sodium_mg: int
+    conditions: List[str] = []
+    rules: List[str] = []
+
+
+class MenuItemDigest(BaseModel):
+    meal: str
+    dish: str
+    # source 为表格中食材单元格的原文 (含计数食材与备注)，ingredients 为解析出的生重
+    source: str = ""
+    ingredients: List[Tuple[str, float]]
+    # kcal 为按营养数据库重新计算的值，claimed_kcal 为菜单中的热量估算
+    kcal: Optional[int] = None
+    claimed_kcal: Optional[int] = None
+
+
+class MenuDigest(BaseModel):
+    items: List[MenuItemDigest]
+    totals: Dict[str, int]
+    audit: List[str] = []
+    missing: List[str] = []
+    notes: str = ""
+
+
+def to_json(digest: BaseModel) -> str:
+    return json.dumps(digest.model_dump(exclude_defaults=True), ensure_ascii=False, separators=(",", ":"))
+
+
+# ============================================================
+# 2. 各阶段的压缩
+# ============================================================
+def _short(text) -> str:
+    text = re.sub(r"\s+", " ", str(text)).strip()
+    return text if len(text) <= MAX_ITEM_CHARS else text[:MAX_ITEM_CHARS - 1] + "…"
+
+
+def _leaves(value, path=(), in_list=False):
+    """展开嵌套 JSON，返回 [(键路径, 文本)]；字典里的标量带上键名 (如 "BMI: 27.8")"""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _leaves(v, path + (str(k),))
+    elif isinstance(value, list):
+        for v in value:
+            yield from _leaves(v, path, in_list=True)
+    elif value not in (None, ""):
+        yield path, value if in_list or not path else f"{path[-1]}: {value}"
+
+
+def compact_profile(raw: str) -> Optional[ProfileDigest]:
+    """把画像任务输出的 JSON (键名不固定) 归并成固定字段；不是合法 JSON 时返回 None"""
+    match = _JSON_BLOCK.search(raw or "")
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group())
+    except ValueError:
+        return None
+
+    fields = {name: [] for name, _ in _PROFILE_FIELDS}
+    fields["other"] = []
+    for path, text in _leaves(data):
+        joined = " ".join(path).lower()
+        name = next((n for n, keys in _PROFILE_FIELDS if any(k in joined for k in keys)), "other")
+        item = _short(text)
+        if len(fields[name]) < MAX_ITEMS and item not in fields[name]:
+            fields[name].append(item)
+    try:
+        return ProfileDigest(**fields)
+    except ValidationError:
+        return None
+
+
+def compact_targets(result: dict) -> TargetsDigest:
+    """nutrition_math.calculate_profile 的结果 -> 菜单 / 质检阶段需要的最小目标集"""
+    return TargetsDigest(
+        kcal=round(result["target_kcal"]),
+        protein_g=round(result["protein_g"]),
+        carbs_g=round(result["carbs_g"]),
+        fat_g=round(result["fat_g"]),
+        servings=result["servings"],
+        meals={k: round(v) for k, v in result["meals"].items()},
+        sodium_mg=result["sodium_mg"],
+        conditions=[CONDITION_RULES[n]["label"] for n in result["conditions"]],
+        rules=[r for n in result["conditions"] for r in CONDITION_RULES[n]["rules"]],
+    )
+
+
+def _notes(raw: str) -> str:
+    """表格以外的文字 (如外卖指南)，截断后保留"""
+    text = "\n".join(line for line in (raw or "").splitlines() if not line.strip().startswith("|")).strip()
+    return text if len(text) <= MAX_NOTES_CHARS else text[:MAX_NOTES_CHARS - 1] + "…"
+
+
+def _fully_parsed(row: dict) -> bool:
+    """食材单元格的每一项都换算成了克数 (没有 "汉堡 1个" 这类无法换算的计数项，也不是整格无法解析)"""
+    return not row.get("unparsed") and (row["ingredients"] or not row.get("ingredients_text", "").strip())
+
+
+def compact_menu(raw: str, audit: dict) -> Optional[MenuDigest]:
+    """
+    菜单表格 + 程序化核对结果 -> MenuDigest。
+    解析不到表格，或有食材无法换算成克数时返回 None (保留原文，避免下游按不完整的食材重建食谱)
+    """
+    if not audit["rows"] or not all(_fully_parsed(r) for r in audit["rows"]):
+        return None
+    kcal, protein, carbs, fat = audit["daily"]
+    try:
+        return MenuDigest(
+            items=[MenuItemDigest(meal=r["meal"], dish=r["dish"], source=r.get("ingredients_text", ""),
+                                  ingredients=r["ingredients"], kcal=round(r["computed"][0]),
+                                  claimed_kcal=round(r["claimed_kcal"]) if r["claimed_kcal"] else None)
+                   for r in audit["rows"]],
+            totals={"kcal": round(kcal), "protein_g": round(protein), "carbs_g": round(carbs), "fat_g": round(fat)},
+            audit=[f"{label}: {value:.0f} vs {target:.0f} ({delta:+.0%})" for label, value, target, delta in audit["flags"]],
+            missing=audit["missing"],
+            notes=_notes(raw),
+        )
+    except ValidationError:
+        return None
+
+
+# ============================================================
+# 3. Task 回调
+# ============================================================
+def compact_profile_callback(output):
+    digest = compact_profile(output.raw)
+    if digest is None:
+        print("Context Compaction: profile output is not valid JSON, passing it through")
+        return
+    output.raw = to_json(digest)
+
+
+def make_menu_callback(lookup, targets: dict = None):
+    """核对菜单 (见 menu_audit) 并把输出替换为压缩后的 JSON；无法完整解析时保留原文并追加核对报告"""
+    def callback(output):
+        try:
+            audit = audit_menu(output.raw, lookup, targets)
+        except Exception as e:
+            print(f"Menu Audit Error: {e}")
+            return
+        digest = compact_menu(output.raw, audit)
+        if digest is None:
+            output.raw = f"{output.raw}\n\n{render_audit(audit)}"
+        else:
+            output.raw = to_json(digest)
+    return callback
@@ -0,0 +1,162 @@
+import contextvars
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from crewai import Crew
+from crewai.utilities.constants import NOT_SPECIFIED
+from checkpoints import task_fingerprint
+from instrumentation import span
+from ingredient_aliases import SEPARATORS, resolve_alias
+
+
+# ============================================================
+# 1. 按 context 依赖分层
+# ============================================================
+def task_parents(tasks, i):
+    """任务 i 的上游任务：声明了 context 的用 context，否则沿用顺序语义依赖前一个任务"""
+    task = tasks[i]
+    if task.context is NOT_SPECIFIED:
+        return tasks[i - 1:i]
+    return [t for t in (task.context or []) if t in tasks[:i]]
+
+
+def task_levels(tasks):
+    """
+    按 Task.context 声明的依赖做拓扑分层，同一层内的任务互不依赖，可以并行。
+    未声明 context 的任务沿用顺序语义：依赖前一个任务。
+    同一个 Agent 不能同时执行两个任务，因此同层内重复的 Agent 会被顺延到下一层。
+    """
+    depth = {}
+    levels = []
+    for i, task in enumerate(tasks):
+        level = max((depth[p] + 1 for p in task_parents(tasks, i)), default=0)
+        while True:
+            while len(levels) <= level:
+                levels.append([])
+            if all(t.agent is not task.agent for t in levels[level]):
+                break
+            level += 1
+        depth[task] = level
+        levels[level].append(task)
+    return [level for level in levels if level]
+
+
+# ============================================================
+# 2. DAG 调度的 Crew
+# ============================================================
+def _execute_task(task, agent, context, tools):
+    with span(f"task {task.name}", "task", task_name=task.name or "", agent_role=agent.role):
+        return task.execute_sync(agent=agent, context=context, tools=tools)
+
+
+class DagCrew(Crew):
+    """
+    沿用 Crew.kickoff 的全部准备工作 (输入插值、回调、Agent 执行器、事件)，
+    只把顺序执行替换为按依赖分层并行执行。
+    """
+
+    max_parallel: int = 4
+    # checkpoints.CheckpointStore：命中的任务直接复用输出，只重算失效的后缀
+    checkpoints: Any = None
+    # 最终任务 (质检 / 成稿) 默认不复用检查点：LLM 有随机性，同样的输入再次点击生成应得到新的成稿
+    checkpoint_final: bool = False
+
+    def _run_sequential_process(self):
+        index = {task: i for i, task in enumerate(self.tasks)}
+        outputs = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="crew-task") as pool:
+            for level in task_levels(self.tasks):
+                started = time.perf_counter()
+                futures = []
+                for task in level:
+                    key = None
+                    if self.checkpoints is not None and (self.checkpoint_final or task is not self.tasks[-1]):
+                        upstream = [outputs[p] for p in task_parents(self.tasks, index[task])]
+                        key = task_fingerprint(task, upstream)
+                        restored = self.checkpoints.get(key, task)
+                        if restored is not None:
+                            # 下游任务通过 task.output 读取上下文
+                            task.output = restored
+                            outputs[task] = restored
+                            with span(f"task {task.name}", "task", task_name=task.name or "", checkpoint=True,
+                                      agent_role=task.agent.role if task.agent else ""):
+                                pass
+                            print(f"[Checkpoint] reused: {task.agent.role if task.agent else task.name}")
+                            continue
+
+                    agent = self._get_agent_to_use(task)
+                    if agent is None:
+                        raise ValueError(f"No agent available for task: {task.description}")
+                    tools = self._prepare_tools(agent, task, task.tools or agent.tools or [])
+                    self._log_task_start(task, agent.role)
+                    context = self._get_context(task, [outputs[t] for t in self.tasks if t in outputs])
+                    futures.append((task, key, pool.submit(
+                        # 复制 contextvars，保证追踪上下文在工作线程中可见
+                        contextvars.copy_context().run, _execute_task, task, agent, context, tools
+                    )))
+
+                for task, key, future in futures:
+                    output = future.result()
+                    outputs[task] = output
+                    # 每个任务完成即写检查点，崩溃后可从这里继续
+                    if key is not None:
+                        self.checkpoints.put(key, task, output)
+                    self._process_task_result(task, output)
+                    self._store_execution_log(task, output, index[task])
+                if len(futures) > 1:
+                    print(f"[DAG] {len(futures)} tasks in parallel: {time.perf_counter() - started:.1f}s")
+
+        return self._create_crew_output([outputs[t] for t in self.tasks])
+
+
+# ============================================================
+# 3. 推测性预取营养数据
+# ============================================================
+_THEME_INGREDIENTS = re.compile(r"[(（]([^)）]*)[)）]")
+_THEME_SEPARATORS = re.compile(r"[/／、,，]+")
+# 偏好里的否定表达：这些食材不会出现在食谱中，不需要预取
+_NEGATIONS = ("不吃", "不喝", "不要", "不能", "忌", "禁", "过敏", "讨厌", "少吃", "别")
+
+
+def prefetch_terms(theme: str = "", preferences: str = ""):
+    """
+    从主题括号中的关键食材 (如 "川渝麻辣 (花椒/辣椒/红油/开胃)") 和用户偏好中提取可查询的食材，
+    返回去重后的英文查询词。只保留别名索引能识别的词，"开胃" 之类的描述会被跳过。
+    """
+    candidates = []
+    for group in _THEME_INGREDIENTS.findall(theme or ""):
+        candidates.extend(_THEME_SEPARATORS.split(group))
+    for part in SEPARATORS.split(preferences or ""):
+        if part and not any(n in part for n in _NEGATIONS):
+            candidates.append(part)
+
+    terms = []
+    for text in candidates:
+        english = resolve_alias(text.strip())
+        if english and english not in terms:
+            terms.append(english)
+    return terms
+
+
+def start_prefetch(nutrient_tool, terms):
+    """在后台线程查询 terms，结果写入工具的缓存层；返回线程对象 (调用方通常不需要等待)"""
+    if not terms:
+        return None
+
+    def run():
+        started = time.perf_counter()
+        try:
+            results = nutrient_tool.lookup_records(terms)
+        except Exception as e:
+            print(f"Prefetch Error: {e}")
+            return
+        found = sum(1 for _, record, _ in results if record is not None)
+        print(f"[Prefetch] {found}/{len(terms)} foods warmed in {time.perf_counter() - started:.2f}s")
+
+    # 复制 contextvars，预取日志归入发起请求的那次运行
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), name="nutrient-prefetch",
+                              daemon=True)
+    thread.start()
+    return thread
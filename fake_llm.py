@@ -0,0 +1,113 @@
+import json
+import re
+import time
+from crewai.llms.base_llm import BaseLLM
+from llm_replay import _normalize_messages, estimate_tokens
+
+# ============================================================
+# 脚本化的假 LLM (基准测试 / 离线演示)
+# 按任务名返回预先写好的 ReAct 回复，驱动 create_nutrition_crew 走完真实的工具调用路径：
+# 画像 -> 菜单 (查询营养数据 -> 求解份量 -> 输出表格) -> 质检
+# ============================================================
+DEFAULT_INGREDIENTS = {
+    "早餐": ["oatmeal", "milk", "鸡蛋"],
+    "午餐": ["brown rice", "chicken breast", "broccoli"],
+    "晚餐": ["sweet potato", "tofu", "spinach"],
+}
+
+_OBSERVATION = re.compile(r"^Observation:", re.MULTILINE)
+_DAY_SUFFIX = re.compile(r"_day\d+$")
+
+
+def _react_action(tool: str, arguments: dict) -> str:
+    return (f"Thought: I need data from the tool first.\nAction: {tool}\n"
+            f"Action Input: {json.dumps(arguments, ensure_ascii=False)}")
+
+
+def _final(answer: str) -> str:
+    return f"Thought: I now know the final answer\nFinal Answer: {answer}"
+
+
+class ScriptedLLM(BaseLLM):
+    """
+    - 当前轮次 = 助手消息中已有的 Observation 数 (每次工具调用后 CrewAI 追加一条)
+    - latency: 每次调用的模拟耗时 (秒)，可以是固定值或 (基础耗时, 每千输出 token 耗时)
+    - 用量按文本长度估算，计入 token 统计
+    """
+
+    def __init__(self, model: str = "fake-llm", latency=0.0, ingredients: dict = None):
+        super().__init__(model=model, temperature=0.0)
+        self.latency = latency
+        self.ingredients = ingredients or DEFAULT_INGREDIENTS
+        self.calls = 0
+
+    def _stage(self, messages, from_task) -> str:
+        name = getattr(from_task, "name", None)
+        if name:
+            # 多日模式的菜单任务为 menu_design_day<N>
+            return _DAY_SUFFIX.sub("", name)
+        prompt = " ".join(str(m.get("content", "")) for m in messages)
+        if "深度拆解" in prompt:
+            return "profile"
+        if "落地" in prompt:
+            return "menu_design"
+        if "食物交换份转化" in prompt:
+            return "calculation"
+        return "qa_review"
+
+    def script(self, stage: str, turn: int) -> str:
+        foods = [food for items in self.ingredients.values() for food in items]
+        if stage == "profile":
+            return _final(json.dumps({
+                "基础数据": {"BMI": 27.8, "体型": "超重"},
+                "风险": ["脂肪肝风险", "久坐"],
+                "生活流标签": ["时间匮乏型", "外卖依赖"],
+                "禁忌": ["香菜", "内脏"],
+                "核心目标": ["减脂", "改善免疫力"],
+            }, ensure_ascii=False))
+        if stage == "calculation":
+            return _final("BMR 1800 kcal, TDEE 2160 kcal, 目标 1660 kcal; 谷薯 6.5份, 肉蛋 7.5份, 蔬菜 1份, 油脂 1份")
+        if stage == "menu_design":
+            if turn == 0:
+                return _react_action("Search FatSecret Nutrition Data", {"query": ", ".join(foods)})
+            if turn == 1:
+                return _react_action("Solve Ingredient Portions", {"meals": [
+                    {"meal": meal, "ingredients": items, "kcal": 500} for meal, items in self.ingredients.items()
+                ]})
+            rows = "\n".join(f"| {meal} | 主题{meal}套餐 | {'、'.join(f'{food} 100g' for food in items)} | 500 |"
+                             for meal, items in self.ingredients.items())
+            return _final("| 餐次 | 推荐菜品 | 核心食材及生重(g) | 热量估算 |\n|---|---|---|---|\n" + rows
+                          + "\n\n外卖指南：选择少油少盐的轻食套餐。")
+        return _final("# 一日食谱\n\n" + "\n".join(
+            f"## {meal}\n- " + "\n- ".join(f"{food} 100g" for food in items) for meal, items in self.ingredients.items()
+        ) + "\n\n## 质检结论\n- 热量与宏量均在目标范围内。")
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None,
+             from_task=None, from_agent=None, response_model=None):
+        messages = _normalize_messages(messages)
+        turn = sum(len(_OBSERVATION.findall(str(m["content"] or ""))) for m in messages if m["role"] == "assistant")
+        response = self.script(self._stage(messages, from_task), turn)
+
+        if isinstance(self.latency, (tuple, list)):
+            base, per_ktok = self.latency
+            time.sleep(base + per_ktok * estimate_tokens(response) / 1000)
+        elif self.latency:
+            time.sleep(self.latency)
+
+        prompt_tokens = estimate_tokens(json.dumps(messages, ensure_ascii=False))
+        completion_tokens = estimate_tokens(response)
+        self._track_token_usage_internal({
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+        self.calls += 1
+        return response
+
+    def supports_function_calling(self) -> bool:
+        return False
+
+    def supports_stop_words(self) -> bool:
+        return True
+
+    def get_context_window_size(self) -> int:
+        return 32768
@@ -0,0 +1,322 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from instrumentation import span
+from nutrient_cache import NutrientRecord
+from throttle import AdaptiveLimiter, RetryPolicy, shared_bucket
+
+
+# ============================================================
+# 1. 异常定义
+# ============================================================
+class FatSecretError(Exception):
+    """FatSecret 接口调用失败"""
+
+
+class FatSecretAuthError(FatSecretError):
+    """OAuth 鉴权失败 (未配置 Key / Key 无效)"""
+
+
+class FatSecretUnavailable(FatSecretError):
+    """上游暂时不可用 (5xx / 超时 / 连接失败)，可重试"""
+
+    def __init__(self, message, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FatSecretRateLimited(FatSecretUnavailable):
+    """上游限流 (HTTP 429)"""
+
+
+# ============================================================
+# 2. 同键请求合并 (single-flight)
+# ============================================================
+class SingleFlight:
+    """同一个 key 同时只发起一次调用，其余调用方共享同一个结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+# ============================================================
+# 3. FatSecret 客户端
+# ============================================================
+class FatSecretClient:
+    """
+    带连接池的 FatSecret 客户端。
+    - 复用 requests.Session (keep-alive)，避免每次查询重新握手 TCP/TLS
+    - Token 在过期前自动刷新 (软阈值后台刷新，硬阈值同步刷新)
+    - 相同查询在途时合并为一次上游请求
+    - lookup_async() 提供线程池并发接口
+    - 令牌桶限流 (按 API 地址进程内共享) + 自适应并发 + 带预算的指数退避重试
+    """
+
+    def __init__(self, client_id, client_secret,
+                 token_url="https://oauth.fatsecret.com/connect/token",
+                 api_url="https://platform.fatsecret.com/rest/server.api",
+                 pool_size: int = 32, timeout: float = 10,
+                 refresh_soft_margin: float = 300, refresh_hard_margin: float = 30,
+                 rate_limit: float = 10.0, burst: int = 20,
+                 max_concurrency: int = 16, retry_policy: RetryPolicy = None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.api_url = api_url
+        self.timeout = timeout
+        self.refresh_soft_margin = refresh_soft_margin
+        self.refresh_hard_margin = refresh_hard_margin
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="fatsecret")
+        self.bucket = shared_bucket(api_url, rate_limit, burst)
+        self.limiter = AdaptiveLimiter(initial=min(5, max_concurrency), max_limit=max_concurrency)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._flight = SingleFlight()
+        self._token_lock = threading.Lock()
+        self._token = None
+        self._token_expires_at = 0.0
+        self._refreshing = False
+
+    # ------------------------------------------------------------
+    # Token 生命周期
+    # ------------------------------------------------------------
+    def _fetch_token(self):
+        # 如果是 mock ID 或未配置 Key，不进行真实请求
+        if not self.client_id or self.client_id == "mock_id":
+            raise FatSecretAuthError("FatSecret credentials not configured")
+        try:
+            res = self.session.post(
+                self.token_url,
+                data={"grant_type": "client_credentials", "scope": "basic"},
+                auth=(self.client_id, self.client_secret),
+                timeout=self.timeout
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # 网络故障是暂时性的：走重试预算，不能当成 Key 无效
+            raise FatSecretUnavailable(f"Network Error (token): {e}") from e
+        if res.status_code == 429 or res.status_code >= 500:
+            error_cls = FatSecretRateLimited if res.status_code == 429 else FatSecretUnavailable
+            raise error_cls(f"HTTP {res.status_code} (token)", _parse_retry_after(res.headers.get("Retry-After")))
+        try:
+            res.raise_for_status()
+            payload = res.json()
+            return payload["access_token"], time.time() + float(payload.get("expires_in", 3600))
+        except Exception as e:
+            raise FatSecretAuthError(f"Auth Error: {e}") from e
+
+    def _refresh_token(self):
+        token, expires_at = self._fetch_token()
+        with self._token_lock:
+            self._token, self._token_expires_at = token, expires_at
+        return token
+
+    def _background_refresh(self):
+        try:
+            self._refresh_token()
+        except FatSecretError as e:
+            print(f"Token Refresh Error: {e}")
+        finally:
+            with self._token_lock:
+                self._refreshing = False
+
+    def get_token(self) -> str:
+        remaining = self._token_expires_at - time.time()
+        if self._token and remaining > self.refresh_soft_margin:
+            return self._token
+
+        if self._token and remaining > self.refresh_hard_margin:
+            # 即将过期：继续使用旧 Token，同时后台刷新
+            with self._token_lock:
+                start = not self._refreshing
+                self._refreshing = True
+            if start:
+                self._executor.submit(self._background_refresh)
+            return self._token
+
+        # 已过期或首次获取：所有调用方合并为一次同步刷新
+        return self._flight.do(_TOKEN_FLIGHT_KEY, self._refresh_token)
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token, self._token_expires_at = None, 0.0
+
+    # ------------------------------------------------------------
+    # API 调用
+    # ------------------------------------------------------------
+    def _call_once(self, params: dict) -> dict:
+        self.bucket.acquire()
+        started = self.limiter.acquire()
+        overloaded = False
+        try:
+            token = self.get_token()
+            try:
+                res = self.session.get(
+                    self.api_url,
+                    headers={"Authorization": f"Bearer {token}"},
+                    params=dict(params, format="json"),
+                    timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                overloaded = True
+                raise FatSecretUnavailable(f"Network Error: {e}") from e
+
+            if res.status_code == 429 or res.status_code >= 500:
+                overloaded = True
+                retry_after = _parse_retry_after(res.headers.get("Retry-After"))
+                error_cls = FatSecretRateLimited if res.status_code == 429 else FatSecretUnavailable
+                raise error_cls(f"HTTP {res.status_code}", retry_after)
+            if res.status_code == 401:
+                raise _TokenRejected()
+            res.raise_for_status()
+            return res.json()
+        finally:
+            self.limiter.release(overloaded, started)
+
+    def _call(self, params: dict) -> dict:
+        self.retry_policy.on_request()
+        attempt = 1
+        token_retried = False
+        # 一次逻辑请求一个 span，耗时包含限流等待与退避重试
+        with span(f"fatsecret {params.get('method', '')}", "upstream") as current:
+            while True:
+                try:
+                    return self._call_once(params)
+                except _TokenRejected:
+                    # Token 被服务端提前作废时，刷新后重试一次
+                    if token_retried:
+                        raise FatSecretAuthError("Token rejected by FatSecret")
+                    token_retried = True
+                    self.invalidate_token()
+                except FatSecretUnavailable as e:
+                    if not self.retry_policy.allow_retry(attempt):
+                        raise
+                    time.sleep(self.retry_policy.backoff(attempt, e.retry_after))
+                    attempt += 1
+                    current.set(retries=attempt - 1)
+
+    def search_food_id(self, query: str):
+        res = self._call({"method": "foods.search", "search_expression": query, "max_results": 1})
+        foods = (res.get("foods") or {}).get("food", [])
+        if not foods:
+            return None
+        return foods[0]["food_id"] if isinstance(foods, list) else foods["food_id"]
+
+    def get_food(self, food_id) -> dict:
+        return self._call({"method": "food.get.v2", "food_id": food_id})
+
+    def _fetch(self, query: str):
+        # 步骤A: 搜索 ID -> 步骤B: 获取详情
+        food_id = self.search_food_id(query)
+        if food_id is None:
+            return None
+        return parse_food_detail(self.get_food(food_id), food_id, query)
+
+    def lookup(self, query: str):
+        """查询单个食物，返回 NutrientRecord；数据库中不存在时返回 None"""
+        try:
+            return self._flight.do(query, self._fetch, query)
+        except FatSecretError:
+            raise
+        except Exception as e:
+            raise FatSecretError(str(e)) from e
+
+    def lookup_async(self, query: str) -> Future:
+        return self._executor.submit(self.lookup, query)
+
+    def submit(self, fn, *args) -> Future:
+        """在客户端线程池中执行任意函数 (供上层并发编排使用)"""
+        return self._executor.submit(fn, *args)
+
+    def stats(self) -> dict:
+        stats = {"deduplicated": self._flight.shared, "queue_depth": self._executor._work_queue.qsize()}
+        stats.update(self.bucket.stats())
+        stats.update(self.limiter.stats())
+        stats.update(self.retry_policy.stats())
+        return stats
+
+
+# single-flight 键：用元组与查询字符串分属不同命名空间，
+# 任何食物名都不会和 Token 刷新撞键
+_TOKEN_FLIGHT_KEY = ("token", "refresh")
+
+
+class _TokenRejected(Exception):
+    pass
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_food_detail(detail_res: dict, food_id, default_name: str) -> NutrientRecord:
+    """从 food.get.v2 的响应中挑出 100g (或首个公制) 份量并构造记录"""
+    food_data = detail_res.get("food", {})
+    food_name = food_data.get("food_name", default_name)
+
+    servings = food_data.get("servings", {}).get("serving", [])
+    if isinstance(servings, dict): servings = [servings]
+
+    target = servings[0] if servings else {}
+    for s in servings:
+        if s.get("metric_serving_unit") == "g" and "100" in s.get("metric_serving_amount", ""):
+            target = s
+            break
+
+    return NutrientRecord.from_serving(food_id, food_name, target)
+
+
+# ============================================================
+# 4. 进程级共享客户端
+# ============================================================
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(client_id, client_secret, token_url, api_url, **options) -> FatSecretClient:
+    """
+    同一组凭证在进程内共享一个客户端 (连接池 / Token / 在途合并 / 限流跨会话生效)。
+    options 仅在首次创建时生效。
+    """
+    key = (client_id, client_secret, token_url, api_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = FatSecretClient(client_id, client_secret, token_url, api_url, **options)
+            _clients[key] = client
+    return client
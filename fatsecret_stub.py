@@ -0,0 +1,182 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# ============================================================
+# 本地 FatSecret 替身服务
+# 模拟 OAuth / foods.search / food.get.v2，可注入延迟、错误与限流，
+# 用于在本地验证客户端的限流、退避和自适应并发。
+# ============================================================
+class StubConfig:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, rate_limit: float = None, not_found_rate: float = 0.0,
+                 search_results: int = 1, servings: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        # 按比例随机返回 error_status
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # 服务端每秒允许的请求数，超出返回 429 (None 表示不限)
+        self.rate_limit = rate_limit
+        self.not_found_rate = not_found_rate
+        # 响应大小：foods.search 返回的条目数 / food.get.v2 每个食物的份量数
+        self.search_results = max(1, search_results)
+        self.servings = max(1, servings)
+
+
+class StubStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def incr(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.stats.incr("token")
+        self._send(200, {"access_token": "stub-token", "expires_in": 86400, "token_type": "Bearer"})
+
+    def do_GET(self):
+        server = self.server
+        config = server.config
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        method = params.get("method", "")
+        server.stats.incr(method)
+
+        time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+
+        if config.rate_limit and not server.admit():
+            server.stats.incr("429")
+            return self._send(429, {"error": "rate limited"}, {"Retry-After": "1"})
+        if random.random() < config.error_rate:
+            server.stats.incr(str(config.error_status))
+            return self._send(config.error_status, {"error": "injected"})
+
+        if method == "foods.search":
+            if random.random() < config.not_found_rate:
+                return self._send(200, {"foods": {"max_results": "1", "total_results": "0"}})
+            food_id = abs(hash(params.get("search_expression", ""))) % 10 ** 8
+            foods = [{"food_id": str(food_id + i), "food_name": f"Stub Food {food_id + i}",
+                      "food_description": "Per 100g - Calories: 100kcal | Fat: 1.00g | Carbs: 10.00g | Protein: 5.00g"}
+                     for i in range(config.search_results)]
+            return self._send(200, {"foods": {"food": foods, "max_results": str(len(foods)),
+                                              "total_results": str(len(foods))}})
+        if method == "food.get.v2":
+            return self._send(200, _fake_food(params.get("food_id", "0"), config.servings))
+        self._send(400, {"error": f"unknown method {method}"})
+
+
+def _fake_food(food_id: str, servings: int = 1) -> dict:
+    rng = random.Random(food_id)
+    kcal, protein, carbs, fat = rng.randint(20, 600), rng.uniform(0, 30), rng.uniform(0, 80), rng.uniform(0, 50)
+    # 第一个是 100g 份量，其余模拟 "1 cup" 之类的家用份量
+    grams = [100.0] + [rng.choice((30.0, 50.0, 150.0, 240.0)) for _ in range(servings - 1)]
+    return {"food": {
+        "food_id": food_id,
+        "food_name": f"Stub Food {food_id}",
+        "servings": {"serving": [{
+            "serving_description": "100 g" if i == 0 else f"1 portion ({g:g} g)",
+            "metric_serving_amount": f"{g:.3f}",
+            "metric_serving_unit": "g",
+            "calories": f"{kcal * g / 100:.0f}",
+            "protein": f"{protein * g / 100:.2f}",
+            "carbohydrate": f"{carbs * g / 100:.2f}",
+            "fat": f"{fat * g / 100:.2f}",
+        } for i, g in enumerate(grams)]},
+    }}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: StubConfig):
+        super().__init__(address, _Handler)
+        self.config = config
+        self.stats = StubStats()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        """按 1 秒固定窗口计数，超过 rate_limit 拒绝"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            return self._window_count <= self.config.rate_limit
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    @property
+    def token_url(self) -> str:
+        return self.url + "/connect/token"
+
+    @property
+    def api_url(self) -> str:
+        return self.url + "/rest/server.api"
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, **config) -> StubServer:
+    """在后台线程启动替身服务；port=0 时自动分配端口"""
+    server = StubServer((host, port), StubConfig(**config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local FatSecret stub server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    parser.add_argument("--not-found-rate", type=float, default=0.0)
+    parser.add_argument("--search-results", type=int, default=1, help="foods returned by foods.search")
+    parser.add_argument("--servings", type=int, default=1, help="servings per food in food.get.v2")
+    args = parser.parse_args()
+
+    stub = start_stub_server(port=args.port, latency=args.latency, jitter=args.jitter,
+                             error_rate=args.error_rate, error_status=args.error_status,
+                             rate_limit=args.rate_limit, not_found_rate=args.not_found_rate,
+                             search_results=args.search_results, servings=args.servings)
+    print(f"FatSecret stub listening on {stub.url}")
+    print(f"  token_url={stub.token_url}")
+    print(f"  api_url={stub.api_url}")
+    try:
+        while True:
+            time.sleep(5)
+            print(stub.stats.snapshot())
+    except KeyboardInterrupt:
+        stub.shutdown()
@@ -0,0 +1,297 @@
+import argparse
+import re
+import threading
+from nutrient_reference import name_grams
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# ============================================================
+# 1. 规范化词表
+# ============================================================
+# 同义词 (多词短语优先匹配)
+SYNONYMS = {
+    "garbanzo beans": "chickpea",
+    "garbanzo bean": "chickpea",
+    "sweetpotato": "sweet potato",
+    "scallion": "green onion",
+    "spring onion": "green onion",
+    "aubergine": "eggplant",
+    "courgette": "zucchini",
+    "prawn": "shrimp",
+    "capsicum": "bell pepper",
+    "coriander": "cilantro",
+    "rolled oat": "oatmeal",
+    "soya": "soy",
+    "bean curd": "tofu",
+    "beancurd": "tofu",
+    "low fat": "lowfat",
+    "fat free": "nonfat",
+    "non fat": "nonfat",
+    "skim": "nonfat",
+    "whole wheat": "wholewheat",
+    "whole grain": "wholegrain",
+}
+
+# 烹饪方式归并：营养成分差异主要来自 "生 / 熟 / 油炸"
+COOKING_METHODS = {
+    "boiled": "cooked", "steamed": "cooked", "cooked": "cooked", "poached": "cooked",
+    "stewed": "cooked", "braised": "cooked", "blanched": "cooked",
+    "baked": "roasted", "roasted": "roasted", "grilled": "roasted", "broiled": "roasted",
+    "fried": "fried", "stirfried": "fried", "sauteed": "fried", "panfried": "fried", "deepfried": "fried",
+    "raw": "raw", "uncooked": "raw", "dry": "raw", "dried": "dried",
+}
+
+# 不影响营养查询的修饰语
+NOISE_PHRASES = (
+    "without skin", "with skin", "skin on", "skin off", "without salt", "no salt",
+    "peel not eaten", "in skin", "bone in", "boneless", "skinless", "peeled", "unpeeled",
+)
+STOPWORDS = {
+    "a", "an", "the", "of", "and", "or", "with", "without", "in", "for", "to",
+    "fresh", "plain", "organic", "homemade", "style", "pieces", "piece", "sliced", "diced",
+    "chopped", "minced", "lightly", "fillet", "fillets",
+}
+
+# 部位 / 成分：查询里出现时候选中也必须有 (egg white 不能匹配整蛋，chicken thigh 不能匹配鸡胸)
+PART_WORDS = {"white", "yolk", "breast", "thigh", "wing", "leg", "drumstick", "loin", "rib", "belly", "liver"}
+# 制品形态：查询与候选必须一致 (almond milk / 杏仁、potato chip / 土豆、lemon juice / 柠檬)
+FORM_WORDS = {"milk", "juice", "chip", "fry", "powder", "flour", "oil", "butter", "sauce", "paste", "soup", "jam"}
+
+# 生熟热量差异大 (谷物干重 vs 熟重、豆类、肉类)：一方写了烹饪方式另一方没写时不视为同一食物
+METHOD_SENSITIVE = {
+    "rice", "oat", "oatmeal", "pasta", "noodle", "spaghetti", "macaroni", "quinoa", "barley", "millet",
+    "buckwheat", "couscous", "bulgur", "corn", "bean", "lentil", "chickpea", "pea", "soybean", "edamame",
+    "chicken", "beef", "pork", "lamb", "mutton", "turkey", "duck", "goose", "veal", "ham", "bacon",
+    "sausage", "fish", "salmon", "tuna", "cod", "shrimp", "crab", "egg",
+}
+
+# 以 s 结尾但不是复数的词
+_SINGULAR_EXCEPTIONS = {"hummus", "asparagus", "couscous", "molasses", "swiss", "grass", "bass",
+                        "citrus", "octopus"}
+# -ves -> -f 只对已知词生效 (olives / chives / cloves 仍按普通复数去掉 s)
+_F_PLURALS = {"leaves": "leaf", "loaves": "loaf", "halves": "half", "calves": "calf", "shelves": "shelf"}
+
+
+def singularize(word: str) -> str:
+    if word in _SINGULAR_EXCEPTIONS or len(word) <= 3:
+        return word
+    if word in _F_PLURALS:
+        return _F_PLURALS[word]
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+# ============================================================
+# 2. 查询规范化
+# ============================================================
+class CanonicalQuery:
+    """规范化后的查询：method 为归并后的烹饪方式，tokens 为其余关键词 (保持原顺序)"""
+
+    __slots__ = ("raw", "method", "tokens")
+
+    def __init__(self, raw: str, method: str, tokens: tuple):
+        self.raw = raw
+        self.method = method
+        self.tokens = tokens
+
+    @property
+    def key(self) -> str:
+        """缓存键：与词序无关"""
+        words = sorted(set(self.tokens))
+        return " ".join(([self.method] if self.method else []) + words)
+
+    @property
+    def text(self) -> str:
+        """可读形式，用于本地库匹配"""
+        return " ".join(([self.method] if self.method else []) + list(self.tokens))
+
+    def __repr__(self):
+        return f"CanonicalQuery({self.key!r})"
+
+
+def canonicalize(query: str) -> CanonicalQuery:
+    text = " " + " ".join(_TOKEN_PATTERN.findall((query or "").lower().replace("-", ""))) + " "
+    for phrase in NOISE_PHRASES:
+        text = text.replace(f" {phrase} ", " ")
+
+    words = [singularize(w) for w in text.split()]
+    text = " " + " ".join(words) + " "
+    for phrase in sorted(SYNONYMS, key=len, reverse=True):
+        text = text.replace(f" {phrase} ", f" {SYNONYMS[phrase]} ")
+
+    method = ""
+    tokens = []
+    for word in text.split():
+        if word in COOKING_METHODS:
+            # 多个烹饪词时保留第一个 (例如 "baked sweet potato, cooked")
+            method = method or COOKING_METHODS[word]
+        elif word not in STOPWORDS:
+            tokens.append(word)
+    return CanonicalQuery(query, method, tuple(tokens))
+
+
+# ============================================================
+# 3. 近似重复索引
+# ============================================================
+def similarity(a: CanonicalQuery, b: CanonicalQuery) -> float:
+    """
+    0~1 的置信度：词集合 Jaccard 与字符三元组 Dice 的加权。
+    烹饪方式冲突时为 0；谷物 / 豆类 / 肉类只有一方写了烹饪方式时同样为 0
+    """
+    if a.method and b.method and a.method != b.method:
+        return 0.0
+    ta, tb = set(a.tokens), set(b.tokens)
+    if not ta or not tb:
+        return 0.0
+    if a.method != b.method and (ta | tb) & METHOD_SENSITIVE:
+        return 0.0
+    jaccard = len(ta & tb) / len(ta | tb)
+    ga, gb = name_grams(" ".join(sorted(ta))), name_grams(" ".join(sorted(tb)))
+    dice = 2 * len(ga & gb) / (len(ga) + len(gb)) if ga and gb else 0.0
+    score = 0.6 * jaccard + 0.4 * dice
+    # 一方有烹饪方式、另一方没有时略微降权
+    if a.method != b.method:
+        score *= 0.9
+    return score
+
+
+def head_noun(canonical: CanonicalQuery) -> str:
+    """中心词：最后一个不是部位 / 形态词的关键词 (duck breast -> duck, almond milk -> almond)"""
+    nouns = [t for t in canonical.tokens if t not in PART_WORDS and t not in FORM_WORDS]
+    return nouns[-1] if nouns else (canonical.tokens[-1] if canonical.tokens else "")
+
+
+def compatible(query: CanonicalQuery, candidate: CanonicalQuery) -> bool:
+    """
+    模糊匹配的硬性约束 (字符相似度之外)：
+    中心词必须出现在候选中；查询指定了烹饪方式时候选必须包含同一种；部位词必须出现；制品形态词必须一致
+    """
+    head = head_noun(query)
+    tokens = set(candidate.tokens)
+    if not head or head not in tokens:
+        return False
+    # 只有形态词的查询 (milk / juice)：候选也必须以它为中心 (USDA 名称中心词在最前)，不能是 coconut milk
+    if head in FORM_WORDS and candidate.tokens[0] != head:
+        return False
+    if query.method:
+        # 候选名称可能同时写了多种烹饪方式 ("cooked, roasted")，任一相同即可
+        methods = {COOKING_METHODS[w] for w in _TOKEN_PATTERN.findall(candidate.raw.lower()) if w in COOKING_METHODS}
+        if query.method not in methods:
+            return False
+    query_tokens = set(query.tokens)
+    if not (query_tokens & PART_WORDS) <= tokens:
+        return False
+    return query_tokens & FORM_WORDS == tokens & FORM_WORDS
+
+
+class NearDuplicateIndex:
+    """
+    已缓存查询的近似重复索引。
+    按规范化后的关键词建倒排表，只和至少共享一个关键词的条目比较。
+    """
+
+    def __init__(self, min_confidence: float = 0.75):
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._entries = {}   # canonical key -> (stored key, CanonicalQuery)
+        self._postings = {}  # token -> set(canonical key)
+
+    def add(self, stored_key: str, canonical: CanonicalQuery = None):
+        canonical = canonical or canonicalize(stored_key)
+        key = canonical.key
+        if not key:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (stored_key, canonical)
+            for token in set(canonical.tokens):
+                self._postings.setdefault(token, set()).add(key)
+
+    def match(self, canonical: CanonicalQuery):
+        """返回 (已缓存的键, 置信度)；没有足够相近的条目时返回 (None, 最高分)"""
+        with self._lock:
+            entry = self._entries.get(canonical.key)
+            if entry is not None:
+                return entry[0], 1.0
+            candidates = set()
+            for token in set(canonical.tokens):
+                candidates |= self._postings.get(token, set())
+            scored = [(similarity(canonical, self._entries[c][1]), self._entries[c][0]) for c in candidates]
+        if not scored:
+            return None, 0.0
+        best_score, best_key = max(scored)
+        if best_score < self.min_confidence:
+            return None, best_score
+        return best_key, best_score
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# ============================================================
+# 4. 查询日志回放：评估规范化带来的命中率提升
+# ============================================================
+def replay_hit_rate(queries, min_confidence: float = 0.75) -> dict:
+    """
+    按顺序回放查询，模拟一个初始为空的缓存：
+    baseline 只按 strip().lower() 命中；canonical 先按规范化键、再按近似重复索引命中。
+    """
+    baseline_keys = set()
+    index = NearDuplicateIndex(min_confidence)
+    baseline_hits = exact_hits = near_hits = total = 0
+    for q in queries:
+        q = q.strip()
+        if not q:
+            continue
+        total += 1
+        raw_key = q.lower()
+        if raw_key in baseline_keys:
+            baseline_hits += 1
+        baseline_keys.add(raw_key)
+
+        canonical = canonicalize(q)
+        stored, confidence = index.match(canonical)
+        if stored is not None and confidence >= 1.0:
+            exact_hits += 1
+        elif stored is not None:
+            near_hits += 1
+        else:
+            index.add(raw_key, canonical)
+
+    def rate(n):
+        return round(n / total, 4) if total else 0.0
+
+    return {
+        "queries": total,
+        "baseline_hit_rate": rate(baseline_hits),
+        "canonical_hit_rate": rate(exact_hits),
+        "canonical_plus_near_hit_rate": rate(exact_hits + near_hits),
+        "upstream_fetches_baseline": total - baseline_hits,
+        "upstream_fetches_canonical": total - exact_hits - near_hits,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Food query canonicalization tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_key = sub.add_parser("key", help="print the canonical cache key of each query")
+    p_key.add_argument("queries", nargs="+")
+    p_replay = sub.add_parser("replay", help="replay a query log (one query per line, or comma-separated)")
+    p_replay.add_argument("log_file")
+    p_replay.add_argument("--min-confidence", type=float, default=0.75)
+    args = parser.parse_args()
+
+    if args.command == "key":
+        for q in args.queries:
+            print(f"{q!r} -> {canonicalize(q).key!r}")
+    else:
+        with open(args.log_file, "r", encoding="utf-8") as f:
+            logged = [part for line in f for part in line.split(",")]
+        for k, v in replay_hit_rate(logged, args.min_confidence).items():
+            print(f"{k}: {v}")
@@ -0,0 +1,285 @@
+import re
+import unicodedata
+
+# ============================================================
+# 1. 中英文食材别名表
+# 英文名 -> (简体中文 / 俗称 / 拼音)
+# 英文名需要能被 FatSecret 和本地营养库直接检索
+# ============================================================
+ALIASES = {
+    # --- 谷薯类 ---
+    "cooked white rice": ("米饭", "白米饭", "白饭", "大米饭", "蒸米饭", "mifan", "baimifan"),
+    "white rice": ("大米", "白米", "稻米", "dami"),
+    "cooked brown rice": ("糙米饭", "caomifan"),
+    "brown rice": ("糙米", "caomi"),
+    "oatmeal": ("燕麦", "燕麦片", "麦片", "yanmai", "yanmaipian"),
+    "quinoa": ("藜麦", "limai"),
+    "millet": ("小米", "小米粥", "xiaomi"),
+    "corn": ("玉米", "甜玉米", "苞米", "棒子", "yumi"),
+    "sweet potato": ("红薯", "地瓜", "番薯", "甘薯", "白薯", "山芋", "hongshu", "digua"),
+    "purple sweet potato": ("紫薯", "zishu"),
+    "potato": ("土豆", "马铃薯", "洋芋", "tudou"),
+    "taro": ("芋头", "芋艿", "yutou"),
+    "yam": ("山药", "淮山", "shanyao"),
+    "pumpkin": ("南瓜", "nangua"),
+    "whole wheat bread": ("全麦面包", "quanmaimianbao"),
+    "bread": ("面包", "吐司", "mianbao"),
+    "noodles": ("面条", "挂面", "面", "miantiao"),
+    "buckwheat noodles": ("荞麦面", "qiaomaimian"),
+    "rice noodles": ("米粉", "米线", "河粉", "mifen", "mixian"),
+    "steamed bun": ("馒头", "mantou"),
+    "dumplings": ("饺子", "水饺", "jiaozi"),
+    "rice porridge": ("白粥", "稀饭", "大米粥", "baizhou", "xifan"),
+    "glutinous rice": ("糯米", "江米", "nuomi"),
+    "spaghetti": ("意面", "意大利面", "yimian"),
+    "beef noodle soup": ("牛肉面", "牛肉拉面", "niuroumian"),
+    "fried rice": ("炒饭", "蛋炒饭", "chaofan"),
+
+    # --- 肉蛋水产 ---
+    "egg": ("鸡蛋", "蛋", "鸡子", "jidan"),
+    "boiled egg": ("水煮蛋", "煮鸡蛋", "白煮蛋", "shuizhudan"),
+    "egg white": ("蛋白", "蛋清", "鸡蛋白", "danbai"),
+    "scrambled eggs with tomato": ("西红柿炒鸡蛋", "西红柿炒蛋", "番茄炒蛋", "番茄炒鸡蛋"),
+    "chicken breast": ("鸡胸肉", "鸡胸", "鸡脯肉", "jixiongrou"),
+    "chicken thigh": ("鸡腿肉", "鸡腿", "jituirou"),
+    "chicken": ("鸡肉", "jirou"),
+    "duck": ("鸭肉", "鸭子", "yarou"),
+    "lean beef": ("瘦牛肉", "牛里脊", "shouniurou"),
+    "beef": ("牛肉", "niurou"),
+    "beef brisket": ("牛腩", "niunan"),
+    "lean pork": ("瘦猪肉", "猪瘦肉", "里脊肉", "猪里脊", "shourou"),
+    "pork": ("猪肉", "zhurou"),
+    "pork belly": ("五花肉", "wuhuarou"),
+    "lamb": ("羊肉", "yangrou"),
+    "salmon": ("三文鱼", "鲑鱼", "sanwenyu"),
+    "cod": ("鳕鱼", "xueyu"),
+    "tuna": ("金枪鱼", "吞拿鱼", "jinqiangyu"),
+    "sea bass": ("鲈鱼", "luyu"),
+    "tilapia": ("罗非鱼", "luofeiyu"),
+    "crucian carp": ("鲫鱼", "jiyu"),
+    "grass carp": ("草鱼", "caoyu"),
+    "shrimp": ("虾", "虾仁", "大虾", "基围虾", "鲜虾", "xia", "xiaren"),
+    "crab": ("螃蟹", "蟹", "pangxie"),
+    "squid": ("鱿鱼", "youyu"),
+    "clams": ("蛤蜊", "花甲", "geli", "huajia"),
+    "scallops": ("扇贝", "带子", "shanbei"),
+    "oysters": ("生蚝", "牡蛎", "shenghao"),
+
+    # --- 豆类 / 豆制品 / 奶类 ---
+    "firm tofu": ("北豆腐", "老豆腐", "beidoufu"),
+    "soft tofu": ("南豆腐", "嫩豆腐", "nendoufu"),
+    "tofu": ("豆腐", "doufu"),
+    "dried tofu": ("豆腐干", "豆干", "香干", "dougan"),
+    "tempeh": ("天贝", "丹贝", "印尼豆豉", "tianbei"),
+    "soy milk": ("豆浆", "无糖豆浆", "doujiang"),
+    "edamame": ("毛豆", "maodou"),
+    "soybeans": ("黄豆", "大豆", "huangdou"),
+    "chickpeas": ("鹰嘴豆", "yingzuidou"),
+    "lentils": ("小扁豆", "兵豆", "扁豆", "biandou"),
+    "black beans": ("黑豆", "heidou"),
+    "mung beans": ("绿豆", "lvdou"),
+    "red beans": ("红豆", "赤小豆", "hongdou"),
+    "skim milk": ("脱脂牛奶", "脱脂奶", "tuozhiniunai"),
+    "milk": ("牛奶", "纯牛奶", "牛乳", "niunai"),
+    "plain low-fat yogurt": ("低脂酸奶", "dizhisuannai"),
+    "greek yogurt": ("希腊酸奶", "xilasuannai"),
+    "yogurt": ("酸奶", "无糖酸奶", "酸牛奶", "suannai"),
+    "cheese": ("奶酪", "芝士", "干酪", "nailao", "zhishi"),
+
+    # --- 蔬菜 ---
+    "broccoli": ("西兰花", "西蓝花", "绿菜花", "xilanhua"),
+    "cauliflower": ("花菜", "菜花", "花椰菜", "caihua"),
+    "spinach": ("菠菜", "bocai"),
+    "bok choy": ("小白菜", "青菜", "上海青", "小油菜", "qingcai"),
+    "napa cabbage": ("大白菜", "白菜", "baicai"),
+    "cabbage": ("卷心菜", "包菜", "圆白菜", "甘蓝", "baocai"),
+    "lettuce": ("生菜", "莴苣叶", "shengcai"),
+    "romaine lettuce": ("罗马生菜", "luomashengcai"),
+    "celery": ("芹菜", "西芹", "qincai"),
+    "cucumber": ("黄瓜", "青瓜", "huanggua"),
+    "tomato": ("番茄", "西红柿", "fanqie", "xihongshi"),
+    "cherry tomatoes": ("圣女果", "小番茄", "樱桃番茄", "shengnvguo"),
+    "carrot": ("胡萝卜", "huluobo"),
+    "white radish": ("白萝卜", "萝卜", "bailuobo"),
+    "eggplant": ("茄子", "qiezi"),
+    "zucchini": ("西葫芦", "xihulu"),
+    "bitter melon": ("苦瓜", "kugua"),
+    "winter melon": ("冬瓜", "donggua"),
+    "loofah": ("丝瓜", "sigua"),
+    "green beans": ("四季豆", "豆角", "芸豆", "sijidou"),
+    "snow peas": ("荷兰豆", "helandou"),
+    "asparagus": ("芦笋", "lusun"),
+    "bean sprouts": ("豆芽", "绿豆芽", "黄豆芽", "douya"),
+    "lotus root": ("莲藕", "藕", "lianou"),
+    "bamboo shoots": ("竹笋", "笋", "zhusun"),
+    "onion": ("洋葱", "yangcong"),
+    "green onion": ("葱", "小葱", "大葱", "香葱", "cong"),
+    "garlic": ("大蒜", "蒜", "蒜头", "蒜泥", "dasuan"),
+    "ginger": ("生姜", "姜", "shengjiang"),
+    "bell pepper": ("彩椒", "甜椒", "青椒", "柿子椒", "caijiao", "qingjiao"),
+    "chili pepper": ("辣椒", "小米辣", "尖椒", "鲜椒", "lajiao"),
+    "shiitake mushrooms": ("香菇", "冬菇", "xianggu"),
+    "enoki mushrooms": ("金针菇", "jinzhengu"),
+    "king oyster mushroom": ("杏鲍菇", "xingbaogu"),
+    "mushrooms": ("蘑菇", "口蘑", "菌菇", "mogu"),
+    "wood ear mushroom": ("木耳", "黑木耳", "muer"),
+    "kelp": ("海带", "昆布", "haidai"),
+    "seaweed": ("紫菜", "海苔", "zicai"),
+    "kale": ("羽衣甘蓝", "yuyiganlan"),
+    "okra": ("秋葵", "qiukui"),
+    "cilantro": ("香菜", "芫荽", "xiangcai"),
+
+    # --- 水果 ---
+    "apple": ("苹果", "pingguo"),
+    "banana": ("香蕉", "xiangjiao"),
+    "orange": ("橙子", "橙", "橘子", "chengzi"),
+    "pear": ("梨", "雪梨", "li"),
+    "grapes": ("葡萄", "putao"),
+    "strawberries": ("草莓", "caomei"),
+    "blueberries": ("蓝莓", "lanmei"),
+    "kiwi": ("猕猴桃", "奇异果", "mihoutao"),
+    "watermelon": ("西瓜", "xigua"),
+    "mango": ("芒果", "mangguo"),
+    "pineapple": ("菠萝", "凤梨", "boluo"),
+    "papaya": ("木瓜", "mugua"),
+    "grapefruit": ("西柚", "柚子", "xiyou"),
+    "dragon fruit": ("火龙果", "huolongguo"),
+    "lemon juice": ("柠檬汁", "ningmengzhi"),
+    "lemon": ("柠檬", "ningmeng"),
+    "avocado": ("牛油果", "鳄梨", "niuyouguo"),
+    "dates": ("红枣", "枣", "hongzao"),
+
+    # --- 坚果 / 油脂 / 调味 ---
+    "walnuts": ("核桃", "核桃仁", "hetao"),
+    "almonds": ("杏仁", "巴旦木", "xingren"),
+    "peanuts": ("花生", "花生米", "huasheng"),
+    "cashews": ("腰果", "yaoguo"),
+    "pistachios": ("开心果", "kaixinguo"),
+    "chia seeds": ("奇亚籽", "qiyazi"),
+    "sesame seeds": ("芝麻", "zhima"),
+    "peanut butter": ("花生酱", "huashengjiang"),
+    "olive oil": ("橄榄油", "ganlanyou"),
+    "vegetable oil": ("植物油", "食用油", "菜籽油", "zhiwuyou"),
+    "sesame oil": ("香油", "芝麻油", "xiangyou"),
+    "chili oil": ("红油", "辣椒油", "hongyou"),
+    "coconut milk": ("椰浆", "椰奶", "yejiang"),
+    "soy sauce": ("酱油", "生抽", "jiangyou"),
+    "vinegar": ("醋", "陈醋", "香醋", "cu"),
+    "miso": ("味噌", "weizeng"),
+    "fish sauce": ("鱼露", "yulu"),
+    "honey": ("蜂蜜", "fengmi"),
+    "lemongrass": ("香茅", "柠檬草", "xiangmao"),
+    "sichuan peppercorn": ("花椒", "huajiao"),
+    "cumin": ("孜然", "ziran"),
+}
+
+# 中文烹饪方式前缀 -> 英文 (用于 "清蒸鲈鱼" / "烤红薯" 这类组合词)
+COOKING_PREFIXES = {
+    "清蒸": "steamed", "蒸": "steamed",
+    "水煮": "boiled", "白灼": "boiled", "煮": "boiled", "焯": "boiled",
+    "烤": "baked", "烘": "baked", "焗": "baked",
+    "香煎": "pan-fried", "煎": "pan-fried",
+    "清炒": "stir-fried", "小炒": "stir-fried", "炒": "stir-fried",
+    "油炸": "fried", "炸": "fried",
+    "红烧": "braised", "卤": "braised", "炖": "stewed", "焖": "stewed",
+    "凉拌": "raw", "生": "raw",
+}
+
+# 不改变食物本身的前置修饰 (切法 / 处理方式)
+MODIFIER_PREFIXES = ("新鲜", "鲜", "去皮", "带皮", "去骨", "切片", "切块", "切丝", "手撕")
+# 切法后缀 ("鸡胸肉丁" / "土豆丝" / "牛肉片")
+CUT_SUFFIXES = ("丁", "丝", "片", "块", "条", "末", "段", "粒", "碎")
+# 制品形态字：剩余部分含这些字时是另一种食物 (花生油 / 橙汁 / 番茄酱 / 面粉 / 牛肉干 / 蛋糕 / 鸡蛋面)
+FORM_CHARS = set("油汁酱粉干糕面")
+
+# 查询列表分隔符：英文/全角逗号、顿号、分号、换行
+SEPARATORS = re.compile(r"[,，、;；\n]+")
+_CJK = re.compile(r"[一-鿿]")
+_COOKED_WORDS = ("cooked", "boiled", "steamed", "baked", "fried", "roasted", "raw", "stewed", "braised")
+
+
+# ============================================================
+# 2. 反向索引
+# ============================================================
+# 单个拼音音节 (li / cu / xia / cong)：同音字太多，不作为别名
+_SYLLABLE = re.compile(r"^(zh|ch|sh|[bpmfdtnlgkhjqxrzcsyw])?"
+                       r"(iang|iong|uang|ang|eng|ing|ong|uan|ian|iao|uai|ai|ei|ao|ou|an|en|er|in|un"
+                       r"|ia|ie|iu|ua|uo|ui|ue|ve|a|o|e|i|u|v)$")
+
+
+def _build_index():
+    chinese, pinyin = {}, {}
+    for english, names in ALIASES.items():
+        for name in names:
+            if name.isascii() and _SYLLABLE.match(name):
+                continue
+            target = pinyin if name.isascii() else chinese
+            # 同一别名出现多次时以先出现的为准
+            target.setdefault(name.lower(), english)
+    return chinese, pinyin
+
+
+_CHINESE_INDEX, _PINYIN_INDEX = _build_index()
+_MAX_ALIAS_LEN = max(len(k) for k in _CHINESE_INDEX)
+
+
+def split_queries(query: str):
+    """拆分食物列表，兼容全角逗号 / 顿号 / 分号"""
+    text = unicodedata.normalize("NFKC", query or "")
+    return [part.strip() for part in SEPARATORS.split(text) if part.strip()]
+
+
+def contains_chinese(text: str) -> bool:
+    return bool(_CJK.search(text or ""))
+
+
+def _strip_prefix(prefix: str):
+    """前缀必须完全由修饰语和烹饪方式组成，返回烹饪方式 (可能为空串)；含其他字时返回 None"""
+    method = ""
+    while prefix:
+        word = next((p for p in MODIFIER_PREFIXES if prefix.startswith(p)), None)
+        if word is None:
+            word = next((p for p in COOKING_PREFIXES if prefix.startswith(p)), None)
+            if word is None:
+                return None
+            method = COOKING_PREFIXES[word]
+        prefix = prefix[len(word):]
+    return method
+
+
+def resolve_alias(query: str):
+    """
+    把中文 / 拼音食材名解析为英文名；无法识别时返回 None。
+    中文按最长别名匹配，剩余部分只允许是烹饪方式 / 修饰前缀和切法后缀
+    (例如 "清蒸鲈鱼" -> "steamed sea bass")；剩余部分含其他名词或制品形态字
+    (花生油、橙汁、蛋糕) 时不做猜测，返回 None。拼音只做整词匹配。
+    """
+    text = unicodedata.normalize("NFKC", query or "").strip().lower()
+    if not text:
+        return None
+
+    if not contains_chinese(text):
+        return _PINYIN_INDEX.get(re.sub(r"[\s'-]+", "", text))
+
+    compact = re.sub(r"\s+", "", text)
+    if compact in _CHINESE_INDEX:
+        return _CHINESE_INDEX[compact]
+
+    # 最长子串匹配：剩余部分必须是已知的前缀 / 后缀
+    for length in range(min(_MAX_ALIAS_LEN, len(compact)), 0, -1):
+        for start in range(len(compact) - length + 1):
+            english = _CHINESE_INDEX.get(compact[start:start + length])
+            if english is None:
+                continue
+            prefix, suffix = compact[:start], compact[start + length:]
+            if FORM_CHARS & set(prefix + suffix):
+                return None
+            if suffix and suffix not in CUT_SUFFIXES:
+                continue
+            method = _strip_prefix(prefix)
+            if method is None:
+                continue
+            if method and not english.startswith(_COOKED_WORDS):
+                return f"{method} {english}"
+            return english
+    return None
@@ -0,0 +1,421 @@
+import bisect
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# 环境变量：INSTRUMENTATION=off 关闭埋点，TRACE_FILE=span 导出文件 (空字符串不导出)，METRICS_PORT=Prometheus 端口 (0 不启动)
+ENV_ENABLED = "INSTRUMENTATION"
+ENV_TRACE_FILE = "TRACE_FILE"
+ENV_METRICS_PORT = "METRICS_PORT"
+
+_enabled = os.getenv(ENV_ENABLED, "on").strip().lower() not in ("0", "off", "false", "no")
+
+
+def _new_id(bits: int = 64) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+# ============================================================
+# 1. Span
+# ============================================================
+class Span:
+    """
+    一段计时区间。category 用于汇总：
+    trace (一次食谱生成) / task / llm / tool / lookup (单个食材查询) / upstream (FatSecret 请求)
+    """
+
+    __slots__ = ("name", "category", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, category: str, trace_id: str, parent_id: str, attributes: dict):
+        self.name = name
+        self.category = category
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        """秒；未结束时按当前时间计算"""
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+    def to_otel(self) -> dict:
+        """OTLP/JSON 的 span 结构 (每行一个 span，可直接转交 OpenTelemetry Collector 的 file receiver 处理)"""
+        attributes = dict(self.attributes, **{"span.category": self.category})
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": "SPAN_KIND_CLIENT" if self.category in ("llm", "upstream") else "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [{"key": k, "value": _otel_value(v)} for k, v in attributes.items()],
+            "status": {"code": "STATUS_CODE_ERROR", "message": self.error} if self.error
+            else {"code": "STATUS_CODE_OK"},
+        }
+
+
+def _otel_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class _NullSpan:
+    """关闭埋点时使用，调用方不需要判断"""
+
+    def set(self, **attributes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """一次运行内结束的全部 span (按结束顺序)"""
+
+    def __init__(self):
+        self.trace_id = _new_id(128)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+
+# ============================================================
+# 2. 埋点接口 (contextvars 传递父 span，新线程需复制上下文)
+# ============================================================
+_current_span = contextvars.ContextVar("span", default=None)
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextmanager
+def span(name: str, category: str = "internal", **attributes):
+    if not _enabled:
+        yield _NULL_SPAN
+        return
+    parent = _current_span.get()
+    trace = _current_trace.get()
+    trace_id = trace.trace_id if trace else (parent.trace_id if parent else _new_id(128))
+    current = Span(name, category, trace_id, parent.span_id if parent else "", attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.time_ns()
+        _current_span.reset(token)
+        metrics.observe(current)
+        if trace is not None:
+            trace.add(current)
+
+
+def traced(name: str, category: str = "internal"):
+    """把整个函数调用记为一个 span"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name: str, category: str, start_ns: int, end_ns: int, **attributes):
+    """补记一段已经结束的区间 (例如在别的线程里完成、由当前调用方等待的工作)，挂在当前 span 下"""
+    if not _enabled:
+        return
+    parent = _current_span.get()
+    trace = _current_trace.get()
+    trace_id = trace.trace_id if trace else (parent.trace_id if parent else _new_id(128))
+    current = Span(name, category, trace_id, parent.span_id if parent else "", attributes)
+    current.start, current.end = start_ns, max(start_ns, end_ns)
+    metrics.observe(current)
+    if trace is not None:
+        trace.add(current)
+
+
+def annotate(**attributes):
+    """给当前 span 补充属性 (不在任何 span 内时忽略)"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """一次完整运行的根 span；结束后整体导出到 TRACE_FILE"""
+    current = Trace()
+    token = _current_trace.set(current)
+    try:
+        with span(name, "trace", **attributes):
+            yield current
+    finally:
+        _current_trace.reset(token)
+        export(current)
+
+
+_export_lock = threading.Lock()
+
+
+def export(current: Trace, path: str = None):
+    path = os.getenv(ENV_TRACE_FILE, "spans.jsonl") if path is None else path
+    if not path or not current.spans:
+        return
+    lines = "".join(json.dumps(s.to_otel(), ensure_ascii=False, default=str) + "\n" for s in current.spans)
+    try:
+        with _export_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+    except OSError as e:
+        print(f"Trace Export Error: {e}")
+
+
+# ============================================================
+# 3. 进程级指标 (Prometheus 文本格式)
+# ============================================================
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}" if labels else ""
+
+
+class Metrics:
+    """span 结束时累加：耗时直方图 (按类别与名称)、LLM token、食材查询命中层级、上游重试"""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+    HELP = {
+        "nutrition_span_seconds": ("histogram", "Duration of instrumented spans"),
+        "nutrition_span_errors_total": ("counter", "Spans that ended with an exception"),
+        "nutrition_llm_tokens_total": ("counter", "LLM tokens by model, agent and direction"),
+        "nutrition_lookups_total": ("counter", "Nutrient lookups by the tier that answered them"),
+        "nutrition_upstream_retries_total": ("counter", "FatSecret request retries"),
+        "nutrition_lookup_requests_total": ("counter", "Nutrient lookups submitted to the batching dispatcher"),
+        "nutrition_lookup_coalesced_total": ("counter", "Lookups answered by another caller's identical lookup"),
+        "nutrition_lookup_batch_size": ("histogram", "Distinct lookups resolved per dispatcher window"),
+        "nutrition_lookup_upstream_batch_size": ("histogram", "Upstream fetches issued per dispatcher window"),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (metric, labels) -> [各桶计数..., +Inf 计数, 总和]
+        self._counters = {}    # (metric, labels) -> 值
+        self._buckets = {}     # metric -> 非默认的桶边界
+
+    def _observe(self, metric, labels, value, buckets=None):
+        buckets = buckets or self.BUCKETS
+        with self._lock:
+            if buckets is not self.BUCKETS:
+                self._buckets[metric] = buckets
+            row = self._histograms.setdefault((metric, labels), [0] * (len(buckets) + 1) + [0.0])
+            row[bisect.bisect_left(buckets, value)] += 1
+            row[-1] += value
+
+    def _incr(self, metric, labels, value=1):
+        if not value:
+            return
+        with self._lock:
+            self._counters[(metric, labels)] = self._counters.get((metric, labels), 0) + value
+
+    def histogram(self, metric: str, value: float, labels=(), buckets=None):
+        self._observe(metric, tuple(labels), value, buckets)
+
+    def count(self, metric: str, value=1, labels=()):
+        self._incr(metric, tuple(labels), value)
+
+    def observe(self, span: Span):
+        labels = (("category", span.category), ("name", span.name))
+        self._observe("nutrition_span_seconds", labels, span.duration)
+        if span.error:
+            self._incr("nutrition_span_errors_total", labels)
+        attrs = span.attributes
+        if span.category == "llm":
+            base = (("model", attrs.get("llm_model", "")), ("agent", attrs.get("agent_role", "")))
+            self._incr("nutrition_llm_tokens_total", base + (("type", "prompt"),), attrs.get("prompt_tokens", 0))
+            self._incr("nutrition_llm_tokens_total", base + (("type", "completion"),),
+                       attrs.get("completion_tokens", 0))
+        elif span.category in ("lookup", "request"):
+            self._incr("nutrition_lookups_total", (("tier", attrs.get("cache_tier", "none")),))
+        elif span.category == "upstream":
+            self._incr("nutrition_upstream_retries_total", (), attrs.get("retries", 0))
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+            bucket_overrides = dict(self._buckets)
+        lines = []
+        for metric, (kind, help_text) in self.HELP.items():
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            if kind == "histogram":
+                for (name, labels), row in sorted(histograms.items()):
+                    if name != metric:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(bucket_overrides.get(metric, self.BUCKETS) + ("+Inf",), row[:-1]):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{metric}_sum{_labels(labels)} {row[-1]:.6f}")
+                    lines.append(f"{metric}_count{_labels(labels)} {cumulative}")
+            else:
+                for (name, labels), value in sorted(counters.items()):
+                    if name == metric:
+                        lines.append(f"{metric}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if urlparse(self.path).path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port: int = None, host: str = "0.0.0.0"):
+    """在后台线程提供 /metrics (进程内只启动一次)；port 为空时读 METRICS_PORT，为 0 时不启动"""
+    global _server
+    port = int(os.getenv(ENV_METRICS_PORT, "9464") or 0) if port is None else port
+    with _server_lock:
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"Metrics Server Error: {e}")
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        print(f"[Metrics] serving http://{host}:{port}/metrics")
+        return _server
+
+
+# ============================================================
+# 4. 单次运行的耗时分布
+# ============================================================
+TIERS = ("memory", "sqlite", "near", "local", "upstream")
+
+
+def summarize(spans) -> dict:
+    """按任务汇总 LLM / 工具耗时与 token，以及食材查询的命中层级 (结果可 JSON 序列化，随任务结果保存)"""
+    by_id = {s.span_id: s for s in spans}
+
+    def owner(s):
+        parent = by_id.get(s.parent_id)
+        while parent is not None and parent.category != "task":
+            parent = by_id.get(parent.parent_id)
+        return parent
+
+    rows = {}
+    for s in sorted((s for s in spans if s.category == "task"), key=lambda s: s.start):
+        rows[s.span_id] = {
+            "task": s.attributes.get("task_name") or s.name, "agent": s.attributes.get("agent_role", ""),
+            "seconds": s.duration, "checkpoint": bool(s.attributes.get("checkpoint")),
+            "llm_calls": 0, "llm_s": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            "tool_calls": 0, "tool_s": 0.0, "lookups": 0,
+        }
+    tiers = {}
+    upstream = []
+    retries = 0
+    for s in spans:
+        # 经过微批调度的查询由调用方补记为 request span (实际解析在调度线程，不属于本次运行)
+        if s.category in ("lookup", "request"):
+            tier = s.attributes.get("cache_tier", "none")
+            tiers[tier] = tiers.get(tier, 0) + 1
+        elif s.category == "upstream":
+            upstream.append(s.duration)
+            retries += s.attributes.get("retries", 0)
+        task = owner(s)
+        row = rows.get(task.span_id) if task is not None else None
+        if row is None:
+            continue
+        if s.category == "llm":
+            row["llm_calls"] += 1
+            row["llm_s"] += s.duration
+            row["prompt_tokens"] += s.attributes.get("prompt_tokens", 0)
+            row["completion_tokens"] += s.attributes.get("completion_tokens", 0)
+        elif s.category == "tool":
+            row["tool_calls"] += 1
+            row["tool_s"] += s.duration
+        elif s.category in ("lookup", "request"):
+            row["lookups"] += 1
+
+    root = next((s for s in spans if s.category == "trace"), None)
+    for row in rows.values():
+        for key in ("seconds", "llm_s", "tool_s"):
+            row[key] = round(row[key], 3)
+    return {
+        "total_s": round(root.duration, 3) if root else None,
+        "tasks": list(rows.values()),
+        "lookups": {
+            "tiers": tiers,
+            "upstream_calls": len(upstream),
+            "upstream_s": round(sum(upstream), 3),
+            "upstream_max_s": round(max(upstream), 3) if upstream else 0.0,
+            "retries": retries,
+        },
+    }
+
+
+def render_summary(summary: dict) -> str:
+    """Markdown：每个任务的时间花在 LLM / 工具 / 其他 (Agent 框架开销、检查点读写) 上的比例"""
+    lines = [
+        "| 任务 | Agent | 耗时 (s) | LLM 调用 | LLM 耗时 (s) | 输入 / 输出 tokens | 工具调用 | 工具耗时 (s) | 其他 (s) |",
+        "|---|---|---|---|---|---|---|---|---|",
+    ]
+    for row in summary["tasks"]:
+        if row["checkpoint"]:
+            lines.append(f"| {row['task']} | {row['agent']} | 检查点复用 | - | - | - | - | - | - |")
+            continue
+        other = max(0.0, row["seconds"] - row["llm_s"] - row["tool_s"])
+        lines.append(f"| {row['task']} | {row['agent']} | {row['seconds']:.2f} | {row['llm_calls']} | "
+                     f"{row['llm_s']:.2f} | {row['prompt_tokens']} / {row['completion_tokens']} | "
+                     f"{row['tool_calls']} | {row['tool_s']:.2f} | {other:.2f} |")
+    if summary.get("total_s") is not None:
+        lines.append(f"\n**总耗时**：{summary['total_s']:.2f}s")
+    lookups = summary["lookups"]
+    tiers = lookups["tiers"]
+    if tiers:
+        names = {"memory": "内存", "sqlite": "SQLite", "near": "近似复用", "local": "本地库", "upstream": "联网"}
+        parts = [f"{names.get(t, t)} {tiers[t]}" for t in TIERS if t in tiers]
+        parts += [f"{t} {n}" for t, n in tiers.items() if t not in TIERS]
+        lines.append(f"\n**食材查询**：{' · '.join(parts)}；FatSecret 请求 {lookups['upstream_calls']} 次，"
+                     f"累计 {lookups['upstream_s']:.2f}s (最长 {lookups['upstream_max_s']:.2f}s)，重试 {lookups['retries']} 次")
+    return "\n".join(lines)
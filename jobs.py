@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable
+from resources import lazy_import, singleton
+from run_logs import RunLog, capture
+from token_stream import TokenStream, streaming
+
+# 环境变量：JOB_WORKERS=并发运行的 Crew 数，JOB_MAX_PER_USER=每个用户同时排队/运行的任务数，JOB_MAX_QUEUED=全局排队上限
+ENV_WORKERS = "JOB_WORKERS"
+ENV_MAX_PER_USER = "JOB_MAX_PER_USER"
+ENV_MAX_QUEUED = "JOB_MAX_QUEUED"
+
+STATUSES = ("queued", "running", "done", "failed")
+# 已结束的任务保留时长 (秒)
+RETENTION = 7 * 24 * 3600
+
+
+class JobRejected(RuntimeError):
+    """准入失败：该用户已有未完成的任务，或全局队列已满"""
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# ============================================================
+# 任务队列 (SQLite WAL 持久化 + 有界工作线程池)
+# ============================================================
+class JobQueue:
+    """
+    - 任务表持久化状态 (queued / running / done / failed)、参数、结果与最终日志，
+      页面刷新或断线重连后按 job_id 继续查看
+    - 固定数量的工作线程按提交顺序执行，同时运行的 Crew 数有上限
+    - 准入控制：每个用户未完成的任务数、全局排队数超限时直接拒绝 (背压)，而不是无限堆积
+    - 启动时接管所属进程已退出的未完成任务 (配合任务检查点，重跑只补算未完成的阶段)
+    """
+
+    def __init__(self, runner: Callable[[dict], dict], db_path: str = "jobs.db", workers: int = None,
+                 max_per_user: int = None, max_queued: int = None, busy_timeout_ms: int = 5000):
+        self.runner = runner
+        self.db_path = db_path
+        self.workers = workers or int(os.getenv(ENV_WORKERS, "2"))
+        self.max_per_user = max_per_user or int(os.getenv(ENV_MAX_PER_USER, "1"))
+        self.max_queued = max_queued or int(os.getenv(ENV_MAX_QUEUED, "16"))
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._admit_lock = threading.Lock()
+        # job_id -> 运行中的 RunLog (结束后日志写入任务表) / 最终文档的流式输出
+        self._live = {}
+        self._streams = {}
+        self._init_schema()
+        self._recover()
+        self._threads = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " user TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " owner INTEGER,"
+            " payload TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " log TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_user_status ON jobs (user, status)")
+        conn.execute("DELETE FROM jobs WHERE finished_at < ?", (time.time() - RETENTION,))
+
+    def _recover(self):
+        rows = self._connect().execute(
+            "SELECT id, owner FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+        for row in rows:
+            owner = row["owner"]
+            if owner is None or owner == os.getpid() or not _process_alive(owner):
+                self._connect().execute("UPDATE jobs SET status = 'queued', owner = ? WHERE id = ?",
+                                        (os.getpid(), row["id"]))
+                self._pending.append(row["id"])
+        if self._pending:
+            print(f"[Jobs] recovered {len(self._pending)} unfinished jobs")
+
+    # ------------------------------------------------------------
+    # 提交 / 查询
+    # ------------------------------------------------------------
+    def submit(self, user: str, payload: dict) -> str:
+        """准入检查通过后入队，返回 job_id；否则抛出 JobRejected"""
+        with self._admit_lock:
+            active = self._connect().execute(
+                "SELECT COUNT(*) FROM jobs WHERE user = ? AND status IN ('queued', 'running')", (user,)
+            ).fetchone()[0]
+            if active >= self.max_per_user:
+                raise JobRejected(f"已有 {active} 个任务在排队或运行，请等待完成后再提交")
+            with self._cond:
+                if len(self._pending) >= self.max_queued:
+                    raise JobRejected(f"当前排队任务已满 ({self.max_queued})，请稍后再试")
+                job_id = uuid.uuid4().hex
+                self._connect().execute(
+                    "INSERT INTO jobs (id, user, status, owner, payload, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                    (job_id, user, os.getpid(), json.dumps(payload, ensure_ascii=False), time.time())
+                )
+                self._pending.append(job_id)
+                self._cond.notify()
+        return job_id
+
+    def get(self, job_id: str):
+        """返回任务记录 (dict，payload / result 已解析)；不存在时返回 None"""
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def position(self, job_id: str) -> int:
+        """排队位置 (0 表示下一个执行)；不在本进程队列中时返回 -1"""
+        with self._cond:
+            try:
+                return list(self._pending).index(job_id)
+            except ValueError:
+                return -1
+
+    def log(self, job_id: str):
+        """运行中返回实时 RunLog，已结束返回保存的日志文本"""
+        run_log = self._live.get(job_id)
+        if run_log is not None:
+            return run_log
+        row = self._connect().execute("SELECT log FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["log"] if row else None
+
+    def stream(self, job_id: str):
+        """运行中的 TokenStream；未开始或已结束时返回 None"""
+        return self._streams.get(job_id)
+
+    def stats(self) -> dict:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {row[0]: row[1] for row in rows}
+        return {status: counts.get(status, 0) for status in STATUSES}
+
+    # ------------------------------------------------------------
+    # 工作线程
+    # ------------------------------------------------------------
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job_id = self._pending.popleft()
+            self._run(job_id)
+
+    def _run(self, job_id: str):
+        job = self.get(job_id)
+        if job is None:
+            return
+        run_log = self._live[job_id] = RunLog()
+        stream = self._streams[job_id] = TokenStream()
+        self._connect().execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                                (time.time(), job_id))
+        status, result, error = "done", None, None
+        with capture(run_log), streaming(stream):
+            try:
+                result = self.runner(job["payload"])
+            except Exception as e:
+                print(f"Job Error: {e}")
+                status, error = "failed", str(e)
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, log = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+             run_log.text(), time.time(), job_id)
+        )
+        self._live.pop(job_id, None)
+        self._streams.pop(job_id, None)
+
+
+def _run_nutrition_job(payload: dict) -> dict:
+    return lazy_import("recipe_design").run_nutrition_job(payload)
+
+
+def get_job_queue() -> JobQueue:
+    """进程内共享的食谱生成任务队列 (首次使用时启动工作线程)"""
+    return singleton("jobs", lambda: JobQueue(_run_nutrition_job))
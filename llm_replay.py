@@ -0,0 +1,409 @@
+import contextvars
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any
+from crewai.llms.base_llm import BaseLLM
+from crewai.utilities.llm_utils import create_llm
+from crewai.utilities.token_counter_callback import CustomLogger
+from instrumentation import annotate, span
+
+MODES = ("passthrough", "record", "replay")
+
+# 环境变量：LLM_REPLAY_MODE=passthrough|record|replay，LLM_REPLAY_DB=文件路径，LLM_REPLAY_LATENCY=秒
+ENV_MODE = "LLM_REPLAY_MODE"
+ENV_DB = "LLM_REPLAY_DB"
+ENV_LATENCY = "LLM_REPLAY_LATENCY"
+
+
+class LLMReplayMiss(RuntimeError):
+    """回放模式下找不到对应的录制结果"""
+
+
+# ============================================================
+# 0. 按任务统计 token 用量
+# ============================================================
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+# task.id -> {"calls", "prompt_tokens", "completion_tokens", "estimated"}
+_task_usage = {}
+_task_usage_lock = threading.Lock()
+
+
+# 已被调用方放弃的调用 (例如路由超时后回退到其他档位)：之后结束时不计入 token 用量
+_abandoned = contextvars.ContextVar("llm_abandoned", default=None)
+
+
+def abandon_on(cancelled: threading.Event):
+    """在当前上下文内 (为一次可放弃的调用复制的上下文) 登记取消标志"""
+    _abandoned.set(cancelled)
+
+
+def _counted() -> bool:
+    cancelled = _abandoned.get()
+    return cancelled is None or not cancelled.is_set()
+
+
+# 本次调用使用的停止词：由调用方 (例如路由) 按调用指定，不写到进程内共享的 LLM 对象上
+_call_stop = contextvars.ContextVar("llm_call_stop", default=None)
+# 本次调用的请求超时 (秒)：被放弃的调用最迟在这之后结束，不会一直占用调用方的线程
+_call_timeout = contextvars.ContextVar("llm_call_timeout", default=None)
+# 当前这一次真实调用的用量收集器 (见 _CallUsage)
+_call_usage = contextvars.ContextVar("llm_call_usage", default=None)
+# 当前上下文里最近一次调用计入的用量 (被放弃的调用为 None)
+_last_usage = contextvars.ContextVar("llm_last_usage", default=None)
+
+
+def use_stop_words(stop):
+    """在当前上下文内为接下来的 LLM 调用指定停止词"""
+    _call_stop.set(list(stop or []))
+
+
+def use_request_timeout(seconds):
+    """在当前上下文内为接下来的 LLM 调用指定请求超时 (只会缩短内层 LLM 自己的超时)"""
+    _call_timeout.set(seconds)
+
+
+def last_call_usage():
+    """当前上下文里最近一次 ReplayLLM 调用计入的用量 {"prompt_tokens", "completion_tokens", ...}"""
+    return _last_usage.get()
+
+
+def _usage_dict(usage) -> dict:
+    """litellm Usage 对象或各家接口的用量字典 -> 统一的字典"""
+    get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+    prompt = get("prompt_tokens") or get("input_tokens") or get("prompt_token_count") or 0
+    completion = get("completion_tokens") or get("output_tokens") or get("candidates_token_count") or 0
+    details = get("prompt_tokens_details")
+    cached = get("cached_prompt_tokens") or get("cached_tokens") or getattr(details, "cached_tokens", None) or 0
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion,
+            "cached_prompt_tokens": cached}
+
+
+class _CallUsage(CustomLogger):
+    """
+    一次调用自己的 token 用量。内层 LLM 是进程内共享的单例，并发调用的用量会混在它的累计值里，
+    所以不能用前后差值：litellm 路径通过 callbacks 回报，原生接口路径通过 _track_token_usage_internal 回报
+    (两条路径可能各报一次同一份用量，取最后一次，不累加)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.usage = {}
+        self._thread = threading.get_ident()
+
+    def log_success_event(self, kwargs, response_obj, start_time, end_time):
+        # litellm 也会在自己的线程里用全局回调报告其他调用，只接收本线程 (即本次调用) 的回报
+        if threading.get_ident() != self._thread:
+            return
+        usage = response_obj.get("usage") if isinstance(response_obj, dict) else None
+        if usage:
+            self.report(usage)
+
+    def report(self, usage):
+        self.usage = _usage_dict(usage)
+
+
+def _report_call_usage(inner):
+    """让内层 LLM 的 _track_token_usage_internal 同时回报给当前调用的收集器 (每个对象只包装一次)"""
+    if getattr(inner, "_reports_call_usage", False):
+        return
+    track = inner._track_token_usage_internal
+
+    def track_and_report(usage_data):
+        track(usage_data)
+        collector = _call_usage.get()
+        if collector is not None:
+            collector.report(usage_data)
+
+    inner._track_token_usage_internal = track_and_report
+    inner._reports_call_usage = True
+
+
+def estimate_tokens(text: str) -> int:
+    """模型没有返回用量时的估算：中文约 1 字 1 token，其余约 4 字符 1 token"""
+    text = text or ""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _record_task_usage(task, usage: dict, messages, response):
+    prompt = usage.get("prompt_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    estimated = not prompt
+    if estimated:
+        prompt = estimate_tokens(json.dumps(_normalize_messages(messages), ensure_ascii=False))
+        completion = estimate_tokens(str(response))
+    annotate(prompt_tokens=prompt, completion_tokens=completion, tokens_estimated=estimated)
+    _last_usage.set({"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion,
+                     "cached_prompt_tokens": usage.get("cached_prompt_tokens") or 0})
+    if task is None:
+        return
+    with _task_usage_lock:
+        entry = _task_usage.setdefault(str(task.id), {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                                      "estimated": False})
+        entry["calls"] += 1
+        entry["prompt_tokens"] += prompt
+        entry["completion_tokens"] += completion
+        entry["estimated"] = entry["estimated"] or estimated
+
+
+def task_token_usage(task) -> dict:
+    with _task_usage_lock:
+        return dict(_task_usage.get(str(task.id), {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                                   "estimated": False}))
+
+
+def reset_task_usage(tasks):
+    """复用同一组 Task 处理新请求前清零，避免用量跨请求累加"""
+    with _task_usage_lock:
+        for task in tasks:
+            _task_usage.pop(str(task.id), None)
+
+
+def render_token_usage(tasks) -> str:
+    """每个任务的 LLM 调用次数与输入 / 输出 token，Markdown 表格 (带 * 的为估算值)"""
+    lines = ["| 任务 | LLM 调用 | 输入 tokens | 输出 tokens |", "|---|---|---|---|"]
+    total = [0, 0, 0]
+    for task in tasks:
+        usage = task_token_usage(task)
+        mark = "*" if usage["estimated"] else ""
+        name = task.agent.role if task.agent else (task.name or "task")
+        lines.append(f"| {name} | {usage['calls']} | {usage['prompt_tokens']}{mark} | {usage['completion_tokens']}{mark} |")
+        total = [total[0] + usage["calls"], total[1] + usage["prompt_tokens"], total[2] + usage["completion_tokens"]]
+    lines.append(f"| **合计** | {total[0]} | {total[1]} | {total[2]} |")
+    return "\n".join(lines)
+
+
+# ============================================================
+# 1. 请求指纹
+# ============================================================
+def _digest(payload) -> str:
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _normalize_messages(messages):
+    if isinstance(messages, str):
+        return [{"role": "user", "content": messages}]
+    return [{"role": m.get("role"), "content": m.get("content")} for m in messages]
+
+
+def request_keys(model: str, messages, tools=None, stop=None):
+    """
+    返回 (精确键, 轮次键)：
+    - 精确键：模型 + 完整消息 + 工具定义 + 停止词
+    - 轮次键：模型 + 前两条消息 (系统提示与任务) + 第几轮。
+      工具返回的文本可能随缓存状态变化 (例如 "[Cache]" 标记)，精确键失配时按轮次回放。
+    """
+    messages = _normalize_messages(messages)
+    tool_names = sorted(
+        (t.get("function", {}).get("name") or t.get("name") or "") if isinstance(t, dict) else str(t)
+        for t in (tools or [])
+    )
+    exact = _digest({"model": model, "messages": messages, "tools": tool_names, "stop": sorted(stop or [])})
+    turn = sum(1 for m in messages if m["role"] == "assistant")
+    by_turn = _digest({"model": model, "head": messages[:2], "turn": turn})
+    return exact, by_turn
+
+
+# ============================================================
+# 2. 录制存储 (SQLite + zlib 压缩)
+# ============================================================
+class LLMCallStore:
+    """请求指纹 -> 响应 (zlib 压缩的 JSON)，同时记录 token 用量，回放时原样计入"""
+
+    def __init__(self, db_path: str = "llm_replay.db", busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS calls ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " payload BLOB NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, *keys):
+        """按顺序尝试多个键，返回第一个命中的 {"response", "usage"}"""
+        for key in keys:
+            row = self._connect().execute("SELECT payload FROM calls WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+        return None
+
+    def put(self, keys, model: str, response, usage: dict):
+        payload = zlib.compress(json.dumps({"response": response, "usage": usage}, ensure_ascii=False,
+                                           default=str).encode("utf-8"), 9)
+        now = time.time()
+        self._connect().executemany(
+            "INSERT OR REPLACE INTO calls (key, model, payload, created_at) VALUES (?, ?, ?, ?)",
+            [(key, model, payload, now) for key in keys]
+        )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM calls").fetchone()[0]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path: str) -> LLMCallStore:
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = _stores[db_path] = LLMCallStore(db_path)
+        return store
+
+
+# ============================================================
+# 3. 录制 / 回放 LLM
+# ============================================================
+class ReplayLLM(BaseLLM):
+    """
+    包装任意 CrewAI 可用的 LLM (ChatOpenAI / crewai.LLM 等)：
+    - passthrough: 直接调用真实模型
+    - record:      调用真实模型，并把 请求指纹 -> 响应 写入存储 (包括每一轮工具调用)
+    - replay:      只从存储回放，可选模拟延迟；找不到时抛出 LLMReplayMiss
+    stream=True 时真实调用使用流式输出；回放时把录制的响应切块发出，同样产生 LLMStreamChunkEvent
+    """
+
+    # 回放时每个文本块的字符数
+    REPLAY_CHUNK_CHARS = 16
+
+    def __init__(self, llm: Any, mode: str = "passthrough", store: LLMCallStore = None, latency: float = 0.0,
+                 stream: bool = False):
+        inner = create_llm(llm)
+        super().__init__(model=inner.model, temperature=getattr(inner, "temperature", None))
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM replay mode: {mode!r} (expected one of {', '.join(MODES)})")
+        self.inner = inner
+        self.mode = mode
+        self.store = store
+        self.latency = latency
+        self.stream = stream
+        if stream and hasattr(inner, "stream"):
+            inner.stream = True
+        self.stats = {"live": 0, "recorded": 0, "replayed": 0, "replayed_by_turn": 0}
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None,
+             from_task=None, from_agent=None, response_model=None):
+        # ReAct 循环中每轮迭代调用一次 LLM，已有的助手消息数即当前是第几轮
+        agent = from_agent or getattr(from_task, "agent", None)
+        with span(f"llm {self.model}", "llm", llm_model=self.model, llm_mode=self.mode,
+                  task_name=getattr(from_task, "name", None) or "", agent_role=getattr(agent, "role", "") or "",
+                  iteration=sum(1 for m in _normalize_messages(messages) if m["role"] == "assistant")):
+            return self._call(messages, tools, callbacks, available_functions, from_task, from_agent, response_model)
+
+    def _call(self, messages, tools, callbacks, available_functions, from_task, from_agent, response_model):
+        _last_usage.set(None)
+        if self.mode == "passthrough":
+            return self._live_call(messages, tools, callbacks, available_functions, from_task, from_agent,
+                                   response_model)[0]
+
+        exact, by_turn = request_keys(self.model, messages, tools, self._stop_words())
+        if self.mode == "replay":
+            entry = self.store.get(exact)
+            if entry is None:
+                entry = self.store.get(by_turn)
+                if entry is None:
+                    raise LLMReplayMiss(f"No recorded LLM response for request {exact[:12]} (turn key {by_turn[:12]})")
+                self.stats["replayed_by_turn"] += 1
+            self.stats["replayed"] += 1
+            if self.stream and isinstance(entry["response"], str):
+                self._replay_stream(entry["response"], from_task, from_agent)
+            elif self.latency:
+                time.sleep(self.latency)
+            if _counted():
+                self._track_token_usage_internal(entry.get("usage") or {})
+                _record_task_usage(from_task, entry.get("usage") or {}, messages, entry["response"])
+            return entry["response"]
+
+        response, usage = self._live_call(messages, tools, callbacks, available_functions, from_task, from_agent,
+                                          response_model)
+        self.store.put((exact, by_turn), self.model, response, usage)
+        self.stats["recorded"] += 1
+        return response
+
+    def _replay_stream(self, response: str, from_task, from_agent):
+        """把录制的响应按块发出，模拟延迟平均分摊到每一块"""
+        pieces = [response[i:i + self.REPLAY_CHUNK_CHARS] for i in range(0, len(response), self.REPLAY_CHUNK_CHARS)]
+        for piece in pieces:
+            if not _counted():
+                return
+            if self.latency:
+                time.sleep(self.latency / len(pieces))
+            self._emit_stream_chunk_event(piece, from_task=from_task, from_agent=from_agent)
+
+    def _stop_words(self):
+        stop = _call_stop.get()
+        return self.stop if stop is None else stop
+
+    def _live_call(self, messages, tools, callbacks, available_functions, from_task, from_agent, response_model):
+        """调用真实模型，返回 (响应, 本次 token 用量)"""
+        # 内层 LLM 可能在构建后被替换 (例如基准测试换成脚本化 LLM)，每次调用前确认已接入用量回报
+        _report_call_usage(self.inner)
+        inner = self.inner
+        overrides = {}
+        stop = list(self._stop_words() or [])
+        if list(getattr(inner, "stop", None) or []) != stop:
+            overrides["stop"] = stop
+        timeout = _call_timeout.get()
+        if timeout and hasattr(inner, "timeout") and (not inner.timeout or inner.timeout > timeout):
+            overrides["timeout"] = timeout
+        if overrides:
+            # 按调用的参数用浅拷贝发起本次调用，不修改共享的内层 LLM
+            inner = copy.copy(inner)
+            for name, value in overrides.items():
+                setattr(inner, name, value)
+        collector = _CallUsage()
+        token = _call_usage.set(collector)
+        try:
+            response = inner.call(messages, tools=tools, callbacks=list(callbacks or []) + [collector],
+                                  available_functions=available_functions, from_task=from_task,
+                                  from_agent=from_agent, response_model=response_model)
+        finally:
+            _call_usage.reset(token)
+        usage = collector.usage
+        if _counted():
+            self._track_token_usage_internal(usage)
+            _record_task_usage(from_task, usage, messages, response)
+        self.stats["live"] += 1
+        return response, usage
+
+    def supports_function_calling(self) -> bool:
+        return self.inner.supports_function_calling()
+
+    def supports_stop_words(self) -> bool:
+        return self.inner.supports_stop_words()
+
+    def get_context_window_size(self) -> int:
+        return self.inner.get_context_window_size()
+
+
+def wrap_llm(llm: Any, mode: str = None, db_path: str = None, latency: float = None,
+             stream: bool = False) -> ReplayLLM:
+    """按参数或环境变量 (LLM_REPLAY_MODE / LLM_REPLAY_DB / LLM_REPLAY_LATENCY) 包装 LLM"""
+    mode = mode or os.getenv(ENV_MODE, "passthrough").strip().lower() or "passthrough"
+    db_path = db_path or os.getenv(ENV_DB, "llm_replay.db")
+    latency = float(os.getenv(ENV_LATENCY, "0") or 0) if latency is None else latency
+    store = get_store(db_path) if mode != "passthrough" else None
+    return ReplayLLM(llm, mode=mode, store=store, latency=latency, stream=stream)
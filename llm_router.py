@@ -0,0 +1,259 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict
+from crewai.llms.base_llm import BaseLLM
+from llm_replay import (_normalize_messages, abandon_on, estimate_tokens, last_call_usage, use_request_timeout,
+                        use_stop_words)
+from token_stream import guard
+
+# ============================================================
+# 1. 模型档位与路由配置
+# ============================================================
+# 从慢 (能力强) 到快；latency = 固定开销 + 每千 prompt token 的耗时 (秒)，用于冷启动时的预估
+TIERS = ("max", "plus", "turbo")
+TIER_MODELS = {"max": "qwen3-max", "plus": "qwen-plus", "turbo": "qwen-turbo"}
+TIER_LATENCY = {"max": (4.0, 0.8), "plus": (2.0, 0.4), "turbo": (0.8, 0.15)}
+
+# 路由名 (任务名或 Agent 路由) -> 首选档位、延迟预算与单次超时 (秒)
+DEFAULT_ROUTES = {
+    "profile": {"tier": "plus", "budget": 20, "timeout": 45},
+    "calculation": {"tier": "max", "budget": 60, "timeout": 90},
+    "menu_design": {"tier": "max", "budget": 90, "timeout": 120},
+    "qa_review": {"tier": "plus", "budget": 45, "timeout": 90},
+    # 多日质检一次输出全部天数的食谱，预算与超时按篇幅放宽
+    "weekly_review": {"tier": "plus", "budget": 90, "timeout": 180},
+}
+# 路由没有配置 timeout 时的单次超时 (秒)；最后一个档位同样受限
+DEFAULT_TIMEOUT = 180
+# 环境变量 LLM_ROUTES 可覆盖，例如 '{"qa_review": {"tier": "turbo"}}'
+ENV_ROUTES = "LLM_ROUTES"
+# 观测样本数达到该值后，用实测均值代替静态预估
+MIN_SAMPLES = 5
+
+
+def load_routes() -> Dict[str, dict]:
+    routes = {name: dict(cfg) for name, cfg in DEFAULT_ROUTES.items()}
+    raw = os.getenv(ENV_ROUTES, "").strip()
+    if raw:
+        try:
+            for name, cfg in json.loads(raw).items():
+                routes.setdefault(name, {}).update(cfg)
+        except (ValueError, AttributeError) as e:
+            print(f"LLM Router: invalid {ENV_ROUTES}: {e}")
+    return routes
+
+
+# ============================================================
+# 2. 延迟直方图
+# ============================================================
+class LatencyHistogram:
+    """固定分桶 (秒) 的延迟直方图，另外统计超时与失败次数"""
+
+    BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.timeouts = 0
+        self.errors = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count, "mean": round(self.mean, 3),
+            "p50": self.quantile(0.5), "p95": self.quantile(0.95),
+            "timeouts": self.timeouts, "errors": self.errors,
+            "buckets": dict(zip([str(b) for b in self.BUCKETS] + ["inf"], self.counts)),
+        }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def _histogram(route: str, tier: str) -> LatencyHistogram:
+    with _histograms_lock:
+        return _histograms.setdefault((route, tier), LatencyHistogram())
+
+
+def router_stats() -> dict:
+    """{"route/tier": 直方图快照}"""
+    with _histograms_lock:
+        return {f"{route}/{tier}": h.snapshot() for (route, tier), h in sorted(_histograms.items())}
+
+
+def render_router_stats() -> str:
+    lines = ["| 路由 / 档位 | 调用 | 平均(s) | p50(s) | p95(s) | 超时 | 失败 |", "|---|---|---|---|---|---|---|"]
+    for name, s in router_stats().items():
+        lines.append(f"| {name} | {s['count']} | {s['mean']:.2f} | ≤{s['p50']:g} | ≤{s['p95']:g} "
+                     f"| {s['timeouts']} | {s['errors']} |")
+    return "\n".join(lines)
+
+
+# ============================================================
+# 3. 路由 LLM
+# ============================================================
+# 超时的调用无法中断，只能在后台线程里自然结束：放弃后它的结果、流式输出、工具调用与 token 用量全部丢弃。
+# 每次尝试的请求超时设为路由超时，被放弃的调用最迟在超时后释放线程
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-route")
+
+
+def _abandonable(cancelled: threading.Event, stop, timeout: float):
+    """在为本次尝试复制的上下文里运行：登记取消标志、停止词与请求超时，返回包装后的流式缓冲 (可能为 None)"""
+    abandon_on(cancelled)
+    use_stop_words(stop)
+    use_request_timeout(timeout)
+    return guard(cancelled)
+
+
+def _attempt(llm, messages, **kwargs):
+    """返回 (响应, 本次调用计入的用量)"""
+    response = llm.call(messages, **kwargs)
+    return response, last_call_usage()
+
+
+def _guard_functions(available_functions, cancelled: threading.Event):
+    """放弃后不再执行原生函数调用的工具"""
+    if not available_functions:
+        return available_functions
+
+    def wrap(fn):
+        def call(*args, **kwargs):
+            if cancelled.is_set():
+                return "Cancelled: this LLM call was abandoned after a timeout."
+            return fn(*args, **kwargs)
+        return call
+    return {name: wrap(fn) for name, fn in available_functions.items()}
+
+
+class RouterLLM(BaseLLM):
+    """
+    按路由配置选择模型档位：
+    - 路由名优先取调用方任务的 name (按任务配置)，否则用创建时给定的 Agent 路由
+    - 从首选档位开始，预估延迟 (实测均值或静态预估 + prompt 大小) 超出预算时降到更快的档位
+    - 单次调用超时或报错时，回退到下一个更快的档位；最后一个档位超时则整次调用失败
+    - token 用量只统计经由本实例的调用 (各档位 LLM 是进程内共享的)
+    """
+
+    def __init__(self, route: str, make_llm: Callable[[str], Any], routes: Dict[str, dict] = None):
+        self.routes = routes or load_routes()
+        self.route = route
+        self._tiers = {tier: make_llm(TIER_MODELS[tier]) for tier in TIERS}
+        super().__init__(model=TIER_MODELS[self.routes.get(route, {}).get("tier", "max")])
+
+    def _config(self, from_task) -> tuple:
+        name = getattr(from_task, "name", None)
+        route = name if name in self.routes else self.route
+        return route, self.routes.get(route, {})
+
+    def _predicted_latency(self, route: str, tier: str, prompt_tokens: int) -> float:
+        hist = _histogram(route, tier)
+        if hist.count >= MIN_SAMPLES:
+            return hist.mean
+        base, per_ktok = TIER_LATENCY[tier]
+        return base + per_ktok * prompt_tokens / 1000
+
+    def plan(self, messages, from_task=None):
+        """返回 (路由名, 按尝试顺序排列的档位列表)"""
+        route, cfg = self._config(from_task)
+        preferred = cfg.get("tier", "max")
+        chain = list(TIERS[TIERS.index(preferred):])
+        budget = cfg.get("budget")
+        if budget:
+            prompt_tokens = estimate_tokens(json.dumps(_normalize_messages(messages), ensure_ascii=False))
+            while len(chain) > 1 and self._predicted_latency(route, chain[0], prompt_tokens) > budget:
+                chain.pop(0)
+        return route, chain
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None,
+             from_task=None, from_agent=None, response_model=None):
+        route, chain = self.plan(messages, from_task)
+        timeout = self.routes.get(route, {}).get("timeout") or DEFAULT_TIMEOUT
+        last_error = None
+        for i, tier in enumerate(chain):
+            llm = self._tiers[tier]
+            hist = _histogram(route, tier)
+            started = time.perf_counter()
+            cancelled = threading.Event()
+            context = contextvars.copy_context()
+            guarded = context.run(_abandonable, cancelled, self.stop, timeout)
+            future = _executor.submit(
+                context.run, _attempt, llm, messages, tools=tools, callbacks=callbacks,
+                available_functions=_guard_functions(available_functions, cancelled), from_task=from_task,
+                from_agent=from_agent, response_model=response_model
+            )
+            is_last = i == len(chain) - 1
+            try:
+                response, usage = future.result(timeout=timeout)
+            except FutureTimeout:
+                self._abandon(future, cancelled, guarded)
+                with _histograms_lock:
+                    hist.timeouts += 1
+                last_error = TimeoutError(f"LLM route {route}/{tier} timed out after {timeout}s")
+                if is_last:
+                    raise last_error
+                print(f"LLM Router: {route}/{tier} timed out after {timeout}s, falling back")
+                continue
+            except Exception as e:
+                with _histograms_lock:
+                    hist.errors += 1
+                if is_last:
+                    raise
+                # 失败前已经推送的半截输出同样丢弃
+                self._abandon(future, cancelled, guarded)
+                print(f"LLM Router: {route}/{tier} failed ({e}), falling back")
+                last_error = e
+                continue
+            with _histograms_lock:
+                hist.observe(time.perf_counter() - started)
+            if usage:
+                self._track_token_usage_internal(usage)
+            return response
+        raise last_error
+
+    @staticmethod
+    def _abandon(future, cancelled: threading.Event, guarded):
+        """还没开始执行的直接取消；已在运行的置位取消标志，之后的输出 / 工具调用 / 用量统计都会被丢弃"""
+        cancelled.set()
+        future.cancel()
+        if guarded is not None:
+            guarded.discard()
+
+    def reset_token_usage(self):
+        """模板 Crew 被再次借出时清零，用量只反映本次请求"""
+        self._token_usage = {k: 0 for k in self._token_usage}
+
+    def supports_function_calling(self) -> bool:
+        return self._tiers[TIERS[0]].supports_function_calling()
+
+    def supports_stop_words(self) -> bool:
+        return self._tiers[TIERS[0]].supports_stop_words()
+
+    def get_context_window_size(self) -> int:
+        return min(llm.get_context_window_size() for llm in self._tiers.values())
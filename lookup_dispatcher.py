@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+from instrumentation import metrics, span
+
+# 环境变量：LOOKUP_WINDOW_MS=收集窗口 (毫秒，0 表示不合并、每个查询直接执行)，LOOKUP_MAX_BATCH=单批最多的不同查询数，
+# LOOKUP_TIMEOUT=调用方等待结果的上限 (秒)
+ENV_WINDOW_MS = "LOOKUP_WINDOW_MS"
+ENV_MAX_BATCH = "LOOKUP_MAX_BATCH"
+ENV_TIMEOUT = "LOOKUP_TIMEOUT"
+
+
+class Resolution:
+    """分发给调用方的结果：value 为 fetch / prepare 的结果，tier 为命中的层级，coalesced 表示复用了别人的查询"""
+
+    __slots__ = ("value", "tier", "coalesced", "finished_ns")
+
+    def __init__(self, value, tier: str, coalesced: bool):
+        self.value = value
+        self.tier = tier
+        self.coalesced = coalesced
+        self.finished_ns = time.time_ns()
+
+
+# ============================================================
+# 食材查询微批调度
+# ============================================================
+class LookupDispatcher:
+    """
+    进程内共享 (跨会话 / 跨工具调用)：
+    - 第一个请求到达后等待 window 秒收集同期请求，按 key_fn 去重
+    - 去重后的查询在调度线程里一次性走完缓存层：prepare(query, hint) 返回带 result / tier 的对象，result 为空表示需要联网
+      (hint 为第一个提交该键的调用方附带的信息，例如已查过的内存缓存条目，没有时为 None)
+    - 仍需联网的查询作为一批交给 submit (客户端线程池，受限流与自适应并发约束)，fetch(prepared) 返回最终结果
+    - 结果分发给等待同一个键的全部调用方；联网中的键再次被请求时直接挂到在途结果上
+    """
+
+    BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+    def __init__(self, key_fn: Callable[[str], str], prepare: Callable[[str], Any], fetch: Callable[[Any], Any],
+                 submit: Callable[..., Future], window: float = None, max_batch: int = None):
+        self.key_fn = key_fn
+        self.prepare = prepare
+        self.fetch = fetch
+        self.submit_upstream = submit
+        self.window = float(os.getenv(ENV_WINDOW_MS, "5")) / 1000 if window is None else window
+        self.max_batch = max_batch or int(os.getenv(ENV_MAX_BATCH, "64"))
+        self.timeout = float(os.getenv(ENV_TIMEOUT, "60"))
+        self._cond = threading.Condition()
+        self._queued = {}   # 本窗口内待解析的 key -> (代表查询, hint)
+        self._waiting = {}  # 本窗口内或联网中的 key -> [Future]
+        self._stats = {"requests": 0, "coalesced": 0, "batches": 0, "resolved": 0, "upstream": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._loop, name="lookup-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, query: str, key: str = None, hint: Any = None) -> Future:
+        """返回 Future[Resolution]；调用方已算好合并键时可直接传入，hint 原样传给 prepare"""
+        key = self.key_fn(query) if key is None else key
+        future = Future()
+        metrics.count("nutrition_lookup_requests_total")
+        with self._cond:
+            self._stats["requests"] += 1
+            waiters = self._waiting.get(key)
+            if waiters is not None:
+                waiters.append(future)
+                self._stats["coalesced"] += 1
+                return future
+            self._waiting[key] = [future]
+            self._queued[key] = (query, hint)
+            if len(self._queued) == 1 or len(self._queued) >= self.max_batch:
+                self._cond.notify()
+        return future
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats, inflight=len(self._waiting) - len(self._queued))
+        stats["coalescing_ratio"] = round(stats["coalesced"] / stats["requests"], 4) if stats["requests"] else 0.0
+        stats["mean_batch"] = round(stats["resolved"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
+
+    # ------------------------------------------------------------
+    # 调度线程
+    # ------------------------------------------------------------
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queued:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._queued) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                keys = list(self._queued)[:self.max_batch]
+                batch = [(key, self._queued.pop(key)) for key in keys]
+                requests = sum(len(self._waiting[key]) for key in keys)
+            handled = set()
+            try:
+                self._process(batch, requests, handled)
+            except Exception as e:
+                # 已出队但还没交出去的键必须失败，否则等待它们的调用方 (以及之后挂上来的) 永远拿不到结果
+                for key, _ in batch:
+                    if key not in handled:
+                        self._fail(key, e)
+
+    def _process(self, batch, requests: int, handled: set):
+        """handled 记录已经作答或已交给上游线程池的键"""
+        upstream = []
+        with span("lookup batch", "batch", requests=requests, unique=len(batch)) as current:
+            for key, (query, hint) in batch:
+                try:
+                    prepared = self.prepare(query, hint)
+                except Exception as e:
+                    self._fail(key, e)
+                    handled.add(key)
+                    continue
+                if prepared.result is not None:
+                    self._deliver(key, prepared.result, prepared.tier)
+                    handled.add(key)
+                else:
+                    upstream.append((key, prepared))
+            current.set(upstream=len(upstream))
+            for key, prepared in upstream:
+                try:
+                    self.submit_upstream(self._fetch_one, key, prepared)
+                except Exception as e:
+                    # 例如线程池已关闭
+                    self._fail(key, e)
+                handled.add(key)
+
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["resolved"] += len(batch)
+            self._stats["upstream"] += len(upstream)
+        metrics.histogram("nutrition_lookup_batch_size", len(batch), buckets=self.BATCH_BUCKETS)
+        metrics.histogram("nutrition_lookup_upstream_batch_size", len(upstream), buckets=self.BATCH_BUCKETS)
+
+    def _fetch_one(self, key, prepared):
+        try:
+            value = self.fetch(prepared)
+        except Exception as e:
+            self._fail(key, e)
+            return
+        self._deliver(key, value, prepared.tier)
+
+    def _deliver(self, key, value, tier: str):
+        with self._cond:
+            waiters = self._waiting.pop(key, [])
+        if len(waiters) > 1:
+            metrics.count("nutrition_lookup_coalesced_total", len(waiters) - 1)
+        for i, future in enumerate(waiters):
+            future.set_result(Resolution(value, tier, coalesced=i > 0))
+
+    def _fail(self, key, error: Exception):
+        with self._cond:
+            waiters = self._waiting.pop(key, [])
+            self._stats["failed"] += 1
+        for future in waiters:
+            future.set_exception(error)
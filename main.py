@@ -2,6 +2,7 @@ import os
 from crewai import Agent, Task, Crew, Process, LLM
 # 关键导入
 from langchain_openai import ChatOpenAI
+from llm_replay import wrap_llm
 
 os.environ["OPENAI_API_KEY"] = "sk-09991f3a85344338be57d0c6876fd5d7"
 
@@ -17,12 +18,12 @@ os.environ["CREWAI_TELEMETRY_OPT_OUT"] = "true"
 
 
 # 1. 配置 Qwen 模型
-qwen_llm = ChatOpenAI(
+qwen_llm = wrap_llm(ChatOpenAI(
     model="qwen3-max",
     api_key=os.environ["OPENAI_API_KEY"],
     base_url=os.environ["OPENAI_API_BASE"],
     temperature=0.7
-)
+))
 
 # 2. 将 LLM 赋予 Agent
 researcher = Agent(
@@ -0,0 +1,322 @@
+import json
+import re
+from food_query import canonicalize
+from ingredient_aliases import resolve_alias
+
+# ============================================================
+# 1. 容差与解析规则
+# ============================================================
+DAILY_KCAL_TOLERANCE = 0.10   # 全天热量相对目标
+MACRO_TOLERANCE = 0.15        # 全天宏量营养素相对目标
+MEAL_KCAL_TOLERANCE = 0.20    # 单餐热量相对分配目标
+CLAIM_TOLERANCE = 0.15        # 表格里 "热量估算" 与重新计算值
+
+MEAL_KEYS = (("早", "早餐"), ("午", "午餐"), ("晚", "晚餐"))
+_TOTAL_WORDS = ("合计", "总计", "全天", "总热量")
+_CELL_SEPARATORS = re.compile(r"<br\s*/?>|[,，、;；+＋/\n]")
+_COUNT_UNITS = "个|片|根|颗|勺|杯|碗|只|块|份|把|盒|瓶"
+# 重量 / 体积单位 -> 换算成 g (ml 按 1g 计)；长单位写在前面，"kg" 不会被当成 "g"
+WEIGHT_UNITS = {"kg": 1000, "KG": 1000, "Kg": 1000, "公斤": 1000, "千克": 1000, "斤": 500,
+                "ml": 1, "mL": 1, "ML": 1, "毫升": 1, "g": 1, "G": 1, "克": 1, "L": 1000, "l": 1000, "升": 1000}
+_AMOUNT = re.compile(r"(\d+(?:\.\d+)?)\s*(" + "|".join(sorted(WEIGHT_UNITS, key=len, reverse=True)) + ")(?![a-zA-Z])")
+_COUNT = re.compile(r"(\d+(?:\.\d+)?)\s*(" + _COUNT_UNITS + ")")
+# 中文数字 ("一个苹果" / "鸡蛋 两个" / "半根香蕉")，只在紧跟单位时换算
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_NUMBER = re.compile(r"([零一二两三四五六七八九十半]+)(?=\s*(?:" + _COUNT_UNITS + "|公斤|千克|斤|克|毫升|升))")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+# 千分位 ("1,050 kcal")：只去掉数字之间、后面正好三位数字的逗号
+_THOUSANDS = re.compile(r"(?<=\d)[,，](?=\d{3}(?!\d))")
+
+# 按个数计量的常见食材 -> 每个 / 片 / 根的可食生重 (g)，键为规范化名称；不在表中的计数食材记为缺失
+PIECE_UNITS = ("个", "片", "根", "颗", "只", "块")
+PIECE_GRAMS = {
+    "egg": 50, "cooked egg": 50, "banana": 120, "apple": 180, "orange": 150, "pear": 200,
+    "kiwi": 80, "tomato": 150, "bread": 35, "bread wholewheat": 35, "cooked bun": 100, "corn": 200,
+}
+
+
+def _clean_cell(text: str) -> str:
+    return text.replace("**", "").replace("__", "").strip()
+
+
+def _clean_name(name: str) -> str:
+    name = re.sub(r"生重|熟重|干重|净重|可食部", " ", name)
+    return re.sub(r"\s+", " ", re.sub(r"[()（）\[\]【】*:：~～约]", " ", name)).strip(" -·")
+
+
+def _piece_grams(name: str, unit: str):
+    if unit not in PIECE_UNITS:
+        return None
+    return PIECE_GRAMS.get(canonicalize(resolve_alias(name) or name).key)
+
+
+def _cn_number(text: str) -> str:
+    """"两" -> "2"，"十二" -> "12"，"半" -> "0.5"；无法识别的组合原样返回"""
+    if text == "半":
+        return "0.5"
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        if tens and tens not in _CN_DIGITS or ones and ones not in _CN_DIGITS:
+            return text
+        return str(_CN_DIGITS.get(tens, 1) * 10 + _CN_DIGITS.get(ones, 0))
+    if len(text) == 1 and text in _CN_DIGITS:
+        return str(_CN_DIGITS[text])
+    return text
+
+
+def _item_name(part: str, match) -> str:
+    """名称取数量之前的部分；数量写在前面 ("1根香蕉" / "150g鸡胸肉") 时取之后的部分"""
+    for text in (part[:match.start()], part[match.end():]):
+        name = _clean_name(_COUNT.sub("", _AMOUNT.sub("", text)))
+        if name:
+            return name
+    return ""
+
+
+def split_ingredients(cell: str):
+    """
+    返回 (items, unparsed)：items 为 [(名称, 克数)]，支持 g / ml / kg / 斤，数量可以写在名称前后，
+    常见计数食材 ("香蕉 1根" / "两个鸡蛋") 按 PIECE_GRAMS 换算；
+    unparsed 为其余无法换算成克数的非空项原文 ("汉堡 1个" / "盐 适量")，核对时计为缺失
+    """
+    items, unparsed = [], []
+    for part in _CELL_SEPARATORS.split(_THOUSANDS.sub("", _clean_cell(cell))):
+        part = part.strip()
+        if not part:
+            continue
+        text = _CN_NUMBER.sub(lambda m: _cn_number(m.group(1)), part)
+        # 同时写了个数和克数时 ("鸡蛋 1个(60g)") 以克数为准
+        m = _AMOUNT.search(text)
+        if m:
+            name = _item_name(text, m)
+            grams = float(m.group(1)) * WEIGHT_UNITS[m.group(2)]
+        else:
+            m = _COUNT.search(text)
+            name = _item_name(text, m) if m else ""
+            grams = float(m.group(1)) * (_piece_grams(name, m.group(2)) or 0) if name else 0
+        if name and grams:
+            items.append((name, grams))
+        else:
+            unparsed.append(part)
+    return items, unparsed
+
+
+def parse_ingredients(cell: str):
+    """'糙米 80g、鸡蛋 1个(50g)<br>牛奶250ml、香蕉1根' -> [('糙米', 80.0), ('鸡蛋', 50.0), ('牛奶', 250.0), ('香蕉', 120.0)]"""
+    return split_ingredients(cell)[0]
+
+
+def parse_menu_table(markdown: str):
+    """
+    解析 task_menu_design 输出的 [餐次, 推荐菜品, 核心食材及生重(g), 热量估算] 表格。
+    返回 [{"meal", "dish", "ingredients": [(名称, 克数)], "unparsed": [原文], "ingredients_text": 单元格原文,
+    "claimed_kcal", "table": 第几个表格 (从 0 开始)}]；合并单元格的空餐次沿用上一行。
+    """
+    rows, columns, meal, table = [], None, "", -1
+    for line in (markdown or "").splitlines():
+        line = line.strip()
+        if not line.startswith("|"):
+            columns, meal = None, ""
+            continue
+        cells = [_clean_cell(c) for c in line.strip("|").split("|")]
+        if columns is None:
+            if any("餐次" in c for c in cells) and any("食材" in c for c in cells):
+                columns = {
+                    "meal": next(i for i, c in enumerate(cells) if "餐次" in c),
+                    "dish": next((i for i, c in enumerate(cells) if "菜品" in c), None),
+                    "ingredients": next(i for i, c in enumerate(cells) if "食材" in c),
+                    "kcal": next((i for i, c in enumerate(cells) if "热量" in c), None),
+                }
+                table += 1
+            continue
+        if set("".join(cells)) <= set("-: "):
+            continue
+
+        def cell(name):
+            i = columns[name]
+            return cells[i] if i is not None and i < len(cells) else ""
+
+        meal = cell("meal") or meal
+        if any(w in meal for w in _TOTAL_WORDS) or any(w in cell("dish") for w in _TOTAL_WORDS):
+            continue
+        claimed = _NUMBER.search(_THOUSANDS.sub("", cell("kcal")))
+        items, unparsed = split_ingredients(cell("ingredients"))
+        rows.append({
+            "meal": meal,
+            "dish": cell("dish"),
+            "ingredients": items,
+            "unparsed": unparsed,
+            "ingredients_text": cell("ingredients"),
+            "claimed_kcal": float(claimed.group()) if claimed else None,
+            "table": table,
+        })
+    return rows
+
+
+# ============================================================
+# 2. 重新计算与比对
+# ============================================================
+def _target_meal(meal: str):
+    return next((name for key, name in MEAL_KEYS if key in meal), None)
+
+
+def _delta(value, target):
+    return (value - target) / target if target else 0.0
+
+
+def audit_menu(markdown: str, lookup, targets: dict = None) -> dict:
+    """
+    lookup: 食材名列表 -> {名称: NutrientRecord 或 None} (每 100g 数据)
+    targets: nutrition_math.calculate_profile 的结果 (target_kcal / protein_g / carbs_g / fat_g / meals)，可为空
+    返回 {"rows", "meals", "daily", "missing", "flags"}
+    """
+    rows = parse_menu_table(markdown)
+    names = list(dict.fromkeys(name for row in rows for name, _ in row["ingredients"]))
+    records = lookup(names) if names else {}
+
+    missing = []
+    meals = {}
+    incomplete_meals = set()
+    daily = [0.0, 0.0, 0.0, 0.0]
+    flags = []
+    for row in rows:
+        totals = [0.0, 0.0, 0.0, 0.0]
+        # 无法换算成克数的计数项 ("汉堡 1个") 同样没有计入
+        missing.extend(row.get("unparsed", []))
+        complete = not row.get("unparsed")
+        for name, grams in row["ingredients"]:
+            record = records.get(name)
+            if record is None:
+                missing.append(name)
+                complete = False
+                continue
+            for i, value in enumerate((record.kcal, record.protein, record.carbs, record.fat)):
+                totals[i] += value * grams / 100
+        row["computed"] = totals
+        meal_totals = meals.setdefault(row["meal"], [0.0, 0.0, 0.0, 0.0])
+        for i in range(4):
+            meal_totals[i] += totals[i]
+            daily[i] += totals[i]
+        if not complete:
+            incomplete_meals.add(row["meal"])
+        claimed = row["claimed_kcal"]
+        # 有食材查不到数据时重新计算值偏低，不和表内估算比较
+        if claimed and complete and totals[0] and abs(_delta(totals[0], claimed)) > CLAIM_TOLERANCE:
+            flags.append((f"{row['meal']} · {row['dish']} 热量估算", totals[0], claimed, _delta(totals[0], claimed)))
+
+    # 同理，有未计入食材的餐次 / 全天合计只是下限，不和目标比较 (避免报出虚假的热量缺口)
+    if targets:
+        for meal, totals in meals.items():
+            if meal in incomplete_meals:
+                continue
+            target = targets.get("meals", {}).get(_target_meal(meal))
+            if target and abs(_delta(totals[0], target)) > MEAL_KCAL_TOLERANCE:
+                flags.append((f"{meal} 热量", totals[0], target, _delta(totals[0], target)))
+        checks = (("全天热量 (kcal)", 0, "target_kcal", DAILY_KCAL_TOLERANCE),
+                  ("全天蛋白质 (g)", 1, "protein_g", MACRO_TOLERANCE),
+                  ("全天碳水 (g)", 2, "carbs_g", MACRO_TOLERANCE),
+                  ("全天脂肪 (g)", 3, "fat_g", MACRO_TOLERANCE))
+        for label, i, key, tolerance in checks:
+            target = targets.get(key)
+            if target and not missing and abs(_delta(daily[i], target)) > tolerance:
+                flags.append((label, daily[i], target, _delta(daily[i], target)))
+
+    return {"rows": rows, "meals": meals, "daily": daily,
+            "missing": list(dict.fromkeys(missing)), "flags": flags}
+
+
+def render_audit(audit: dict) -> str:
+    """只输出需要 QA 关注的偏差，保持提示词精简"""
+    kcal, protein, carbs, fat = audit["daily"]
+    lines = ["## 程序化营养核对 (按营养数据库重新计算)",
+             f"全天合计: {kcal:.0f} kcal | P {protein:.0f}g | C {carbs:.0f}g | F {fat:.0f}g"]
+    if not audit["rows"]:
+        lines.append("⚠️ 未能解析到 [餐次, 推荐菜品, 核心食材及生重(g), 热量估算] 表格，请按格式输出。")
+    elif audit["flags"]:
+        lines += ["", "| 偏差项 | 计算值 | 目标/声明值 | 偏差 |", "|---|---|---|---|"]
+        lines += [f"| {label} | {value:.0f} | {target:.0f} | {delta:+.0%} |"
+                  for label, value, target, delta in audit["flags"]]
+    elif audit["missing"]:
+        lines.append("⚠️ 部分食材未计入，合计只是下限，未与目标比较。")
+    else:
+        lines.append("✅ 所有指标均在允许范围内。")
+    if audit["missing"]:
+        lines.append(f"无营养数据或无法换算克数 (未计入，合计偏低): {', '.join(audit['missing'])}")
+    return "\n".join(lines)
+
+
+# ============================================================
+# 3. 与 CrewAI 集成
+# ============================================================
+def tool_lookup(nutrient_tool):
+    """把 FatSecretSearchTool 包装成 audit_menu 需要的 lookup 函数 (复用其缓存层)"""
+    def lookup(names):
+        results = nutrient_tool.lookup_records(names)
+        return {name: record for name, (_, record, _) in zip(names, results)}
+    return lookup
+
+
+def make_audit_callback(lookup, targets: dict = None):
+    """Task 回调：把核对结果追加到 TaskOutput.raw，下游任务的上下文直接可见"""
+    def callback(output):
+        try:
+            report = render_audit(audit_menu(output.raw, lookup, targets))
+        except Exception as e:
+            print(f"Menu Audit Error: {e}")
+            return
+        output.raw = f"{output.raw}\n\n{report}"
+    return callback
+
+
+# ============================================================
+# 4. 多日购物清单
+# ============================================================
+def menu_rows(raw: str):
+    """菜单任务的输出 (Markdown 表格，或 context_compaction 压缩后的 JSON) -> parse_menu_table 格式的行"""
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return parse_menu_table(raw)
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return parse_menu_table(raw)
+    return [{
+        "meal": item.get("meal", ""),
+        "dish": item.get("dish", ""),
+        "ingredients": [(name, float(grams)) for name, grams in item.get("ingredients", [])],
+        "claimed_kcal": item.get("claimed_kcal"),
+    } for item in items]
+
+
+def menu_tables(markdown: str):
+    """按表格分组的 parse_menu_table 结果 (多日最终食谱每天一个表格)，可直接传给 merge_shopping_list"""
+    tables = {}
+    for row in parse_menu_table(markdown):
+        tables.setdefault(row["table"], []).append(row)
+    return list(tables.values())
+
+
+def merge_shopping_list(menus):
+    """
+    menus: 每天一份 menu_rows 的结果。
+    同一食材的不同写法 (中英文 / 词序 / 单复数) 按规范化名称合并，
+    返回 [(名称, 总生重 g, 用到的天数)]，按总量降序；名称取第一次出现的写法。
+    """
+    merged = {}
+    for day, rows in enumerate(menus):
+        for row in rows:
+            for name, grams in row["ingredients"]:
+                key = canonicalize(resolve_alias(name) or name).key or name.strip().lower()
+                entry = merged.setdefault(key, [name, 0.0, set()])
+                entry[1] += grams
+                entry[2].add(day)
+    items = [(name, grams, len(days)) for name, grams, days in merged.values()]
+    return sorted(items, key=lambda item: (-item[1], item[0]))
+
+
+def render_shopping_list(items) -> str:
+    if not items:
+        return "⚠️ 未能从菜单中解析到食材，请参考上方每日食谱。"
+    lines = ["| 食材 | 全周生重 (g) | 用到的天数 |", "|---|---|---|"]
+    lines += [f"| {name} | {grams:.0f} | {days} |" for name, grams, days in items]
+    return "\n".join(lines)
@@ -0,0 +1,196 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+# ============================================================
+# 1. 结构化营养记录
+# ============================================================
+class NutrientRecord:
+    """单个食物的营养数据 (统一换算为每 100g)"""
+
+    __slots__ = ("food_id", "name", "kcal", "protein", "carbs", "fat",
+                 "serving_desc", "serving_g", "fetched_at")
+
+    def __init__(self, food_id, name, kcal, protein, carbs, fat,
+                 serving_desc="", serving_g=None, fetched_at=None):
+        self.food_id = str(food_id or "")
+        self.name = name
+        self.kcal = float(kcal)
+        self.protein = float(protein)
+        self.carbs = float(carbs)
+        self.fat = float(fat)
+        # 原始份量信息，例如 "1 cup (158g)" / 158.0
+        self.serving_desc = serving_desc or ""
+        self.serving_g = float(serving_g) if serving_g else None
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    def render(self) -> str:
+        """渲染成给 LLM 看的文本 (仅在工具输出边界调用)"""
+        return (
+            f"{self.name} | "
+            f"Kcal: {self.kcal:.0f} | "
+            f"P: {self.protein:.2f}g | "
+            f"C: {self.carbs:.2f}g | "
+            f"F: {self.fat:.2f}g (per 100g)"
+        )
+
+    def to_row(self):
+        return (self.food_id, self.name, self.kcal, self.protein, self.carbs, self.fat,
+                self.serving_desc, self.serving_g, self.fetched_at)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    @classmethod
+    def from_serving(cls, food_id, name, serving: dict):
+        """根据 FatSecret 的 serving 数据构造记录，按公制克数换算到每 100g"""
+        amount = _to_float(serving.get("metric_serving_amount"))
+        grams = amount if serving.get("metric_serving_unit") == "g" and amount > 0 else None
+        scale = 100.0 / grams if grams else 1.0
+        return cls(
+            food_id=food_id,
+            name=name,
+            kcal=_to_float(serving.get("calories")) * scale,
+            protein=_to_float(serving.get("protein")) * scale,
+            carbs=_to_float(serving.get("carbohydrate")) * scale,
+            fat=_to_float(serving.get("fat")) * scale,
+            serving_desc=serving.get("serving_description", ""),
+            serving_g=grams,
+        )
+
+    _LEGACY_PATTERN = re.compile(
+        r"^(?P<name>.*?) \| Kcal: (?P<kcal>[\d.]+) \| P: (?P<p>[\d.]+)g \| "
+        r"C: (?P<c>[\d.]+)g \| F: (?P<f>[\d.]+)g"
+    )
+
+    @classmethod
+    def from_legacy_text(cls, text: str, fetched_at=None):
+        """解析旧版缓存中的格式化字符串，无法解析时返回 None"""
+        m = cls._LEGACY_PATTERN.match(text or "")
+        if not m:
+            return None
+        return cls("", m["name"], m["kcal"], m["p"], m["c"], m["f"], fetched_at=fetched_at)
+
+
+class NegativeEntry:
+    """查询失败的结果 (未收录 / 鉴权失败 / 上游不可用)，短期缓存避免反复请求"""
+
+    __slots__ = ("kind", "detail", "created_at")
+
+    def __init__(self, kind: str, detail: str, created_at=None):
+        self.kind = kind
+        self.detail = detail
+        self.created_at = created_at if created_at is not None else time.time()
+
+
+# ============================================================
+# 2. 缓存策略 (按条目类别配置)
+# ============================================================
+class CachePolicy:
+    """
+    fresh_ttl 内直接返回；之后的 stale_ttl 内先返回旧值并在后台刷新；
+    超过 fresh_ttl + stale_ttl 视为未命中，同步查询。
+    """
+
+    __slots__ = ("fresh_ttl", "stale_ttl")
+
+    def __init__(self, fresh_ttl: float, stale_ttl: float = 0.0):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+
+    def state(self, age: float) -> str:
+        if age < self.fresh_ttl:
+            return "fresh"
+        if age < self.fresh_ttl + self.stale_ttl:
+            return "stale"
+        return "expired"
+
+    def __repr__(self):
+        return f"CachePolicy(fresh_ttl={self.fresh_ttl}, stale_ttl={self.stale_ttl})"
+
+
+DAY = 24 * 3600
+
+
+def default_cache_policies() -> dict:
+    return {
+        # 营养成分几乎不变：30 天内视为新鲜，之后半年内后台刷新
+        "found": CachePolicy(30 * DAY, 180 * DAY),
+        # 数据库未收录：缓存 1 天
+        "not_found": CachePolicy(DAY),
+        # 鉴权失败 / 上游不可用：只挡住短时间内的重复调用
+        "auth_failed": CachePolicy(60),
+        "unavailable": CachePolicy(30),
+    }
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# ============================================================
+# 3. 进程内 LRU + TTL 缓存
+# ============================================================
+class LRUCache:
+    """
+    线程安全的容量受限 LRU 缓存，每个条目带独立过期时间。
+    通过 stats() 暴露命中 / 未命中 / 淘汰计数，便于按流量调整容量。
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 6 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,225 @@
+import argparse
+import csv
+import os
+import re
+import threading
+import numpy as np
+from nutrient_cache import NutrientRecord
+
+# 兼容 USDA 等常见导出格式的列名
+_COLUMN_ALIASES = {
+    "id": ("fdc_id", "ndb_no", "food_id", "id"),
+    "name": ("description", "food_name", "name", "long_desc"),
+    "kcal": ("energy_kcal", "kcal", "calories", "energy"),
+    "protein": ("protein_g", "protein"),
+    "carbs": ("carbohydrate_g", "carbohydrate_by_difference", "carbohydrate", "carbs"),
+    "fat": ("fat_g", "total_lipid_fat", "total_lipid", "fat"),
+}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+# ============================================================
+# 1. 字符 n-gram 索引 (模糊匹配)
+# ============================================================
+def name_grams(text: str) -> set:
+    """按单词切分后取三元组 (带词边界填充)，与词序无关"""
+    grams = set()
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NgramIndex:
+    """
+    倒排索引的 CSR 布局：
+    grams (有序) -> offsets -> postings (行号)，配合 np.bincount 一次算出所有候选的重叠数。
+    """
+
+    def __init__(self, grams: np.ndarray, offsets: np.ndarray, postings: np.ndarray, gram_counts: np.ndarray):
+        self.grams = grams
+        self.offsets = offsets
+        self.postings = postings
+        self.gram_counts = gram_counts
+
+    @classmethod
+    def build(cls, names):
+        inverted = {}
+        gram_counts = np.zeros(len(names), dtype=np.int32)
+        for row, name in enumerate(names):
+            grams = name_grams(name)
+            gram_counts[row] = len(grams)
+            for g in grams:
+                inverted.setdefault(g, []).append(row)
+
+        keys = sorted(inverted)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(inverted[k]) for k in keys])
+        postings = np.fromiter((r for k in keys for r in inverted[k]), dtype=np.int32, count=int(offsets[-1]))
+        return cls(np.array(keys, dtype="<U3"), offsets, postings, gram_counts)
+
+    def search(self, query: str, limit: int = 1):
+        """返回 [(行号, 相似度)]；相似度 = 0.7 * 查询覆盖率 + 0.3 * Dice 系数"""
+        q_grams = np.array(sorted(name_grams(query)), dtype="<U3")
+        if not len(q_grams) or not len(self.grams):
+            return []
+        pos = np.searchsorted(self.grams, q_grams)
+        valid = pos < len(self.grams)
+        pos, q_grams_valid = pos[valid], q_grams[valid]
+        pos = pos[self.grams[pos] == q_grams_valid]
+        if not len(pos):
+            return []
+
+        hits = np.concatenate([self.postings[self.offsets[p]:self.offsets[p + 1]] for p in pos])
+        overlap = np.bincount(hits, minlength=len(self.gram_counts))
+        q = len(q_grams)
+        scores = 0.7 * overlap / q + 0.3 * 2 * overlap / (q + self.gram_counts)
+
+        top = np.argsort(-scores, kind="stable")[:limit]
+        return [(int(i), float(scores[i])) for i in top if overlap[i] > 0]
+
+
+# ============================================================
+# 2. 本地离线营养库 (内存映射列式存储)
+# ============================================================
+class ReferenceDB:
+    """
+    目录布局 (全部为 .npy，加载时内存映射)：
+    values.npy        float32 [n, 4]  kcal / protein / carbs / fat (每 100g)
+    labels.npy        unicode [n, 2]  食物 ID / 名称
+    grams.npy / gram_offsets.npy / postings.npy / gram_counts.npy  n-gram 索引
+    """
+
+    def __init__(self, path: str):
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.path = path
+        self.values = load("values.npy")
+        self.labels = load("labels.npy")
+        self.index = NgramIndex(
+            np.asarray(load("grams.npy")), load("gram_offsets.npy"), load("postings.npy"), load("gram_counts.npy")
+        )
+
+    def __len__(self):
+        return len(self.values)
+
+    def record(self, row: int) -> NutrientRecord:
+        kcal, protein, carbs, fat = (float(v) for v in self.values[row])
+        food_id, name = self.labels[row]
+        return NutrientRecord(f"ref:{food_id}", str(name), kcal, protein, carbs, fat,
+                              serving_desc="100 g", serving_g=100)
+
+    def candidates(self, query: str, min_score: float = 0.6, limit: int = 5):
+        """相似度不低于阈值的前 limit 个候选，返回 [(NutrientRecord, 相似度)]，按相似度降序"""
+        return [(self.record(row), score) for row, score in self.index.search(query, limit) if score >= min_score]
+
+    def match(self, query: str, min_score: float = 0.6):
+        """模糊匹配最相近的食物，返回 (NutrientRecord, 相似度)；低于阈值返回 (None, 相似度)"""
+        found = self.index.search(query, limit=1)
+        if not found:
+            return None, 0.0
+        row, score = found[0]
+        if score < min_score:
+            return None, score
+        return self.record(row), score
+
+
+def _pick_columns(header):
+    lowered = {h.strip().lower(): h for h in header}
+    columns = {}
+    for field, aliases in _COLUMN_ALIASES.items():
+        columns[field] = next((lowered[a] for a in aliases if a in lowered), None)
+    missing = [f for f in ("name", "kcal", "protein", "carbs", "fat") if columns[f] is None]
+    if missing:
+        raise ValueError(f"CSV is missing columns for: {', '.join(missing)}")
+    return columns
+
+
+def import_csv(csv_path: str, out_dir: str) -> int:
+    """把 USDA 风格的 CSV 批量导入为列式文件，返回导入行数"""
+    labels, values = [], []
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        columns = _pick_columns(reader.fieldnames or [])
+        for i, row in enumerate(reader):
+            name = (row[columns["name"]] or "").strip()
+            if not name:
+                continue
+            try:
+                nutrients = [float(row[columns[k]] or 0) for k in ("kcal", "protein", "carbs", "fat")]
+            except ValueError:
+                continue
+            food_id = row[columns["id"]] if columns["id"] else str(i)
+            labels.append((food_id, name))
+            values.append(nutrients)
+
+    index = NgramIndex.build([name for _, name in labels])
+    # 先写临时目录再整体替换，避免其他进程读到写了一半的文件
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "values.npy"), np.asarray(values, dtype=np.float32).reshape(-1, 4))
+    np.save(os.path.join(tmp_dir, "labels.npy"), np.asarray(labels, dtype=str).reshape(-1, 2))
+    np.save(os.path.join(tmp_dir, "grams.npy"), index.grams)
+    np.save(os.path.join(tmp_dir, "gram_offsets.npy"), index.offsets)
+    np.save(os.path.join(tmp_dir, "postings.npy"), index.postings)
+    np.save(os.path.join(tmp_dir, "gram_counts.npy"), index.gram_counts)
+
+    if os.path.isdir(out_dir):
+        old_dir = f"{out_dir}.old-{os.getpid()}"
+        os.replace(out_dir, old_dir)
+        os.replace(tmp_dir, out_dir)
+        for name in os.listdir(old_dir):
+            os.remove(os.path.join(old_dir, name))
+        os.rmdir(old_dir)
+    else:
+        os.replace(tmp_dir, out_dir)
+    return len(labels)
+
+
+# ============================================================
+# 3. 进程级共享实例
+# ============================================================
+_reference_dbs = {}
+_reference_lock = threading.Lock()
+
+
+def get_reference_db(path: str, csv_path: str = None):
+    """
+    打开本地营养库 (进程内共享)。
+    如果提供了 csv_path 且列式文件不存在或比 CSV 旧，先自动导入。
+    两者都不存在时返回 None。
+    """
+    with _reference_lock:
+        db = _reference_dbs.get(path)
+        if db is not None:
+            return db
+        values_file = os.path.join(path, "values.npy")
+        if csv_path and os.path.exists(csv_path):
+            if not os.path.exists(values_file) or os.path.getmtime(values_file) < os.path.getmtime(csv_path):
+                import_csv(csv_path, path)
+        if not os.path.exists(values_file):
+            return None
+        db = ReferenceDB(path)
+        _reference_dbs[path] = db
+        return db
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local nutrient reference database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="bulk import a USDA-style CSV")
+    p_import.add_argument("csv_path")
+    p_import.add_argument("--out", default="data/reference")
+    p_match = sub.add_parser("match", help="fuzzy-match a food name")
+    p_match.add_argument("query")
+    p_match.add_argument("--db", default="data/reference")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        print(f"Imported {import_csv(args.csv_path, args.out)} foods into {args.out}")
+    else:
+        ref = ReferenceDB(args.db)
+        for row, score in ref.index.search(args.query, limit=5):
+            print(f"{score:.3f}  {ref.record(row).render()}")
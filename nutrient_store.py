@@ -0,0 +1,175 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from nutrient_cache import NegativeEntry, NutrientRecord
+
+# 表结构版本 (PRAGMA user_version)
+# 1: query -> 格式化字符串
+# 2: query -> 结构化营养字段
+SCHEMA_VERSION = 2
+
+_RECORD_COLUMNS = "food_id, name, kcal, protein, carbs, fat, serving_desc, serving_g, fetched_at"
+
+
+# ============================================================
+# 持久化营养数据存储 (SQLite WAL)
+# ============================================================
+class NutrientStore:
+    """
+    基于 SQLite (WAL 模式) 的食物营养缓存。
+    - 主键点查 / 单行 upsert，查询开销与缓存大小无关
+    - 每个线程独立连接，多个 Streamlit 进程可同时读写同一个文件
+    """
+
+    def __init__(self, db_path: str = "food_cache.db", busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS foods ("
+                " query TEXT PRIMARY KEY,"
+                " food_id TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " kcal REAL NOT NULL,"
+                " protein REAL NOT NULL,"
+                " carbs REAL NOT NULL,"
+                " fat REAL NOT NULL,"
+                " serving_desc TEXT,"
+                " serving_g REAL,"
+                " fetched_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # 负缓存：只持久化 "数据库未收录" 这类与进程无关的结果
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS misses ("
+                " query TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " detail TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            has_v1 = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'food_cache'"
+            ).fetchone()
+            if version < 2 and has_v1:
+                # v1 -> v2: 把格式化字符串解析成结构化字段
+                rows = conn.execute("SELECT query, value, updated_at FROM food_cache").fetchall()
+                self._insert_legacy(conn, rows)
+                conn.execute("DROP TABLE food_cache")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _insert_legacy(conn, rows) -> int:
+        """rows: (query, 格式化字符串, 时间戳)；已有记录优先，不被覆盖"""
+        records = []
+        for query, text, ts in rows:
+            record = NutrientRecord.from_legacy_text(text, fetched_at=ts)
+            if record is not None:
+                records.append((query,) + record.to_row())
+        conn.executemany(
+            f"INSERT OR IGNORE INTO foods (query, {_RECORD_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            records
+        )
+        return len(records)
+
+    # ------------------------------------------------------------
+    # 读写接口
+    # ------------------------------------------------------------
+    def get(self, query: str):
+        row = self._connect().execute(
+            f"SELECT {_RECORD_COLUMNS} FROM foods WHERE query = ?", (query,)
+        ).fetchone()
+        return NutrientRecord.from_row(row) if row else None
+
+    def put(self, query: str, record: NutrientRecord):
+        self._connect().execute(
+            f"INSERT INTO foods (query, {_RECORD_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(query) DO UPDATE SET "
+            "food_id = excluded.food_id, name = excluded.name, kcal = excluded.kcal, "
+            "protein = excluded.protein, carbs = excluded.carbs, fat = excluded.fat, "
+            "serving_desc = excluded.serving_desc, serving_g = excluded.serving_g, "
+            "fetched_at = excluded.fetched_at",
+            (query,) + record.to_row()
+        )
+
+    def keys(self):
+        return [row[0] for row in self._connect().execute("SELECT query FROM foods")]
+
+    def get_miss(self, query: str):
+        row = self._connect().execute(
+            "SELECT kind, detail, created_at FROM misses WHERE query = ?", (query,)
+        ).fetchone()
+        return NegativeEntry(*row) if row else None
+
+    def put_miss(self, query: str, entry: NegativeEntry):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO misses (query, kind, detail, created_at) VALUES (?, ?, ?, ?)",
+            (query, entry.kind, entry.detail, entry.created_at)
+        )
+
+    def delete_miss(self, query: str):
+        self._connect().execute("DELETE FROM misses WHERE query = ?", (query,))
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM foods").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ------------------------------------------------------------
+    # 一次性迁移旧的 food_cache_db.json
+    # ------------------------------------------------------------
+    def migrate_json(self, json_path: str) -> int:
+        """把旧 JSON 缓存导入数据库，只执行一次；返回导入条数"""
+        marker = f"migrated:{os.path.abspath(json_path)}"
+        conn = self._connect()
+        if not os.path.exists(json_path):
+            return 0
+
+        # BEGIN IMMEDIATE 拿写锁，保证多个进程同时启动时只有一个执行迁移
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                conn.execute("COMMIT")
+                return 0
+            try:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    legacy = json.load(f)
+            except (OSError, ValueError):
+                legacy = {}
+
+            now = time.time()
+            rows = [(k.strip().lower(), v, now) for k, v in legacy.items() if isinstance(v, str) and k.strip()]
+            count = self._insert_legacy(conn, rows)
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (marker, str(now)))
+            conn.execute("COMMIT")
+            return count
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
@@ -0,0 +1,384 @@
+import re
+import numpy as np
+
+# ============================================================
+# 1. 常量与规则表
+# ============================================================
+KCAL_PER_SERVING = 90.0
+KCAL_PER_G = {"protein": 4.0, "carbs": 4.0, "fat": 9.0}
+
+# 职业 / 工作强度关键词 -> 活动系数 (PAL)，按顺序匹配，先命中者优先
+ACTIVITY_RULES = (
+    (("运动员", "重体力", "工地", "搬运", "建筑工", "农民", "快递", "外卖员"), 1.725, "重度活动"),
+    (("健身", "运动", "跑步", "护士", "服务员", "销售", "站立", "体力"), 1.55, "中度活动"),
+    (("教师", "老师", "医生", "轻度", "通勤", "走动"), 1.375, "轻度活动"),
+    (("久坐", "程序员", "办公", "文员", "996", "学生", "设计", "司机", "坐"), 1.2, "久坐"),
+)
+DEFAULT_ACTIVITY = (1.375, "轻度活动")
+
+# 否定 / 程度限定：出现在关键词之前 (同一分句内) 时该关键词不算数
+# "无糖尿病、无高血压" / "很少运动" / "不坐班"
+NEGATIONS = ("无", "没有", "没", "否认", "未", "不", "排除")
+ACTIVITY_QUALIFIERS = NEGATIONS + ("很少", "偶尔", "少")
+# 出现在关键词之后表示指标正常："血脂正常" / "血压无异常"
+NORMAL_SUFFIXES = ("正常", "无异常", "未见异常")
+_CLAUSE_SEPARATORS = re.compile(r"[，,、；;。.！!？?\s/()（）]+")
+
+# 目标关键词 -> 每日热量调整 (kcal)
+GOAL_RULES = (
+    (("减脂", "减重", "减肥", "瘦身", "变瘦", "控制体重", "减轻体重"), -500, "减脂"),
+    (("增肌", "增重", "长肉"), 300, "增肌"),
+)
+
+# 中国居民膳食指南：BMI 分级
+BMI_LEVELS = ((18.5, "偏瘦"), (24.0, "正常"), (28.0, "超重"), (float("inf"), "肥胖"))
+
+# 每日最低热量 (男 / 女)
+MIN_KCAL = {True: 1500.0, False: 1200.0}
+
+# 食物交换份 (每份 90 kcal) 的宏量组成 (g)：蛋白质 / 碳水 / 脂肪
+EXCHANGE_GROUPS = {
+    "谷薯类": (2.0, 20.0, 0.0),
+    "蔬菜类": (5.0, 17.0, 0.0),
+    "水果类": (1.0, 21.0, 0.0),
+    "肉蛋类": (9.0, 0.0, 6.0),
+    "大豆乳类": (5.0, 6.0, 4.0),
+    "油脂类": (0.0, 0.0, 10.0),
+}
+MIN_OIL_SERVINGS = 1.0
+# 每餐热量分配：早 / 午 / 晚
+MEAL_SPLIT = (("早餐", 0.3), ("午餐", 0.4), ("晚餐", 0.3))
+
+# 疾病 / 体检异常关键词 -> 营养限制
+CONDITION_RULES = {
+    "diabetes": {
+        "keywords": ("糖尿病", "血糖", "胰岛素抵抗", "糖耐量"),
+        "label": "血糖异常",
+        "carb_ratio_max": 0.45,
+        "added_sugar_g": 25,
+        "rules": ("主食选择低GI (GI<55) 食物，粗杂粮占主食一半以上", "水果选低GI品种并计入碳水份数，两餐之间食用",
+                  "避免含糖饮料"),
+    },
+    "hypertension": {
+        "keywords": ("高血压", "血压"),
+        "label": "血压异常",
+        "sodium_mg": 1500,
+        "rules": ("钠 < 1500 mg/天 (约食盐 3.8g)，少用酱油、腌制品和加工肉", "多选高钾蔬果 (菠菜、香蕉、土豆等)"),
+    },
+    "fatty_liver": {
+        "keywords": ("脂肪肝", "转氨酶"),
+        "label": "脂肪肝",
+        "fat_ratio_max": 0.25,
+        "added_sugar_g": 25,
+        "rules": ("严格禁酒", "脂肪供能 ≤ 25%，以不饱和脂肪为主", "避免果汁和甜点"),
+    },
+    "hyperuricemia": {
+        "keywords": ("尿酸", "痛风"),
+        "label": "高尿酸",
+        "protein_g_per_kg_max": 1.2,
+        "rules": ("低嘌呤饮食：避免动物内脏、浓肉汤、海鲜贝类", "禁啤酒和烈酒，避免果糖饮料", "每日饮水 ≥ 2000ml"),
+    },
+    "dyslipidemia": {
+        "keywords": ("血脂", "胆固醇", "甘油三酯"),
+        "label": "血脂异常",
+        "fat_ratio_max": 0.25,
+        "rules": ("饱和脂肪 < 总热量 7%，少吃肥肉、黄油、油炸食品", "膳食纤维 ≥ 25g/天"),
+    },
+    "kidney": {
+        "keywords": ("肾病", "肾功能", "肌酐"),
+        "label": "肾功能异常",
+        "protein_g_per_kg_max": 0.8,
+        "sodium_mg": 2000,
+        "rules": ("优质低蛋白饮食，需遵医嘱", "控制钠和磷的摄入"),
+    },
+}
+DEFAULT_SODIUM_MG = 2000
+
+
+# ============================================================
+# 2. 文本 -> 数值参数
+# ============================================================
+def is_male(gender: str) -> bool:
+    return str(gender).strip().lower() in ("男", "male", "m", "man")
+
+
+def mentions(text: str, keyword: str, qualifiers=NEGATIONS, normal_suffixes=()) -> bool:
+    """
+    text 中是否肯定地提到 keyword：按标点切成分句，
+    分句中关键词前有否定 / 限定词，或其后紧跟 "正常" 之类时不算
+    """
+    for clause in _CLAUSE_SEPARATORS.split(text or ""):
+        start = clause.find(keyword)
+        while start >= 0:
+            before, after = clause[:start], clause[start + len(keyword):]
+            if not any(q in before for q in qualifiers) and not after.startswith(normal_suffixes):
+                return True
+            start = clause.find(keyword, start + 1)
+    return False
+
+
+def activity_factor(job_desc: str):
+    """根据职业与工作强度描述估算活动系数，返回 (系数, 等级)"""
+    for keywords, factor, label in ACTIVITY_RULES:
+        if any(mentions(job_desc, k, ACTIVITY_QUALIFIERS) for k in keywords):
+            return factor, label
+    return DEFAULT_ACTIVITY
+
+
+def goal_adjustment(goals: str):
+    """只看目标描述 (偏好里的 "瘦肉" 之类不能当成减脂目标)"""
+    for keywords, delta, label in GOAL_RULES:
+        if any(mentions(goals, k) for k in keywords):
+            return delta, label
+    return 0, "维持"
+
+
+def detect_conditions(health_issues: str):
+    return [name for name, rule in CONDITION_RULES.items()
+            if any(mentions(health_issues, k, normal_suffixes=NORMAL_SUFFIXES) for k in rule["keywords"])]
+
+
+def bmi_level(bmi: float) -> str:
+    return next(label for limit, label in BMI_LEVELS if bmi < limit)
+
+
+# ============================================================
+# 3. 批量计算 (numpy 向量化)
+# ============================================================
+def bmr_batch(male, age, height_cm, weight_kg, formula: str = "mifflin"):
+    """基础代谢率 (kcal/天)。formula: 'mifflin' (Mifflin-St Jeor) 或 'harris' (Harris-Benedict 修订版)"""
+    male = np.asarray(male, dtype=bool)
+    age, height_cm, weight_kg = (np.asarray(v, dtype=float) for v in (age, height_cm, weight_kg))
+    if formula == "harris":
+        return np.where(
+            male,
+            88.362 + 13.397 * weight_kg + 4.799 * height_cm - 5.677 * age,
+            447.593 + 9.247 * weight_kg + 3.098 * height_cm - 4.330 * age,
+        )
+    return 10 * weight_kg + 6.25 * height_cm - 5 * age + np.where(male, 5.0, -161.0)
+
+
+def calculate_batch(male, age, height_cm, weight_kg, activity, goal_delta,
+                    carb_ratio_max=None, fat_ratio_max=None, protein_g_per_kg_max=None,
+                    formula: str = "mifflin") -> dict:
+    """
+    批量计算营养处方，所有参数均可为等长数组 (一次计算成千上万份档案)。
+    返回字典，每个值为与输入等长的数组。
+    """
+    male = np.asarray(male, dtype=bool)
+    height_cm = np.asarray(height_cm, dtype=float)
+    weight_kg = np.asarray(weight_kg, dtype=float)
+    n = np.broadcast(male, height_cm, weight_kg, np.asarray(age)).shape
+
+    def param(value, default):
+        return np.broadcast_to(np.asarray(default if value is None else value, dtype=float), n)
+
+    bmi = weight_kg / np.square(height_cm / 100)
+    bmr = bmr_batch(male, age, height_cm, weight_kg, formula)
+    tdee = bmr * np.asarray(activity, dtype=float)
+    target = np.maximum(tdee + np.asarray(goal_delta, dtype=float), np.where(male, MIN_KCAL[True], MIN_KCAL[False]))
+    # 不低于基础代谢的 90%，避免过度节食
+    target = np.maximum(target, bmr * 0.9)
+
+    # 蛋白质按体重计算 (超重者用 BMI=24 对应的校正体重)
+    ref_weight = np.minimum(weight_kg, 24.0 * np.square(height_cm / 100))
+    protein_per_kg = np.where(np.asarray(goal_delta) < 0, 1.5, np.where(np.asarray(goal_delta) > 0, 1.8, 1.2))
+    protein_cap_g = ref_weight * param(protein_g_per_kg_max, np.inf)
+    protein_g = np.minimum(ref_weight * protein_per_kg, protein_cap_g)
+
+    fat_cap_g = target * param(fat_ratio_max, 1.0) / KCAL_PER_G["fat"]
+    fat_g = np.minimum(target * 0.28 / KCAL_PER_G["fat"], fat_cap_g)
+    carbs_g = (target - protein_g * KCAL_PER_G["protein"] - fat_g * KCAL_PER_G["fat"]) / KCAL_PER_G["carbs"]
+    # 碳水上限 (例如糖尿病)：超出部分转给仍有余量的蛋白质与脂肪，不突破它们各自的上限
+    carb_cap = target * param(carb_ratio_max, 1.0) / KCAL_PER_G["carbs"]
+    overflow_kcal = np.maximum(carbs_g - carb_cap, 0) * KCAL_PER_G["carbs"]
+    carbs_g = np.minimum(carbs_g, carb_cap)
+    fat_room = (fat_cap_g - fat_g) * KCAL_PER_G["fat"]
+    protein_room = (protein_cap_g - protein_g) * KCAL_PER_G["protein"]
+    # 先各分一半，一方余量不足时剩下的给另一方
+    to_fat = np.minimum(overflow_kcal * 0.5, fat_room)
+    to_protein = np.minimum(overflow_kcal * 0.5, protein_room)
+    to_fat = to_fat + np.minimum(overflow_kcal - to_fat - to_protein, fat_room - to_fat)
+    to_protein = to_protein + np.minimum(overflow_kcal - to_fat - to_protein, protein_room - to_protein)
+    fat_g = fat_g + to_fat / KCAL_PER_G["fat"]
+    protein_g = protein_g + to_protein / KCAL_PER_G["protein"]
+    # 三项都到上限仍凑不满目标热量：不突破限制，记录缺口由报告提示，交换份按实际分配的热量计算
+    unallocated = overflow_kcal - to_fat - to_protein
+
+    servings = exchange_servings_batch(target - unallocated, protein_g, carbs_g, fat_g)
+    result = {
+        "bmi": bmi, "bmr": bmr, "tdee": tdee, "target_kcal": target,
+        "protein_g": protein_g, "carbs_g": carbs_g, "fat_g": fat_g,
+        "unallocated_kcal": unallocated,
+        "total_servings": target / KCAL_PER_SERVING,
+    }
+    result.update({f"servings_{k}": v for k, v in servings.items()})
+    return result
+
+
+def exchange_servings_batch(target_kcal, protein_g, carbs_g, fat_g) -> dict:
+    """把宏量克数拆成各类食物交换份 (四舍五入到 0.5 份)"""
+    target_kcal = np.asarray(target_kcal, dtype=float)
+    half = lambda v: np.maximum(np.round(np.asarray(v) * 2) / 2, 0)  # noqa: E731
+
+    vegetables = np.full_like(target_kcal, 1.0)   # 约 500g 蔬菜
+    fruit = np.full_like(target_kcal, 1.0)        # 约 200g 水果
+    dairy = np.full_like(target_kcal, 1.5)        # 约 250ml 奶 + 少量豆制品
+    fixed = {"蔬菜类": vegetables, "水果类": fruit, "大豆乳类": dairy}
+
+    p_fixed = sum(EXCHANGE_GROUPS[k][0] * v for k, v in fixed.items())
+    c_fixed = sum(EXCHANGE_GROUPS[k][1] * v for k, v in fixed.items())
+    f_fixed = sum(EXCHANGE_GROUPS[k][2] * v for k, v in fixed.items())
+
+    grains = half((np.asarray(carbs_g) - c_fixed) / EXCHANGE_GROUPS["谷薯类"][1])
+    meat = half((np.asarray(protein_g) - p_fixed - grains * EXCHANGE_GROUPS["谷薯类"][0]) / EXCHANGE_GROUPS["肉蛋类"][0])
+    oil = half((np.asarray(fat_g) - f_fixed - meat * EXCHANGE_GROUPS["肉蛋类"][2]) / EXCHANGE_GROUPS["油脂类"][2])
+    # 烹调至少需要约 10g 油
+    oil = np.maximum(oil, MIN_OIL_SERVINGS)
+
+    # 最后按比例缩放谷薯类与肉蛋类，把总份数校正到目标热量
+    flexible = np.maximum(target_kcal / KCAL_PER_SERVING - sum(fixed.values()) - oil, 0)
+    scale = flexible / np.maximum(grains + meat, 0.5)
+    servings = dict(fixed, **{"谷薯类": half(grains * scale), "肉蛋类": half(meat * scale), "油脂类": oil})
+    return {k: servings[k] for k in EXCHANGE_GROUPS}
+
+
+# ============================================================
+# 4. 单份档案 -> 计算报告
+# ============================================================
+def _profile_params(profile: dict) -> dict:
+    """从档案文本解析出 calculate_batch 的参数与展示字段"""
+    male = is_male(profile.get("gender", ""))
+    factor, activity_label = activity_factor(profile.get("job_desc", ""))
+    delta, goal_label = goal_adjustment(profile.get("goals", ""))
+    conditions = detect_conditions(profile.get("health_issues", ""))
+
+    limits = {"carb_ratio_max": None, "fat_ratio_max": None, "protein_g_per_kg_max": None}
+    sodium_mg = DEFAULT_SODIUM_MG
+    for name in conditions:
+        rule = CONDITION_RULES[name]
+        for key in limits:
+            if key in rule:
+                limits[key] = rule[key] if limits[key] is None else min(limits[key], rule[key])
+        sodium_mg = min(sodium_mg, rule.get("sodium_mg", sodium_mg))
+    return {
+        "male": male, "activity_factor": factor, "activity_label": activity_label,
+        "goal_delta": delta, "goal_label": goal_label, "conditions": conditions,
+        "sodium_mg": sodium_mg, "limits": limits,
+    }
+
+
+def _profile_result(values: dict, params: dict, formula: str) -> dict:
+    result = dict(values)
+    result.update({
+        "formula": formula,
+        "male": params["male"],
+        "activity_factor": params["activity_factor"],
+        "activity_label": params["activity_label"],
+        "goal_label": params["goal_label"],
+        "goal_delta": params["goal_delta"],
+        "bmi_level": bmi_level(result["bmi"]),
+        "conditions": params["conditions"],
+        "sodium_mg": params["sodium_mg"],
+        "servings": {k: result[f"servings_{k}"] for k in EXCHANGE_GROUPS},
+        # 有未分配热量时按实际分配到宏量营养素的热量分餐，与交换份一致
+        "meals": {meal: (result["target_kcal"] - result["unallocated_kcal"]) * ratio for meal, ratio in MEAL_SPLIT},
+    })
+    return result
+
+
+def calculate_profile(profile: dict, formula: str = "mifflin") -> dict:
+    """
+    profile 字段与 app.py 侧边栏一致：
+    gender, age, height, weight, job_desc, health_issues, goals (以及可选的 preferences)
+    """
+    return calculate_profiles([profile], formula)[0]
+
+
+def calculate_profiles(profiles, formula: str = "mifflin"):
+    """批量版 calculate_profile：文本解析逐份进行，数值计算合并为一次 calculate_batch"""
+    params = [_profile_params(p) for p in profiles]
+    if not params:
+        return []
+
+    def column(key, default=None):
+        values = [p["limits"][key] for p in params]
+        # 全部为空时保持 None，由 calculate_batch 使用默认值
+        if all(v is None for v in values):
+            return None
+        return [np.inf if v is None else v for v in values]
+
+    batch = calculate_batch(
+        [p["male"] for p in params],
+        [float(p.get("age", 30)) for p in profiles],
+        [float(p.get("height", 170)) for p in profiles],
+        [float(p.get("weight", 65)) for p in profiles],
+        [p["activity_factor"] for p in params],
+        [p["goal_delta"] for p in params],
+        formula=formula, **{key: column(key) for key in params[0]["limits"]}
+    )
+    return [
+        _profile_result({k: float(np.asarray(v).reshape(-1)[i]) for k, v in batch.items()}, p, formula)
+        for i, p in enumerate(params)
+    ]
+
+
+def render_report(result: dict) -> str:
+    """渲染成与 task_calculation 预期输出一致的 Markdown 营养处方"""
+    kcal = result["target_kcal"]
+    formula = "Mifflin-St Jeor" if result["formula"] == "mifflin" else "Harris-Benedict"
+    macro_rows = []
+    for label, key, per_g in (("蛋白质", "protein_g", 4), ("碳水化合物", "carbs_g", 4), ("脂肪", "fat_g", 9)):
+        grams = result[key]
+        macro_rows.append(f"| {label} | {grams:.0f} g | {grams * per_g / kcal * 100:.0f}% |")
+    serving_rows = [f"| {k} | {v:g} 份 |" for k, v in result["servings"].items()]
+    meal_rows = [f"| {meal} | {v:.0f} kcal (约 {v / KCAL_PER_SERVING:.1f} 份) |" for meal, v in result["meals"].items()]
+
+    principles = [f"钠 < {result['sodium_mg']} mg/天 (食盐约 {result['sodium_mg'] * 2.54 / 1000:.1f} g)"]
+    sugar = [CONDITION_RULES[n]["added_sugar_g"] for n in result["conditions"] if "added_sugar_g" in CONDITION_RULES[n]]
+    if sugar:
+        principles.append(f"添加糖 < {min(sugar)}g/天")
+    for name in result["conditions"]:
+        principles.extend(r for r in CONDITION_RULES[name]["rules"] if r not in principles)
+    condition_labels = "、".join(CONDITION_RULES[n]["label"] for n in result["conditions"]) or "无明显异常"
+
+    return "\n".join([
+        "## 营养处方 (确定性计算)",
+        "",
+        "### 1. 能量计算",
+        f"- BMI: {result['bmi']:.1f} ({result['bmi_level']})",
+        f"- BMR ({formula}): {result['bmr']:.0f} kcal",
+        f"- 活动系数: {result['activity_factor']} ({result['activity_label']})，TDEE: {result['tdee']:.0f} kcal",
+        f"- 目标: {result['goal_label']} ({result['goal_delta']:+d} kcal)，**每日目标热量: {kcal:.0f} kcal**",
+        "",
+        "### 2. 宏量营养素",
+        "| 营养素 | 克数 | 供能比 |",
+        "|---|---|---|",
+        *macro_rows,
+        "",
+        f"### 3. 食物交换份 (1份 = 90kcal，共约 {result['total_servings']:.1f} 份)",
+        "| 类别 | 份数 |",
+        "|---|---|",
+        *serving_rows,
+        "",
+        "| 餐次 | 热量分配 |",
+        "|---|---|",
+        *meal_rows,
+        "",
+        f"### 4. 医学营养治疗原则 (识别到: {condition_labels})",
+        *[f"- {p}" for p in principles],
+        *_shortfall_note(result),
+    ])
+
+
+def _shortfall_note(result: dict):
+    """多项限制叠加时宏量营养素可能凑不满目标热量"""
+    shortfall = result.get("unallocated_kcal", 0)
+    if shortfall < 1:
+        return []
+    return ["", f"> ⚠️ 碳水 / 脂肪 / 蛋白质均已达到疾病限制上限，按上限分配后比目标热量少约 {shortfall:.0f} kcal，"
+                "请勿为补足热量突破上述限制，需由医生或营养师确认。"]
+
+
+def build_calculation_report(profile: dict, formula: str = "mifflin") -> str:
+    return render_report(calculate_profile(profile, formula))
@@ -0,0 +1,109 @@
+import random
+from nutrition_math import calculate_profiles, render_report
+from context_compaction import compact_targets, to_json
+
+# ============================================================
+# 1. 风味主题库
+# ============================================================
+ALL_THEMES = [
+    # --- 西式/异域 ---
+    "地中海风味 (橄榄油/番茄/海鲜/原味)",
+    "东南亚清新 (柠檬草/酸辣/鱼露/椰浆)",
+    "日式极简 (味噌/烤物/昆布高汤)",
+    "法式轻食 (慢煮/香草/红酒醋汁)",
+
+    # --- 中式地域风味 ---
+    "粤式清淡 (清蒸/煲汤/白灼/讲究鲜味)",
+    "川渝麻辣 (花椒/辣椒/红油/开胃)",
+    "湘菜香辣 (鲜椒/小炒/入味下饭)",
+    "淮扬鲜甜 (炖煮/刀工/清鲜平和)",
+    "东北炖菜 (酱香/乱炖/量大豪爽)",
+    "西北风味 (面食/牛羊肉/孜然)",
+    "云南山野 (菌菇/酸木瓜/香料丰富)",
+
+    # --- 功能/创意类 ---
+    "多彩彩虹碗 (强调食材颜色的丰富度)",
+    "温暖治愈系 (砂锅/炖菜/软糯易消化)",
+    "低卡欺骗餐 (重口味但低热量的创意菜)"
+]
+
+# 档案字段 (与 app.py 侧边栏一致) 及默认值
+PROFILE_DEFAULTS = {
+    "gender": "男", "age": 30, "height": 170, "weight": 65.0,
+    "job_desc": "", "breakfast": "", "lunch": "", "dinner": "",
+    "health_issues": "", "preferences": "", "goals": "",
+}
+
+
+# ============================================================
+# 2. 档案 -> Crew 输入
+# ============================================================
+def build_user_context(profile: dict) -> str:
+    """构建全景 Context (Prompt Engineering)"""
+    p = dict(PROFILE_DEFAULTS, **profile)
+    return f"""
+    【用户全景档案】
+    - 基础数据: 性别{p['gender']}, {p['age']}岁, {p['height']}cm, {p['weight']}kg
+    - 职业生活: {p['job_desc']}
+    - 饮食场景: 早餐[{p['breakfast']}], 午餐[{p['lunch']}], 晚餐[{p['dinner']}]
+    - 医学状况: {p['health_issues']}
+    - 偏好禁忌: {p['preferences']}
+    - 目标: {p['goals']}
+    """
+
+
+def pick_theme(theme: str = None):
+    """返回 (主题, 是否随机)；theme 为空时从主题库随机挑选"""
+    if theme:
+        return theme, False
+    return random.choice(ALL_THEMES), True
+
+
+def pick_themes(theme: str = None, days: int = 1):
+    """多日模式：返回 (每天的主题, 是否随机)，主题互不重复；theme 非空时作为第一天的主题"""
+    if days > len(ALL_THEMES):
+        raise ValueError(f"最多支持 {len(ALL_THEMES)} 天 (主题库共 {len(ALL_THEMES)} 个主题，每天不重复)")
+    if theme:
+        return [theme] + random.sample([t for t in ALL_THEMES if t != theme], days - 1), False
+    return random.sample(ALL_THEMES, days), True
+
+
+def build_job_payloads(profiles, themes=None, days: int = 1):
+    """
+    批量构建 recipe_design.run_nutrition_job 的参数。
+    营养处方由计算引擎一次性批量算出 (不经过 LLM)，注入到后续任务。
+    days > 1 时为多日计划：每天一个不重复的主题，画像与处方只算一次。
+    """
+    themes = themes or [None] * len(profiles)
+    results = calculate_profiles([dict(PROFILE_DEFAULTS, **p) for p in profiles])
+    payloads = []
+    for profile, targets, theme in zip(profiles, results, themes):
+        if days > 1:
+            day_themes, is_random = pick_themes(theme, days)
+            theme = day_themes[0]
+        else:
+            theme, is_random = pick_theme(theme)
+        payload = {
+            "inputs": {
+                "user_input_context": build_user_context(profile),
+                "creative_theme": theme,
+                # 传给 Agent 的是压缩后的 JSON 目标，Markdown 报告只用于界面展示
+                "calculation_report": to_json(compact_targets(targets)),
+            },
+            "nutrition_targets": targets,
+            "preferences": profile.get("preferences", ""),
+            "is_random": is_random,
+            "calculation_report": render_report(targets),
+        }
+        if days > 1:
+            payload["days"] = days
+            payload["themes"] = day_themes
+            payload["inputs"].update({f"creative_theme_day{day}": t for day, t in enumerate(day_themes, 1)})
+            payload["inputs"]["days"] = days
+            payload["inputs"]["weekly_themes"] = "\n".join(f"- 第 {day} 天：{t}" for day, t in enumerate(day_themes, 1))
+        payloads.append(payload)
+    return payloads
+
+
+def build_job_payload(profile: dict, theme: str = None, days: int = 1) -> dict:
+    return build_job_payloads([profile], [theme], days)[0]
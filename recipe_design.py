@@ -1,28 +1,123 @@
 import os
+from contextlib import contextmanager
 from crewai import Agent, Task, Crew, Process
 from tools_fatsecret import FatSecretSearchTool
-from langchain_openai import ChatOpenAI
+from tools_portion import PortionSolverTool
+from tools_nutrition import NutritionCalculatorTool
+from menu_audit import (make_audit_callback, menu_rows, menu_tables, merge_shopping_list, render_shopping_list,
+                        tool_lookup)
+from crew_runner import DagCrew, prefetch_terms, start_prefetch
+from checkpoints import CheckpointStore
+from llm_replay import render_token_usage, reset_task_usage, wrap_llm
+from llm_router import RouterLLM
+from instrumentation import summarize, trace
+from context_compaction import compact_profile_callback, make_menu_callback
+from resources import CrewPool, lazy_import, singleton, timed
+from token_stream import STREAM_TASKS
 from dotenv import load_dotenv
 
 load_dotenv()
 
 os.environ["CREWAI_TELEMETRY_OPT_OUT"] = "true"
 
-# 1. 配置 Qwen 模型
-qwen_llm = ChatOpenAI(
-    model="qwen3-max",
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=os.getenv("OPENAI_API_BASE"),
-    temperature=0.7
-)
 
-fatsecret_tool_instance = FatSecretSearchTool(
-    client_id=os.getenv('FATSECRET_CLIENT_ID'),
-    client_secret=os.getenv('FATSECRET_CLIENT_SECRET')
-)
+# ============================================================
+# 0. 进程级共享资源 (首次使用时构建，之后每次请求直接复用)
+# ============================================================
+# 1. 配置 Qwen 模型 (LLM_REPLAY_MODE=record / replay 时录制或离线回放)
+def make_qwen_llm(model: str = "qwen3-max", stream: bool = False):
+    def build():
+        ChatOpenAI = lazy_import("langchain_openai").ChatOpenAI
+        return wrap_llm(ChatOpenAI(
+            model=model,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_API_BASE"),
+            temperature=0.7
+        ), stream=stream)
+    return singleton(f"llm:{model}:stream" if stream else f"llm:{model}", build)
 
 
-def create_nutrition_crew():
+def route_llm(route: str):
+    """
+    按路由 (见 llm_router.DEFAULT_ROUTES) 在 qwen3-max / qwen-plus / qwen-turbo 之间选择档位。
+    每个 Agent 一个 RouterLLM (token 用量按 Agent 统计，Crew 汇总时不会重复计算)，各档位 LLM 仍是进程内单例
+    """
+    # 最终交付阶段流式输出，界面逐 token 显示 (见 token_stream)
+    stream = route in STREAM_TASKS
+    return RouterLLM(route, lambda model: make_qwen_llm(model, stream))
+
+
+def get_fatsecret_tool():
+    return singleton("tool:fatsecret", lambda: FatSecretSearchTool(
+        client_id=os.getenv('FATSECRET_CLIENT_ID'),
+        client_secret=os.getenv('FATSECRET_CLIENT_SECRET')
+    ))
+
+
+def get_portion_tool():
+    return singleton("tool:portion", lambda: PortionSolverTool(nutrient_tool=get_fatsecret_tool()))
+
+
+def get_nutrition_tool():
+    return singleton("tool:nutrition", NutritionCalculatorTool)
+
+
+# 确定性计算模式下，营养处方由 nutrition_math 预先算好，通过 {calculation_report} 注入
+CALCULATION_REPORT_SECTION = """
+        **营养处方 (已由计算引擎精确算出，直接采用，不要重新计算)**：
+        {calculation_report}
+"""
+
+# 多日模式下追加到每天的菜单任务 ({day} 在构建任务时替换)
+MULTI_DAY_MENU_SECTION = """
+        **多日计划**：这是 {days} 天计划中的第 {day} 天，只设计这一天的三餐，其他天由同事按各自的主题负责。
+"""
+
+
+def get_checkpoint_store():
+    """任务检查点库 (进程内共享，首次使用时创建)"""
+    return singleton("checkpoints", lambda: CheckpointStore("crew_checkpoints.db"))
+
+
+def prefetch_nutrients(creative_theme, preferences: str = ""):
+    """
+    在画像 / 计算阶段运行期间，后台预取主题关键食材与用户偏好食材的营养数据。
+    creative_theme 可以是多个主题 (多日模式)，所有主题的食材合并去重后一次性查询。
+    """
+    themes = [creative_theme] if isinstance(creative_theme, str) else creative_theme
+    terms = []
+    for theme in themes:
+        for term in prefetch_terms(theme, preferences):
+            if term not in terms:
+                terms.append(term)
+    return start_prefetch(get_fatsecret_tool(), terms)
+
+
+def is_menu_task(task) -> bool:
+    """单日模式为 menu_design，多日模式为 menu_design_day1 ... menu_design_dayN"""
+    return (task.name or "").startswith("menu_design")
+
+
+def menu_callback(nutrition_targets: dict = None, compact_context: bool = True):
+    """菜单任务的回调依赖本次请求的营养目标，复用 Crew 模板时需要重新绑定"""
+    factory = make_menu_callback if compact_context else make_audit_callback
+    return factory(tool_lookup(get_fatsecret_tool()), nutrition_targets)
+
+
+def create_nutrition_crew(deterministic_calculation: bool = True, nutrition_targets: dict = None,
+                          scheduler: str = "dag", checkpoints: bool = True, compact_context: bool = True,
+                          days: int = 1):
+    """
+    deterministic_calculation=True 时跳过 LLM 计算环节 (clinical_calculator)，
+    kickoff 的 inputs 需要额外提供 calculation_report (见 nutrition_math.build_calculation_report)。
+    nutrition_targets: nutrition_math.calculate_profile 的结果，用于程序化核对食谱表格；为空时只核对表内热量估算。
+    scheduler: "dag" 按任务 context 依赖分层并行执行；"sequential" 为 CrewAI 原生顺序执行。
+    checkpoints: 仅 dag 模式有效；复用输入未变的任务输出 (例如只换主题时跳过画像阶段)，并支持崩溃后续跑。
+    compact_context: 画像与菜单的输出压缩为校验过的精简 JSON 再传给下游任务，减少提示词 token。
+    days: 大于 1 时为多日模式：画像与处方只算一次，之后 N 个单日菜单任务并行 (各用一个膳食策划师实例，
+          主题取 inputs 中的 creative_theme_day1 ... creative_theme_dayN)，最后一次质检汇总全部天数。
+          inputs 还需提供 days 与 weekly_themes (见 plan_inputs.build_job_payloads)。
+    """
     # ==============================================================================
     # 1. 定义 Agents (智能体)
     # ==============================================================================
@@ -33,7 +128,7 @@ def create_nutrition_crew():
         goal='建立带有医学视角的营养诊断书',
         backstory="""你是一名专业的健康数据分析师。
         你擅长从用户零散的描述中挖掘出关键信息，进行风险分层、生活流标签化以及明确核心目标""",
-        llm=qwen_llm,
+        llm=route_llm("profile"),
         verbose=True,
         allow_delegation=False,
         memory=True  # 开启短期记忆
@@ -46,28 +141,31 @@ def create_nutrition_crew():
         backstory="""你是一名严谨的临床营养师。你只相信数据和生化指标。
         你需要根据用户的目标进行合理安排和计算。
         你需要根据用户的疾病情况（如糖尿病、高血压）给出具体的营养限制策略（如：限钠、控糖）。
-        你需要输出具体的数字：总热量、碳水/蛋白/脂肪的克数。""",
-        llm=qwen_llm,
+        你需要输出具体的数字：总热量、碳水/蛋白/脂肪的克数。
+        计算公式交给营养处方计算工具，不要心算。""",
+        tools=[get_nutrition_tool()],
+        llm=route_llm("calculation"),
         verbose=True,
         allow_delegation=False
     )
 
-    # 3. Agent-3: 膳食架构师
-    menu_architect = Agent(
-        role='高级膳食策划师',
-        goal='将枯燥的营养数据转化为美味、可执行的一日三餐食谱。',
-        backstory="""你是一名精通'食物交换份法'的营养师。
-        你拥有查询权威数据库(FatSecret)的能力。
-        你必须根据计算出的份数，安排具体的食材和重量。
-        例如：如果你查询到米饭100g是130kcal，而你需要安排2份谷薯(180kcal)，
-        你应该计算出需要 180/130*100 = 约138g 米饭。""",
+    # 3. Agent-3: 膳食架构师 (同一个 Agent 不能同时执行两个任务，多日模式每天一个实例)
+    def make_menu_architect():
+        return Agent(
+            role='高级膳食策划师',
+            goal='将枯燥的营养数据转化为美味、可执行的一日三餐食谱。',
+            backstory="""你是一名精通'食物交换份法'的营养师。
+            你拥有查询权威数据库(FatSecret)的能力。
+            你必须根据计算出的份数，安排具体的食材和重量。
+            食材克数不要自己心算，交给份量计算工具一次性精确求解。""",
 
-        # === 这里挂载 FatSecret 工具 ===
-        tools=[fatsecret_tool_instance],
+            # === 这里挂载 FatSecret 工具 与 份量计算工具 ===
+            tools=[get_fatsecret_tool(), get_portion_tool()],
 
-        verbose=True,
-        allow_delegation=False
-    )
+            llm=route_llm("menu_design"),
+            verbose=True,
+            allow_delegation=False
+        )
 
     # Agent-4: 质检与仿真专员
     qa_simulator = Agent(
@@ -75,10 +173,12 @@ def create_nutrition_crew():
         goal='模拟用户视角体验食谱，并检查营养指标的合规性。',
         backstory="""你非常挑剔。你会扮演用户去'试吃'这份食谱。
         如果食谱太难做、食材太贵、口感太单一、与用户的目标不符或违反医嘱，你必须提出批评并修正。
-        你需要确保最终输出包含购物清单和备餐指南。""",
-        llm=qwen_llm,
+        你需要确保最终输出包含购物清单和备餐指南。
+        热量与宏量数据已由程序核对过，你只需处理被标记的偏差。""",
+        # 路由名与质检任务名一致 (单日 qa_review / 多日 weekly_review)，档位、超时与录制回放的键都按它区分
+        llm=route_llm("qa_review" if days <= 1 else "weekly_review"),
         verbose=True,
-        allow_delegation=True  # 允许它指派任务回给架构师进行修改（在复杂流程中有效，这里简化为单向）
+        allow_delegation=False  # 数据偏差已由程序核对给出，直接修正即可，不再指派回架构师
     )
 
     # ==============================================================================
@@ -86,6 +186,7 @@ def create_nutrition_crew():
     # ==============================================================================
 
     task_profile = Task(
+        name="profile",
         description="""
         **任务目标**：对用户提供的自然语言描述进行深度拆解。
 
@@ -103,10 +204,12 @@ def create_nutrition_crew():
         输出一份严格的 JSON 格式报告。
         """,
         expected_output="包含风险评估和生活方式标签的深度用户画像 JSON。",
-        agent=profile_analyst
+        agent=profile_analyst,
+        callback=compact_profile_callback if compact_context else None
     )
 
     task_calculation = Task(
+        name="calculation",
         description="""
         **任务目标**：制定精准的医学营养干预方案（MNT）。
 
@@ -124,10 +227,11 @@ def create_nutrition_crew():
         context=[task_profile]
     )
 
-    task_menu_design = Task(
-        description="""
-        **任务目标**：将抽象的营养数字落地为用户场景下可执行的食谱。
+    calculation_section = CALCULATION_REPORT_SECTION if deterministic_calculation else ""
 
+    menu_description = """
+        **任务目标**：将抽象的营养数字落地为用户场景下可执行的食谱。
+        """ + calculation_section + """
         **核心约束**：
         - 必须严格遵循用户偏好和禁忌。
         - **场景适配**：如果用户中午吃外卖，请推荐具体的外卖选购组合。
@@ -147,50 +251,185 @@ def create_nutrition_crew():
         3. **Step 3 - 单次调用**：调用 Search Tool **一次性**获取数据。
                    - **⚠️ 重要参数说明**: 工具接受的参数名为 `query`。
                    - **正确调用示例**: `Search FatSecret Nutrition Data(query="rice, egg")`
-                   - **错误调用示例**: `Search FatSecret Nutrition Data("rice, egg")` 或使用中文
-                                     `Search FatSecret Nutrition Data("米饭， 鸡蛋")`
-        4. **Step 4 - 份额计算**：`食材重量(g) = (计划摄入热量 / 该食材每100g热量) * 100`。
+                                     或 `Search FatSecret Nutrition Data(query="米饭, 鸡蛋")` (中英文食材名均可)
+                   - **错误调用示例**: `Search FatSecret Nutrition Data("rice, egg")` (缺少 query 参数名)
+        4. **Step 4 - 份额计算**：调用 `Solve Ingredient Portions` **一次性**传入每餐的份数/宏量目标和候选食材，
+                   直接使用工具返回的克数表，不要自行推算。
 
         **格式要求**：
         请输出标准的 Markdown 表格，列出：[餐次, 推荐菜品, 核心食材及生重(g), 热量估算]。
-        """,
-        expected_output="一份包含详细食材重量、热量标注及外卖指南的Markdown格式食谱。",
-        agent=menu_architect,
-        context=[task_profile, task_calculation]
-    )
+        """
 
-    task_qa_review = Task(
-        description="""
-        **任务目标**：对食谱进行“压力测试”。
-
-        **检查项**：
-        1. **风格一致性**：检查食谱是否符合 **"{creative_theme}"** 的主题？如果是“川渝风味”却全是水煮菜，请驳回重写。
-        2. **时间可行性**：用户的工作强度能否完成此烹饪？
-        3. **医疗安全**：是否违反了用户的病史禁忌？
-        4. **数据核对**：抽查热量计算是否准确。
-        5. **目标完成度** 检查是否满足用户的目标
-
-        **最终交付**：
-        生成最终文档，包括：
-        - [最终食谱表格]
-        - [分类购物清单]
-        - [暖心备餐指南]
-        """,
-        expected_output="最终确认的食谱文档，语言亲切，包含鼓励话语。",
-        agent=qa_simulator,
-        context=[task_menu_design, task_calculation]
-    )
+    def make_menu_task(day: int = None):
+        """day 为空时是单日菜单；多日模式下第 day 天的主题取 {creative_theme_day<day>}"""
+        description = menu_description
+        if day is not None:
+            description = description.replace("{creative_theme}", f"{{creative_theme_day{day}}}") + \
+                MULTI_DAY_MENU_SECTION.replace("{day}", str(day))
+        return Task(
+            name="menu_design" if day is None else f"menu_design_day{day}",
+            description=description,
+            expected_output="一份包含详细食材重量、热量标注及外卖指南的Markdown格式食谱。",
+            agent=make_menu_architect(),
+            context=[task_profile] if deterministic_calculation else [task_profile, task_calculation],
+            # 按营养数据库重新计算表格中的热量 / 宏量；压缩模式下输出替换为 {items, totals, audit, notes} JSON
+            callback=menu_callback(nutrition_targets, compact_context)
+        )
+
+    menu_tasks = [make_menu_task()] if days <= 1 else [make_menu_task(day) for day in range(1, days + 1)]
+
+    # 单日质检 (qa_review) 与多日质检 (weekly_review) 只构建其一；两者都在 token_stream.STREAM_TASKS
+    # 与 llm_router.DEFAULT_ROUTES 中有各自的条目 (流式输出 / 档位与超时)
+    if days <= 1:
+        review = Task(
+            name="qa_review",
+            description="""
+            **任务目标**：对食谱进行“压力测试”。
+            """ + calculation_section + """
+            **检查项**：
+            1. **风格一致性**：检查食谱是否符合 **"{creative_theme}"** 的主题？如果是“川渝风味”却全是水煮菜，请驳回重写。
+            2. **时间可行性**：用户的工作强度能否完成此烹饪？
+            3. **医疗安全**：是否违反了用户的病史禁忌？
+            4. **数据核对**：上游的【程序化营养核对】(压缩 JSON 中的 audit 字段) 已按数据库重新计算了全部热量与宏量，
+               只需针对其中列出的偏差项调整食材克数，不要重新计算其他数据。
+            5. **目标完成度** 检查是否满足用户的目标
+
+            **最终交付**：
+            生成最终文档 (上游菜单如为 JSON，items 中 source 为食材原文、ingredients 为 [名称, 生重g]，请据此还原为 Markdown 表格)，包括：
+            - [最终食谱表格]
+            - [分类购物清单]
+            - [暖心备餐指南]
+            """,
+            expected_output="最终确认的食谱文档，语言亲切，包含鼓励话语。",
+            agent=qa_simulator,
+            context=menu_tasks if deterministic_calculation else menu_tasks + [task_calculation]
+        )
+    else:
+        # 多日模式：一次质检覆盖全部天数，购物清单由程序按质检后的每日表格汇总 (见 menu_audit.merge_shopping_list)
+        review = Task(
+            name="weekly_review",
+            description="""
+            **任务目标**：对 {days} 天的食谱进行整体“压力测试”。每天的限定主题：
+            {weekly_themes}
+            """ + calculation_section + """
+            **检查项**：
+            1. **风格一致性**：每天的菜品是否符合当天的主题？不同天之间不要出现重复的菜品。
+            2. **时间可行性**：用户的工作强度能否完成此烹饪？多天共用的食材可以提前批量处理。
+            3. **医疗安全**：是否违反了用户的病史禁忌？
+            4. **数据核对**：上游每一天的【程序化营养核对】(压缩 JSON 中的 audit 字段) 已按数据库重新计算了全部热量与宏量，
+               只需针对其中列出的偏差项调整食材克数，不要重新计算其他数据。
+            5. **目标完成度** 检查是否满足用户的目标
+
+            **最终交付**：
+            生成最终文档 (上游菜单如为 JSON，items 中 source 为食材原文、ingredients 为 [名称, 生重g]，请据此还原为 Markdown 表格)，包括：
+            - [第 N 天 · 主题] 每天一个最终食谱表格，列为 [餐次, 推荐菜品, 核心食材及生重(g), 热量估算]
+            - [全周备餐指南]
+            购物清单由系统按你输出的每日表格中的 [核心食材及生重(g)] 自动汇总，不需要输出；
+            因此每个表格都要写全当天的食材与生重克数 (调整过的克数直接写调整后的值)。
+            """,
+            expected_output="按天排列的最终食谱文档与全周备餐指南，语言亲切，包含鼓励话语。",
+            agent=qa_simulator,
+            context=menu_tasks if deterministic_calculation else menu_tasks + [task_calculation]
+        )
 
     # ==============================================================================
     # 3. 组建 Crew 并执行
     # ==============================================================================
 
-    nutrition_crew = Crew(
-        agents=[profile_analyst, clinical_calculator, menu_architect, qa_simulator],
-        tasks=[task_profile, task_calculation, task_menu_design, task_qa_review],
-        process=Process.sequential,  # 顺序执行：Task 1 -> Task 2 -> Task 3 -> Task 4
+    if deterministic_calculation:
+        agents = [profile_analyst] + [t.agent for t in menu_tasks] + [qa_simulator]
+        tasks = [task_profile] + menu_tasks + [review]
+    else:
+        agents = [profile_analyst, clinical_calculator] + [t.agent for t in menu_tasks] + [qa_simulator]
+        tasks = [task_profile, task_calculation] + menu_tasks + [review]
+
+    crew_options = {}
+    if scheduler == "dag":
+        crew_class = DagCrew
+        crew_options["checkpoints"] = get_checkpoint_store() if checkpoints else None
+        # 各天的菜单任务在同一层，全部并行
+        if days > 1:
+            crew_options["max_parallel"] = days
+    else:
+        crew_class = Crew
+    nutrition_crew = crew_class(
+        **crew_options,
+        agents=agents,
+        tasks=tasks,
+        process=Process.sequential,  # 顺序执行：Task 1 -> (Task 2) -> Task 3 -> Task 4
         verbose=True,
         tracing=True
     )
 
     return nutrition_crew
+
+
+# ============================================================
+# 4. Crew 模板复用
+# ============================================================
+_crew_pool = CrewPool(create_nutrition_crew)
+
+
+@contextmanager
+def lease_nutrition_crew(nutrition_targets: dict = None, deterministic_calculation: bool = True,
+                         scheduler: str = "dag", checkpoints: bool = True, compact_context: bool = True,
+                         days: int = 1):
+    """
+    从模板池借出一个 Crew (参数同 create_nutrition_crew)，只重新绑定本次请求相关的部分：
+    菜单核对回调 (营养目标) 与按任务的 token 统计；Agent / Task / LLM / 工具全部复用。
+    """
+    options = dict(deterministic_calculation=deterministic_calculation, scheduler=scheduler,
+                   checkpoints=checkpoints, compact_context=compact_context, days=days)
+    with _crew_pool.lease(**options) as crew:
+        with timed("crew bind", "bind"):
+            for task in crew.tasks:
+                if is_menu_task(task):
+                    task.callback = menu_callback(nutrition_targets, compact_context)
+            reset_task_usage(crew.tasks)
+            for agent in crew.agents:
+                if isinstance(agent.llm, RouterLLM):
+                    agent.llm.reset_token_usage()
+            # 复用检查点的任务不会重新计时，清掉上一次请求留下的耗时
+            for task in crew.tasks:
+                task.start_time = task.end_time = None
+        yield crew
+
+
+def weekly_shopping_list(crew, reviewed: str) -> str:
+    """
+    按质检后的最终食谱 (每天一个表格) 汇总购物清单，与质检调整后的克数一致；
+    质检输出解析不到表格时退回各天菜单任务的输出，并注明是调整前的数据
+    """
+    menus = menu_tables(reviewed)
+    if menus:
+        return render_shopping_list(merge_shopping_list(menus))
+    menus = [menu_rows(task.output.raw) for task in crew.tasks if is_menu_task(task) and task.output]
+    return "> ⚠️ 未能解析质检后的食谱表格，以下按质检调整前的菜单汇总。\n\n" + \
+        render_shopping_list(merge_shopping_list(menus))
+
+
+def run_nutrition_job(payload: dict) -> dict:
+    """
+    后台任务入口 (见 jobs.JobQueue)。
+    payload: {"inputs": kickoff 输入, "nutrition_targets": calculate_profile 结果, "preferences": 偏好文本,
+              多日模式另有 "days" 与每天的主题 "themes"}
+    """
+    inputs = payload["inputs"]
+    days = payload.get("days", 1)
+    with trace("nutrition_plan", theme=inputs.get("creative_theme", ""), days=days) as current:
+        # 画像阶段运行期间，后台预热 (全部) 主题与偏好中的食材营养数据
+        prefetch_nutrients(payload.get("themes") or inputs.get("creative_theme", ""), payload.get("preferences", ""))
+        with lease_nutrition_crew(nutrition_targets=payload.get("nutrition_targets"), days=days) as crew:
+            output = crew.kickoff(inputs=inputs)
+            markdown = str(output)
+            if days > 1:
+                markdown += f"\n\n## 🛒 {days} 天购物清单 (按生重汇总)\n\n" + weekly_shopping_list(crew, markdown)
+            result = {
+                "markdown": markdown,
+                "token_usage": render_token_usage(crew.tasks),
+                # 各阶段耗时 (秒)；复用检查点的阶段为 None
+                "stages": {task.name: task.execution_duration for task in crew.tasks},
+            }
+    # 按任务拆分的 LLM / 工具耗时与食材查询命中层级 (见 instrumentation.render_summary)
+    result["breakdown"] = summarize(current.spans)
+    return result
@@ -0,0 +1,120 @@
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable
+
+# ============================================================
+# 1. 耗时统计 (导入 / 构建 / 请求绑定)
+# ============================================================
+# 名称 -> {"kind", "count", "total", "last"}
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def timed(name: str, kind: str = "build"):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        with _timings_lock:
+            entry = _timings.setdefault(name, {"kind": kind, "count": 0, "total": 0.0, "last": 0.0})
+            entry["count"] += 1
+            entry["total"] += elapsed
+            entry["last"] = elapsed
+
+
+def timings() -> dict:
+    with _timings_lock:
+        return {name: dict(entry) for name, entry in _timings.items()}
+
+
+def render_timings() -> str:
+    """Markdown 表格：每项资源的类型、次数、累计与最近一次耗时"""
+    kinds = {"import": "导入", "build": "构建", "bind": "绑定"}
+    lines = ["| 资源 | 类型 | 次数 | 累计(s) | 最近(s) |", "|---|---|---|---|---|"]
+    for name, t in sorted(timings().items(), key=lambda item: -item[1]["total"]):
+        lines.append(f"| {name} | {kinds.get(t['kind'], t['kind'])} | {t['count']} "
+                     f"| {t['total']:.3f} | {t['last']:.3f} |")
+    return "\n".join(lines)
+
+
+# ============================================================
+# 2. 延迟导入与进程级单例
+# ============================================================
+def lazy_import(module: str):
+    """首次使用时才导入重量级依赖 (crewai / langchain 等)，并记录导入耗时"""
+    loaded = sys.modules.get(module)
+    if loaded is not None:
+        return loaded
+    with timed(module, "import"):
+        return importlib.import_module(module)
+
+
+_singletons = {}
+_singleton_locks = {}
+_singletons_lock = threading.Lock()
+
+
+def singleton(name: str, factory: Callable[[], Any]):
+    """进程内只构建一次 (Streamlit 每次重跑脚本都会拿到同一个对象)；并发首次调用只会构建一次"""
+    value = _singletons.get(name)
+    if value is not None:
+        return value
+    with _singletons_lock:
+        lock = _singleton_locks.setdefault(name, threading.Lock())
+    with lock:
+        value = _singletons.get(name)
+        if value is None:
+            with timed(name, "build"):
+                value = _singletons[name] = factory()
+    return value
+
+
+# ============================================================
+# 3. Crew 模板池
+# ============================================================
+class CrewPool:
+    """
+    Crew 在一次 kickoff 期间会写入任务输出，不能被两个请求同时使用；
+    但 kickoff 每次都从原始描述重新插值，用完归还后可以直接复用。
+    按构建参数分组，空闲时复用，没有空闲的模板时才新建。
+    """
+
+    def __init__(self, build: Callable[..., Any], max_idle: int = 4):
+        self.build = build
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.stats = {"built": 0, "reused": 0}
+
+    def acquire(self, **options):
+        key = tuple(sorted(options.items()))
+        with self._lock:
+            idle = self._idle.get(key)
+            crew = idle.pop() if idle else None
+        if crew is not None:
+            self.stats["reused"] += 1
+            return crew
+        with timed("crew template", "build"):
+            crew = self.build(**options)
+        self.stats["built"] += 1
+        return crew
+
+    def release(self, crew, **options):
+        key = tuple(sorted(options.items()))
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(crew)
+
+    @contextmanager
+    def lease(self, **options):
+        crew = self.acquire(**options)
+        try:
+            yield crew
+        finally:
+            self.release(crew, **options)
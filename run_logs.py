@@ -0,0 +1,147 @@
+import contextvars
+import logging
+import re
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# 每次运行最多保留的日志行数 / 单行最大长度
+MAX_LINES = 2000
+MAX_LINE_CHARS = 2000
+
+_ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+
+# ============================================================
+# 1. 单次运行的日志缓冲 (有界环形缓冲)
+# ============================================================
+class RunLog:
+    """
+    一次运行 (一个用户的一次生成) 的日志。
+    - 只保留最近 max_lines 行，长时间运行内存恒定
+    - seq 记录累计写入的行数，界面据此判断是否有新内容、丢弃了多少行
+    - echo=False 时不再同时输出到终端 (批量运行时避免多个 Crew 的输出交错)
+    """
+
+    def __init__(self, max_lines: int = MAX_LINES, echo: bool = True):
+        self.echo = echo
+        self.lines = deque(maxlen=max_lines)
+        self.seq = 0
+        self._partial = ""
+        self._lock = threading.Lock()
+
+    def write(self, text: str):
+        text = _ANSI_ESCAPE.sub("", text)
+        with self._lock:
+            parts = (self._partial + text).split("\n")
+            # 最后一段没有换行，留到下次拼接
+            self._partial = parts.pop()
+            for line in parts:
+                self._append(line)
+
+    def add_line(self, line: str):
+        """整行写入 (logging 记录)，不与 stdout 中未结束的行拼接"""
+        with self._lock:
+            for part in _ANSI_ESCAPE.sub("", line).split("\n"):
+                self._append(part)
+
+    def _append(self, line: str):
+        line = line.rstrip()
+        if not line.strip():
+            return
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS - 1] + "…"
+        self.lines.append(line)
+        self.seq += 1
+
+    def flush(self):
+        with self._lock:
+            if self._partial:
+                self._append(self._partial)
+                self._partial = ""
+
+    def snapshot(self):
+        """返回 (seq, 缓冲中的行, 已丢弃的行数)"""
+        with self._lock:
+            return self.seq, list(self.lines), self.seq - len(self.lines)
+
+    def text(self, tail: int = None) -> str:
+        """拼接缓冲中的日志；tail 只取最后若干行 (运行中刷新界面时用，控制每次推送的大小)"""
+        _, lines, dropped = self.snapshot()
+        if tail and len(lines) > tail:
+            dropped += len(lines) - tail
+            lines = lines[-tail:]
+        head = [f"... ({dropped} earlier lines omitted)"] if dropped else []
+        return "\n".join(head + lines)
+
+
+# ============================================================
+# 2. 按上下文分发 stdout / logging
+# ============================================================
+# 当前线程 (及用 copy_context 派生的工作线程) 的日志去向
+_current = contextvars.ContextVar("run_log", default=None)
+
+
+class _StdoutRouter:
+    """
+    进程内只安装一次的 sys.stdout 代理：
+    原样写到终端，同时写入当前上下文绑定的 RunLog，不同用户的运行互不串线。
+    """
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+
+    def write(self, message):
+        run_log = _current.get()
+        if run_log is None or run_log.echo:
+            self.terminal.write(message)
+        if run_log is not None:
+            run_log.write(message)
+        return len(message)
+
+    def flush(self):
+        self.terminal.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.terminal, name)
+
+
+class RunLogHandler(logging.Handler):
+    """把 logging 记录写入当前上下文绑定的 RunLog"""
+
+    def emit(self, record):
+        run_log = _current.get()
+        if run_log is None:
+            return
+        try:
+            run_log.add_line(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+_install_lock = threading.Lock()
+
+
+def install():
+    """安装 stdout 代理与 logging handler (幂等)"""
+    with _install_lock:
+        if not isinstance(sys.stdout, _StdoutRouter):
+            sys.stdout = _StdoutRouter(sys.stdout)
+        root = logging.getLogger()
+        if not any(isinstance(h, RunLogHandler) for h in root.handlers):
+            handler = RunLogHandler()
+            handler.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+            root.addHandler(handler)
+
+
+@contextmanager
+def capture(run_log: RunLog):
+    """在当前上下文内把 print / logging 输出收集到 run_log (新线程需在线程内调用)"""
+    install()
+    token = _current.set(run_log)
+    try:
+        yield run_log
+    finally:
+        run_log.flush()
+        _current.reset(token)
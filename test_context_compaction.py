@@ -0,0 +1,24 @@
+import json
+from context_compaction import make_menu_callback
+
+
+class _Output:
+    def __init__(self, raw):
+        self.raw = raw
+
+
+def test_unparsed_items_keep_the_raw_menu(menu, lookup):
+    output = _Output(menu)
+    make_menu_callback(lookup)(output)
+    assert output.raw.startswith(menu.strip())
+    assert "汉堡 1个" in output.raw
+
+
+def test_digest_keeps_source_text_and_claimed_kcal(menu, lookup):
+    breakfast_only = menu.split("| 午餐")[0]
+    output = _Output(breakfast_only)
+    make_menu_callback(lookup)(output)
+    item = json.loads(output.raw)["items"][0]
+    assert item["source"] == "燕麦 50g、香蕉 1根、牛奶 250ml"
+    assert item["claimed_kcal"] == 1050
+    assert ["香蕉", 120.0] in item["ingredients"]
@@ -0,0 +1,65 @@
+import pytest
+import requests
+from fatsecret_client import FatSecretAuthError, FatSecretClient, FatSecretUnavailable
+from throttle import RetryPolicy
+
+
+class _Response:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.headers = {}
+        self._payload = payload or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self._payload
+
+
+class _Session:
+    def __init__(self, token_responses):
+        self.token_responses = list(token_responses)
+        self.token_calls = 0
+
+    def post(self, *args, **kwargs):
+        self.token_calls += 1
+        response = self.token_responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def get(self, *args, **kwargs):
+        return _Response(200, {"foods": {}})
+
+
+def _client(token_responses):
+    client = FatSecretClient("id", "secret", retry_policy=RetryPolicy(base_delay=0, max_delay=0))
+    client.session = _Session(token_responses)
+    return client
+
+
+def test_token_network_error_is_retried_not_auth_failure():
+    client = _client([requests.ConnectionError("reset"), _Response(200, {"access_token": "t"})])
+    assert client.lookup("egg") is None
+    assert client.session.token_calls == 2
+    assert client.retry_policy.retries == 1
+
+
+def test_token_network_outage_surfaces_as_unavailable():
+    client = _client([requests.Timeout("slow")] * 3)
+    with pytest.raises(FatSecretUnavailable, match="Network Error"):
+        client.lookup("egg")
+
+
+def test_rejected_credentials_are_auth_errors():
+    client = _client([_Response(401)])
+    with pytest.raises(FatSecretAuthError):
+        client.lookup("egg")
+
+
+def test_token_refresh_does_not_share_a_flight_with_lookups():
+    client = _client([_Response(200, {"access_token": "t"})])
+    assert client.lookup("__token__") is None
+    assert client.session.token_calls == 1
@@ -0,0 +1,29 @@
+import pytest
+from food_query import canonicalize, similarity, singularize
+
+
+@pytest.mark.parametrize("plural, singular", [
+    ("olives", "olive"), ("chives", "chive"), ("cloves", "clove"),
+    ("leaves", "leaf"), ("loaves", "loaf"), ("tomatoes", "tomato"), ("berries", "berry"),
+])
+def test_singularize(plural, singular):
+    assert singularize(plural) == singular
+
+
+def test_plural_and_singular_share_a_key():
+    assert canonicalize("Olives").key == canonicalize("olive").key
+    assert canonicalize("garlic cloves").key == canonicalize("garlic clove").key
+
+
+@pytest.mark.parametrize("query, cached", [
+    ("cooked rice", "rice"),
+    ("raw chicken breast", "chicken breast"),
+    ("boiled lentils", "lentil"),
+])
+def test_one_sided_method_is_incompatible_for_method_sensitive_foods(query, cached):
+    assert similarity(canonicalize(query), canonicalize(cached)) == 0.0
+
+
+def test_one_sided_method_is_only_downweighted_for_other_foods():
+    score = similarity(canonicalize("steamed broccoli"), canonicalize("broccoli"))
+    assert 0.75 < score < 1.0
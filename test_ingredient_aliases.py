@@ -0,0 +1,34 @@
+import pytest
+from ingredient_aliases import resolve_alias
+
+
+@pytest.mark.parametrize("query", [
+    "花生油", "玉米油", "蛋糕", "鸡蛋面", "皮蛋", "面粉", "橙汁", "苹果汁", "番茄酱", "牛肉干", "虾酱",
+])
+def test_processed_products_do_not_resolve_to_their_base_food(query):
+    assert resolve_alias(query) is None
+
+
+@pytest.mark.parametrize("query", ["西兰花炒虾仁", "鸡蛋清"])
+def test_leftover_nouns_are_not_guessed(query):
+    assert resolve_alias(query) is None
+
+
+@pytest.mark.parametrize("query", ["li", "cu", "xia", "cong"])
+def test_single_syllable_pinyin_is_ambiguous(query):
+    assert resolve_alias(query) is None
+
+
+@pytest.mark.parametrize("query, english", [
+    ("清蒸鲈鱼", "steamed sea bass"),
+    ("烤红薯", "baked sweet potato"),
+    ("去皮鸡胸肉", "chicken breast"),
+    ("鸡胸肉丁", "chicken breast"),
+    ("牛肉片", "beef"),
+    ("花生油 ", None),
+    ("xia ren", "shrimp"),
+    ("xi lan hua", "broccoli"),
+    ("鸡蛋", "egg"),
+])
+def test_known_prefixes_and_suffixes_still_resolve(query, english):
+    assert resolve_alias(query) == english
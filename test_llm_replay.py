@@ -0,0 +1,58 @@
+import contextvars
+import threading
+import time
+from crewai.llms.base_llm import BaseLLM
+from llm_replay import ReplayLLM, use_stop_words
+
+
+class _SharedLLM(BaseLLM):
+    """模拟进程内共享的内层 LLM：每次调用按 prompt 长度回报用量"""
+
+    def __init__(self):
+        super().__init__(model="shared-llm")
+        self.seen_stop = []
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None,
+             from_task=None, from_agent=None, response_model=None):
+        self.seen_stop.append(list(self.stop))
+        tokens = len(messages)
+        time.sleep(0.05)
+        self._track_token_usage_internal({"prompt_tokens": tokens, "completion_tokens": 1})
+        return "ok"
+
+    def supports_function_calling(self) -> bool:
+        return False
+
+
+def test_concurrent_calls_record_only_their_own_usage():
+    llm = ReplayLLM(_SharedLLM())
+    usages = {}
+
+    def run(size):
+        usages[size] = llm._live_call("x" * size, None, None, None, None, None, None)[1]
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in (10, 200, 3000)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert {n: u["prompt_tokens"] for n, u in usages.items()} == {10: 10, 200: 200, 3000: 3000}
+
+
+def test_stop_words_are_passed_per_call():
+    inner = _SharedLLM()
+    llm = ReplayLLM(inner)
+
+    def run():
+        use_stop_words(["\nObservation:"])
+        llm.call("hi")
+
+    contextvars.copy_context().run(run)
+    assert inner.stop == []
+    assert inner.seen_stop == [["\nObservation:"]]
+
+
+def test_replaced_inner_llm_still_reports_usage():
+    llm = ReplayLLM(_SharedLLM())
+    llm.inner = _SharedLLM()
+    assert llm._live_call("x" * 42, None, None, None, None, None, None)[1]["prompt_tokens"] == 42
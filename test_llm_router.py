@@ -0,0 +1,63 @@
+import time
+import pytest
+from crewai.llms.base_llm import BaseLLM
+from llm_replay import ReplayLLM
+from llm_router import RouterLLM
+
+
+class _TierLLM(BaseLLM):
+    """按档位配置延迟的内层 LLM；记录每次调用看到的停止词与请求超时"""
+
+    def __init__(self, model, delay=0.0):
+        super().__init__(model=model)
+        self.delay = delay
+        self.timeout = None
+        self.seen = []
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None,
+             from_task=None, from_agent=None, response_model=None):
+        self.seen.append((list(self.stop), self.timeout))
+        time.sleep(self.delay)
+        self._track_token_usage_internal({"prompt_tokens": 100, "completion_tokens": 10})
+        return self.model
+
+    def supports_function_calling(self) -> bool:
+        return False
+
+
+def _tiers(**delays):
+    return {model: ReplayLLM(_TierLLM(model, delays.get(model, 0.0))) for model in ("qwen3-max", "qwen-plus", "qwen-turbo")}
+
+
+def _router(tiers, timeout=1.0):
+    return RouterLLM("test", tiers.__getitem__, routes={"test": {"tier": "max", "timeout": timeout}})
+
+
+def test_usage_is_counted_per_router_instance():
+    tiers = _tiers()
+    first, second = _router(tiers), _router(tiers)
+    first.call("hi")
+    first.call("hi")
+    second.call("hi")
+    assert first.get_token_usage_summary().prompt_tokens == 200
+    assert second.get_token_usage_summary().prompt_tokens == 100
+    first.reset_token_usage()
+    assert first.get_token_usage_summary().total_tokens == 0
+
+
+def test_abandoned_attempt_is_not_counted_and_gets_a_request_timeout():
+    tiers = _tiers(**{"qwen3-max": 0.5})
+    router = _router(tiers, timeout=0.2)
+    router.stop = ["\nObservation:"]
+    assert router.call("hi") == "qwen-plus"
+    assert router.get_token_usage_summary().successful_requests == 1
+    assert tiers["qwen3-max"].inner.seen == [(["\nObservation:"], 0.2)]
+    # 共享的内层 LLM 没有被修改
+    assert tiers["qwen3-max"].inner.stop == [] and tiers["qwen3-max"].inner.timeout is None
+
+
+def test_last_tier_is_bounded_too():
+    tiers = _tiers(**{model: 0.5 for model in ("qwen3-max", "qwen-plus", "qwen-turbo")})
+    router = _router(tiers, timeout=0.1)
+    with pytest.raises(TimeoutError):
+        router.call("hi")
@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from lookup_dispatcher import LookupDispatcher
+
+
+class _Prepared:
+    def __init__(self, query, hint=None):
+        self.query = query
+        self.hint = hint
+        self.result = None
+        self.tier = ""
+
+
+def _dispatcher(submit, prepare=_Prepared):
+    return LookupDispatcher(lambda q: q.strip().lower(), prepare, lambda p: p.query.upper(), submit, window=0.005)
+
+
+def test_identical_queries_are_coalesced():
+    pool = ThreadPoolExecutor(2)
+    dispatcher = _dispatcher(pool.submit)
+    futures = [dispatcher.submit(q) for q in ("egg", "Egg ", "rice")]
+    assert [f.result(timeout=5).value for f in futures] == ["EGG", "EGG", "RICE"]
+    assert [f.result().coalesced for f in futures] == [False, True, False]
+    assert dispatcher.stats()["coalesced"] == 1
+
+
+def test_failed_upstream_submit_fails_waiters_instead_of_hanging():
+    pool = ThreadPoolExecutor(1)
+    pool.shutdown()
+    dispatcher = _dispatcher(pool.submit)
+    futures = [dispatcher.submit("egg"), dispatcher.submit("egg")]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    # 之后再次请求同一个键不会挂到失效的等待列表上
+    with pytest.raises(RuntimeError):
+        dispatcher.submit("egg").result(timeout=5)
+
+
+def test_unexpected_batch_error_fails_unhandled_keys():
+    pool = ThreadPoolExecutor(2)
+    dispatcher = _dispatcher(pool.submit, prepare=lambda q, hint: object())
+    with pytest.raises(AttributeError):
+        dispatcher.submit("egg").result(timeout=5)
+
+
+def test_hint_of_first_submitter_reaches_prepare():
+    pool = ThreadPoolExecutor(2)
+    seen = []
+
+    def prepare(query, hint):
+        seen.append(hint)
+        return _Prepared(query, hint)
+
+    dispatcher = _dispatcher(pool.submit, prepare=prepare)
+    futures = [dispatcher.submit("egg", hint="first"), dispatcher.submit("egg", hint="second")]
+    assert [f.result(timeout=5).value for f in futures] == ["EGG", "EGG"]
+    assert seen == ["first"]
@@ -0,0 +1,85 @@
+import pytest
+from menu_audit import (audit_menu, menu_tables, merge_shopping_list, parse_ingredients, parse_menu_table, render_audit,
+                        split_ingredients)
+
+
+def test_thousands_separator_in_claimed_kcal(menu):
+    rows = parse_menu_table(menu)
+    assert rows[0]["claimed_kcal"] == 1050.0
+
+
+def test_thousands_separator_in_grams():
+    assert parse_ingredients("米饭 1,200g、鸡胸肉 150g") == [("米饭", 1200.0), ("鸡胸肉", 150.0)]
+
+
+def test_known_count_units_are_converted():
+    items, unparsed = split_ingredients("鸡蛋 2个、吐司 2片、香蕉1根")
+    assert items == [("鸡蛋", 100.0), ("吐司", 70.0), ("香蕉", 120.0)]
+    assert unparsed == []
+
+
+def test_explicit_grams_win_over_count():
+    assert parse_ingredients("鸡蛋 1个(60g)") == [("鸡蛋", 60.0)]
+
+
+def test_unknown_count_units_are_reported_missing(menu, lookup):
+    audit = audit_menu(menu, lookup, targets={"target_kcal": 1800, "meals": {"早餐": 540, "午餐": 720}})
+    assert "汉堡 1个" in audit["missing"]
+    # 午餐没有可计入的食材：不应报出虚假的热量缺口
+    labels = [flag[0] for flag in audit["flags"]]
+    assert "午餐 热量" not in labels
+    assert not any(label.startswith("全天") for label in labels)
+    assert "汉堡 1个" in render_audit(audit)
+
+
+@pytest.mark.parametrize("cell", ["汉堡 1个", "披萨 2块"])
+def test_unparsed_items_keep_their_text(cell):
+    items, unparsed = split_ingredients(cell)
+    assert items == [] and unparsed == [cell]
+
+
+@pytest.mark.parametrize("cell, expected", [
+    ("1根香蕉、2个鸡蛋", [("香蕉", 120.0), ("鸡蛋", 100.0)]),
+    ("150g鸡胸肉(生重)", [("鸡胸肉", 150.0)]),
+])
+def test_count_before_name(cell, expected):
+    assert split_ingredients(cell) == (expected, [])
+
+
+@pytest.mark.parametrize("cell, expected", [
+    ("一个苹果", [("苹果", 180.0)]),
+    ("鸡蛋 两个", [("鸡蛋", 100.0)]),
+    ("半根香蕉", [("香蕉", 60.0)]),
+    ("十二个鸡蛋", [("鸡蛋", 600.0)]),
+])
+def test_chinese_numerals(cell, expected):
+    assert split_ingredients(cell) == (expected, [])
+
+
+@pytest.mark.parametrize("cell, expected", [
+    ("鸡胸肉 0.15kg", [("鸡胸肉", 150.0)]),
+    ("半斤牛肉", [("牛肉", 250.0)]),
+    ("牛肉 1斤", [("牛肉", 500.0)]),
+])
+def test_kg_and_jin(cell, expected):
+    assert split_ingredients(cell) == (expected, [])
+
+
+@pytest.mark.parametrize("cell", ["盐 适量", "2 large eggs", "一些坚果"])
+def test_unmatched_parts_are_reported(cell):
+    assert split_ingredients(cell) == ([], [cell])
+
+
+def test_unmatched_part_keeps_meal_out_of_target_checks(menu, lookup):
+    menu = menu.replace("汉堡 1个", "香蕉 两根、酱料 少许")
+    audit = audit_menu(menu, lookup, targets={"target_kcal": 1800, "meals": {"早餐": 540, "午餐": 720}})
+    assert "酱料 少许" in audit["missing"]
+    assert "午餐 热量" not in [flag[0] for flag in audit["flags"]]
+
+
+def test_menu_tables_groups_rows_by_day():
+    day = "| 餐次 | 推荐菜品 | 核心食材及生重(g) | 热量估算 |\n|---|---|---|---|\n| 早餐 | 燕麦粥 | 燕麦 {}g | 200 |\n"
+    reviewed = "### 第 1 天\n" + day.format(50) + "\n### 第 2 天\n" + day.format(80)
+    tables = menu_tables(reviewed)
+    assert [[row["ingredients"] for row in rows] for rows in tables] == [[[("燕麦", 50.0)]], [[("燕麦", 80.0)]]]
+    assert merge_shopping_list(tables) == [("燕麦", 130.0, 2)]
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from nutrition_math import (CONDITION_RULES, KCAL_PER_G, activity_factor, calculate_batch, calculate_profile,
+                            detect_conditions, goal_adjustment, render_report)
+
+
+def _profile(health_issues, weight=90):
+    return dict(gender="男", age=45, height=170, weight=weight, job_desc="程序员",
+                health_issues=health_issues, goals="减脂")
+
+
+def _ref_weight(weight=90, height=170):
+    return min(weight, 24.0 * (height / 100) ** 2)
+
+
+def _ratios(result):
+    kcal = result["target_kcal"]
+    return {k: result[f"{k}_g"] * KCAL_PER_G[k] / kcal for k in ("protein", "carbs", "fat")}
+
+
+@pytest.mark.parametrize("health_issues", ["肾病 糖尿病", "脂肪肝 糖尿病", "糖尿病 血脂", "肾病 糖尿病 脂肪肝", "尿酸 糖尿病"])
+def test_carb_overflow_respects_every_cap(health_issues):
+    result = calculate_profile(_profile(health_issues))
+    ratios = _ratios(result)
+    for name in result["conditions"]:
+        rule = CONDITION_RULES[name]
+        if "carb_ratio_max" in rule:
+            assert ratios["carbs"] <= rule["carb_ratio_max"] + 1e-9
+        if "fat_ratio_max" in rule:
+            assert ratios["fat"] <= rule["fat_ratio_max"] + 1e-9
+        if "protein_g_per_kg_max" in rule:
+            assert result["protein_g"] / _ref_weight() <= rule["protein_g_per_kg_max"] + 1e-9
+
+
+def test_overflow_fills_target_when_there_is_headroom():
+    result = calculate_profile(_profile("脂肪肝 糖尿病"))
+    macros = sum(result[f"{k}_g"] * KCAL_PER_G[k] for k in ("protein", "carbs", "fat"))
+    assert result["unallocated_kcal"] == pytest.approx(0.0)
+    assert macros == pytest.approx(result["target_kcal"])
+
+
+def test_shortfall_is_flagged_instead_of_exceeding_caps():
+    result = calculate_profile(_profile("肾病 糖尿病 脂肪肝"))
+    macros = sum(result[f"{k}_g"] * KCAL_PER_G[k] for k in ("protein", "carbs", "fat"))
+    assert result["unallocated_kcal"] > 0
+    assert macros + result["unallocated_kcal"] == pytest.approx(result["target_kcal"])
+    assert "⚠️" in render_report(result)
+
+
+def test_batch_caps_apply_per_row():
+    batch = calculate_batch(
+        [True, False], [45, 30], [170, 160], [90, 55], [1.2, 1.375], [-500, 0],
+        carb_ratio_max=[0.45, np.inf], fat_ratio_max=[0.25, np.inf], protein_g_per_kg_max=[0.8, np.inf],
+    )
+    assert batch["carbs_g"][0] * 4 / batch["target_kcal"][0] <= 0.45 + 1e-9
+    assert batch["fat_g"][0] * 9 / batch["target_kcal"][0] <= 0.25 + 1e-9
+    assert batch["unallocated_kcal"][1] == pytest.approx(0.0)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("无糖尿病、无高血压，血脂正常", []),
+    ("没有高血压，血糖偏高", ["diabetes"]),
+    ("高血压，血脂无异常", ["hypertension"]),
+    ("否认肾病史；尿酸偏高", ["hyperuricemia"]),
+])
+def test_detect_conditions_respects_negation(text, expected):
+    assert detect_conditions(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("程序员，很少运动", (1.2, "久坐")),
+    ("程序员，每周跑步三次", (1.55, "中度活动")),
+    ("销售，不坐班", (1.55, "中度活动")),
+])
+def test_activity_factor_respects_qualifiers(text, expected):
+    assert activity_factor(text) == expected
+
+
+@pytest.mark.parametrize("goals, expected", [
+    ("保持体重", (0, "维持")),
+    ("瘦身", (-500, "减脂")),
+    ("不想减重，保持体型", (0, "维持")),
+])
+def test_goal_adjustment_matches_whole_phrases(goals, expected):
+    assert goal_adjustment(goals) == expected
+
+
+def test_goal_ignores_preferences():
+    result = calculate_profile(dict(_profile("无"), goals="保持体重", preferences="喜欢吃瘦肉"))
+    assert result["goal_label"] == "维持"
+
+
+def test_added_sugar_limit_is_listed_once():
+    report = render_report(calculate_profile(_profile("糖尿病 脂肪肝")))
+    assert report.count("添加糖") == 1
+
+
+def test_meal_split_uses_allocated_kcal():
+    result = calculate_profile(_profile("肾病 糖尿病 脂肪肝"))
+    assert sum(result["meals"].values()) == pytest.approx(result["target_kcal"] - result["unallocated_kcal"])
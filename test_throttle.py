@@ -0,0 +1,31 @@
+import time
+from throttle import AdaptiveLimiter
+
+
+def test_burst_of_overloads_halves_once():
+    limiter = AdaptiveLimiter(initial=16, max_limit=16)
+    started = [limiter.acquire() for _ in range(8)]
+    for sent in started:
+        limiter.release(overloaded=True, started=sent)
+    assert limiter.limit == 8
+    assert limiter.stats()["decreases"] == 1
+    assert limiter.stats()["suppressed_decreases"] == 7
+
+
+def test_requests_sent_after_a_decrease_can_halve_again():
+    limiter = AdaptiveLimiter(initial=16, max_limit=16)
+    limiter.release(overloaded=True, started=limiter.acquire())
+    limiter.release(overloaded=True, started=limiter.acquire())
+    assert limiter.limit == 4
+
+
+def test_cooldown_without_start_time():
+    limiter = AdaptiveLimiter(initial=16, max_limit=16, cooldown=0.05)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(overloaded=True)
+    assert limiter.limit == 8
+    time.sleep(0.06)
+    limiter.acquire()
+    limiter.release(overloaded=True)
+    assert limiter.limit == 4
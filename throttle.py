@@ -0,0 +1,188 @@
+import random
+import threading
+import time
+
+
+# ============================================================
+# 1. 令牌桶限流
+# ============================================================
+class TokenBucket:
+    """进程内共享的令牌桶：平均 rate 次/秒，允许 burst 次突发"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.throttle_wait_s = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: float = None) -> bool:
+        """取一个令牌；需要等待时阻塞，超过 timeout 返回 False"""
+        start = time.monotonic()
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    if waited:
+                        self.throttled += 1
+                        self.throttle_wait_s += now - start
+                    return True
+                delay = (1 - self._tokens) / self.rate
+            if timeout is not None and now - start + delay > timeout:
+                return False
+            waited = True
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "throttled": self.throttled,
+            "throttle_wait_s": round(self.throttle_wait_s, 3),
+        }
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def shared_bucket(name: str, rate: float, burst: int) -> TokenBucket:
+    """按名称在进程内共享令牌桶 (所有会话共用同一份配额)"""
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst)
+            _buckets[name] = bucket
+    return bucket
+
+
+# ============================================================
+# 2. 自适应并发 (AIMD)
+# ============================================================
+class AdaptiveLimiter:
+    """
+    在途请求数上限随上游健康度调整：
+    - 收到 429 / 5xx 时乘性减半；每个 RTT 至多减半一次：
+      只有在上次减半之后才发出的请求过载才会再次减半，
+      同一批并发请求的 429 只算一次拥塞信号
+    - 连续成功 limit 次后加 1，逐步恢复到 max_limit
+    """
+
+    def __init__(self, initial: int = 5, min_limit: int = 1, max_limit: int = 20,
+                 cooldown: float = 1.0):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        # 调用方未提供请求发出时间时，退化为固定冷却窗口
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.waiting = 0
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        self._cond = threading.Condition()
+        self.decreases = 0
+        self.suppressed_decreases = 0
+
+    def acquire(self) -> float:
+        """占用一个并发名额，返回放行时间 (供 release 判断是否属于同一 RTT)"""
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_flight >= self.limit:
+                    self._cond.wait()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, overloaded: bool = False, started: float = None):
+        with self._cond:
+            self.in_flight -= 1
+            if overloaded:
+                now = time.monotonic()
+                sent_at = started if started is not None else now - self.cooldown
+                if sent_at >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit // 2)
+                    self._last_decrease = now
+                    self.decreases += 1
+                else:
+                    self.suppressed_decreases += 1
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "decreases": self.decreases,
+                "suppressed_decreases": self.suppressed_decreases,
+            }
+
+
+# ============================================================
+# 3. 指数退避 + 重试预算
+# ============================================================
+class RetryPolicy:
+    """
+    全抖动指数退避。重试预算按请求量积累：
+    每个首发请求存入 budget_ratio 个重试额度，每次重试消耗 1 个，
+    上游大面积故障时重试总量不会超过正常流量的 budget_ratio 倍。
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.2, max_delay: float = 3.0,
+                 budget_ratio: float = 0.2, min_budget: float = 5):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self._budget = float(min_budget)
+        self._max_budget = max(float(min_budget), 100 * budget_ratio)
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    def on_request(self):
+        with self._lock:
+            self._budget = min(self._max_budget, self._budget + self.budget_ratio)
+
+    def allow_retry(self, attempt: int) -> bool:
+        """attempt 从 1 开始计数；预算不足或次数用尽时返回 False"""
+        if attempt >= self.max_attempts:
+            return False
+        with self._lock:
+            if self._budget < 1:
+                self.budget_exhausted += 1
+                return False
+            self._budget -= 1
+            self.retries += 1
+            return True
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "retries": self.retries,
+                "retry_budget": round(self._budget, 2),
+                "budget_exhausted": self.budget_exhausted,
+            }
@@ -0,0 +1,115 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from resources import lazy_import
+
+# 需要逐 token 推送到界面的任务 (按 Task.name)：最终交付文档
+STREAM_TASKS = ("qa_review", "weekly_review")
+FINAL_ANSWER = "Final Answer:"
+
+
+# ============================================================
+# 1. 单次运行的流式输出缓冲
+# ============================================================
+class TokenStream:
+    """
+    收集指定任务的 LLMStreamChunkEvent 文本块。
+    ReAct 格式下一个任务可能有多轮 LLM 调用 (思考 / 工具调用 / 最终答案)，
+    界面只展示最后一个 "Final Answer:" 之后的内容，不需要区分调用边界。
+    """
+
+    def __init__(self, task_names=STREAM_TASKS):
+        self.task_names = tuple(task_names)
+        self.seq = 0
+        self._chunks = []      # [(来源, 文本块)]，来源为 _Guarded 或 None
+        self._dropped = set()  # 已放弃的来源
+        self._lock = threading.Lock()
+
+    def feed(self, task_name: str, chunk: str, owner=None):
+        if task_name not in self.task_names or not chunk:
+            return
+        with self._lock:
+            self._chunks.append((owner, chunk))
+            self.seq += 1
+
+    def drop(self, owner):
+        """丢弃某个来源推送过的全部文本块"""
+        with self._lock:
+            self._dropped.add(owner)
+            self.seq += 1
+
+    def text(self) -> str:
+        with self._lock:
+            return "".join(chunk for owner, chunk in self._chunks if owner is None or owner not in self._dropped)
+
+    def final_text(self) -> str:
+        """最终答案部分；还没开始输出最终答案时返回空字符串"""
+        text = self.text()
+        index = text.rfind(FINAL_ANSWER)
+        return text[index + len(FINAL_ANSWER):].lstrip() if index >= 0 else ""
+
+
+class _Guarded:
+    """一次可能被放弃的 LLM 调用 (见 llm_router) 的流式输出：放弃后丢弃它已推送和之后推送的文本块"""
+
+    def __init__(self, stream: TokenStream, cancelled: threading.Event):
+        self.stream = stream
+        self.cancelled = cancelled
+
+    def feed(self, task_name: str, chunk: str):
+        if not self.cancelled.is_set():
+            self.stream.feed(task_name, chunk, owner=self)
+
+    def discard(self):
+        self.stream.drop(self)
+
+
+# ============================================================
+# 2. 事件订阅 (按上下文分发)
+# ============================================================
+# CrewAI 在发出文本块的线程里同步调用 LLMStreamChunkEvent 的处理函数，
+# 因此可以像 run_logs 一样用 contextvars 找到当前运行的缓冲
+_current = contextvars.ContextVar("token_stream", default=None)
+_install_lock = threading.Lock()
+_installed = False
+
+
+def _on_chunk(source, event):
+    stream = _current.get()
+    if stream is not None:
+        stream.feed(getattr(event, "task_name", None), event.chunk)
+
+
+def install():
+    """向 CrewAI 事件总线注册文本块处理函数 (幂等)"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        events = lazy_import("crewai.events")
+        events.crewai_event_bus.on(events.LLMStreamChunkEvent)(_on_chunk)
+        _installed = True
+
+
+def guard(cancelled: threading.Event):
+    """
+    在当前上下文内 (为一次可放弃的 LLM 调用复制的上下文) 包装流式缓冲，
+    返回 _Guarded (调用方放弃时调用其 discard)；当前没有流式缓冲时返回 None
+    """
+    stream = _current.get()
+    if stream is None:
+        return None
+    guarded = _Guarded(getattr(stream, "stream", stream), cancelled)
+    _current.set(guarded)
+    return guarded
+
+
+@contextmanager
+def streaming(stream: TokenStream):
+    """在当前上下文内把指定任务的流式文本收集到 stream (新线程需在线程内调用)"""
+    install()
+    token = _current.set(stream)
+    try:
+        yield stream
+    finally:
+        _current.reset(token)
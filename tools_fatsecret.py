@@ -1,10 +1,32 @@
-import requests
-import json
+import contextvars
 import os
-from typing import Type
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from concurrent.futures import wait
+from typing import Optional, Type
 from crewai.tools import BaseTool
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+from fatsecret_client import FatSecretAuthError, FatSecretClient, FatSecretUnavailable, get_client
+from instrumentation import annotate, record as record_span, traced
+from food_query import CanonicalQuery, NearDuplicateIndex, canonicalize, compatible
+from ingredient_aliases import resolve_alias, split_queries
+from lookup_dispatcher import LookupDispatcher
+from nutrient_cache import LRUCache, NegativeEntry, NutrientRecord, default_cache_policies
+from nutrient_reference import get_reference_db
+from nutrient_store import NutrientStore
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+_store_lock = threading.Lock()
+# 进程内内存缓存，按数据库路径共享 (所有会话 / 工具实例共用)
+_memory_caches = {}
+# 已缓存查询的近似重复索引，按数据库路径共享
+_near_indexes = {}
+# 正在后台刷新的 key，避免同一条目重复刷新
+_refreshing = set()
+# 跨会话的查询微批调度器，按影响查询结果的全部配置共享 (调度器绑定的是第一个实例的方法)
+_dispatchers = {}
+_query_log_lock = threading.Lock()
 
 
 # ============================================================
@@ -15,6 +37,30 @@ class FatSecretInput(BaseModel):
                        description="A comma-separated list of foods to search. E.g., 'rice, chicken breast, broccoli'.")
 
 
+class _MemoryCheck:
+    """调用方已查过内存缓存：entry 为查到的条目 (可能为 None)，_prepare 不再重复查询"""
+
+    __slots__ = ("entry",)
+
+    def __init__(self, entry):
+        self.entry = entry
+
+
+class _Lookup:
+    """单个查询走完缓存层后的中间状态：result 非空表示已解析，否则需要联网"""
+
+    __slots__ = ("clean_query", "search_text", "canonical", "key", "stale", "tier", "result")
+
+    def __init__(self, clean_query, search_text="", canonical=None, key=""):
+        self.clean_query = clean_query
+        self.search_text = search_text
+        self.canonical = canonical
+        self.key = key
+        self.stale = None
+        self.tier = ""
+        self.result = None
+
+
 # ============================================================
 # 2. 核心工具类
 # ============================================================
@@ -23,6 +69,8 @@ class FatSecretSearchTool(BaseTool):
     description: str = (
         "Useful for searching nutritional info for multiple foods at once. "
         "Returns calories/macros per 100g. "
+        "Food names may be English, Chinese or pinyin. "
+        "Results tagged [Local ~score] are fuzzy matches from an offline table: check the matched name. "
         "You MUST provide the argument 'query' with a comma-separated string."
     )
     args_schema: Type[BaseModel] = FatSecretInput
@@ -32,143 +80,403 @@ class FatSecretSearchTool(BaseTool):
     client_secret: str = Field(..., description="FatSecret Client Secret")
 
     # 内部状态
-    token: str = Field(default=None, exclude=True)
+    cache_db: str = "food_cache.db"
+    # 旧版 JSON 缓存，仅用于首次启动时迁移
     cache_file: str = "food_cache_db.json"
+    # 进程内 LRU 层：容量与过期时间 (秒)
+    memory_cache_size: int = 4096
+    memory_cache_ttl: float = 6 * 3600
+    # 各类条目 (found / not_found / auth_failed / unavailable) 的新鲜期与可过期服务期
+    cache_policies: dict = Field(default_factory=default_cache_policies)
+    # 本地离线营养库：优先于联网查询；联网失败时只接受高置信度的匹配兜底
+    reference_db: str = os.path.join(_DATA_DIR, "reference")
+    reference_csv: str = os.path.join(_DATA_DIR, "reference_foods.csv")
+    reference_min_score: float = 0.6
+    reference_fallback_score: float = 0.8
+    # 近似重复查询直接复用已有缓存的最低置信度
+    near_duplicate_confidence: float = 0.75
+    # 非空时把每个查询追加写入该文件，供 food_query.py replay 评估命中率
+    query_log_file: str = ""
+    _store: NutrientStore = PrivateAttr(default=None)
 
     token_url: str = "https://oauth.fatsecret.com/connect/token"
     api_url: str = "https://platform.fatsecret.com/rest/server.api"
 
-    def _get_access_token(self):
-        """获取 OAuth 2.0 Token"""
-        if self.token: return self.token
-        try:
-            # 如果是 mock ID，直接返回 None，不进行真实请求
-            if self.client_id == "mock_id":
-                return None
-
-            res = requests.post(
-                self.token_url,
-                data={"grant_type": "client_credentials", "scope": "basic"},
-                auth=(self.client_id, self.client_secret),
-                timeout=10
-            )
-            res.raise_for_status()
-            self.token = res.json()["access_token"]
-            return self.token
-        except Exception as e:
-            # 这里的 print 会显示在后台终端，方便调试
-            print(f"Auth Error: {e}")
-            return None
+    # 上游调用限额 (进程内所有会话共享)：每秒请求数 / 突发量 / 最大并发
+    rate_limit: float = 10.0
+    burst: int = 20
+    max_concurrency: int = 16
+    # 查询微批：收集窗口 (毫秒，0 表示不合并) 与单批最多的不同查询数，为空时读环境变量
+    lookup_window_ms: Optional[float] = None
+    lookup_max_batch: Optional[int] = None
+
+    def _get_client(self) -> FatSecretClient:
+        """进程内共享的 FatSecret 客户端 (连接池 + Token 管理 + 在途合并 + 限流)"""
+        return get_client(
+            self.client_id, self.client_secret, self.token_url, self.api_url,
+            rate_limit=self.rate_limit, burst=self.burst, max_concurrency=self.max_concurrency
+        )
+
+    def upstream_stats(self) -> dict:
+        """上游调用指标：排队深度、限流等待、当前并发上限、重试次数"""
+        return self._get_client().stats()
+
+    # 调度器绑定 _prepare / _fetch，这些字段不同的实例不能共用同一个调度器
+    _DISPATCHER_FIELDS = (
+        "client_id", "client_secret", "token_url", "api_url", "rate_limit", "burst", "max_concurrency",
+        "cache_db", "cache_file", "memory_cache_size", "memory_cache_ttl", "cache_policies",
+        "reference_db", "reference_csv", "reference_min_score", "reference_fallback_score",
+        "near_duplicate_confidence", "lookup_window_ms", "lookup_max_batch",
+    )
+
+    def _get_dispatcher(self):
+        """进程内共享的查询微批调度器；窗口为 0 时返回 None (每个查询直接执行)"""
+        dispatcher_key = tuple(repr(getattr(self, name)) for name in self._DISPATCHER_FIELDS)
+        with _store_lock:
+            dispatcher = _dispatchers.get(dispatcher_key)
+            if dispatcher is None:
+                window = None if self.lookup_window_ms is None else self.lookup_window_ms / 1000
+                dispatcher = LookupDispatcher(self._dedupe_key, self._prepare, self._fetch,
+                                              self._get_client().submit, window, self.lookup_max_batch)
+                _dispatchers[dispatcher_key] = dispatcher
+        return dispatcher if dispatcher.window > 0 else None
+
+    def lookup_stats(self) -> dict:
+        """微批指标：请求数、合并数、批次数、平均批大小、合并比例"""
+        dispatcher = self._get_dispatcher()
+        return dispatcher.stats() if dispatcher is not None else {}
 
     # ============================================================
     # 缓存管理
     # ============================================================
-    def _load_cache(self):
-        if os.path.exists(self.cache_file):
+    def _get_store(self) -> NutrientStore:
+        with _store_lock:
+            if self._store is None:
+                store = NutrientStore(self.cache_db)
+                store.migrate_json(self.cache_file)
+                self._store = store
+        return self._store
+
+    def _get_memory_cache(self) -> LRUCache:
+        with _store_lock:
+            cache = _memory_caches.get(self.cache_db)
+            if cache is None:
+                cache = LRUCache(self.memory_cache_size, self.memory_cache_ttl)
+                _memory_caches[self.cache_db] = cache
+        return cache
+
+    def _get_near_index(self) -> NearDuplicateIndex:
+        index = _near_indexes.get(self.cache_db)
+        if index is None:
+            index = NearDuplicateIndex(self.near_duplicate_confidence)
             try:
-                with open(self.cache_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
+                for stored_key in self._get_store().keys():
+                    index.add(stored_key)
+            except Exception as e:
+                print(f"Cache Read Error: {e}")
+            with _store_lock:
+                index = _near_indexes.setdefault(self.cache_db, index)
+        return index
+
+    def _match_reference(self, key, canonical: CanonicalQuery, min_score):
+        """
+        在本地营养库中模糊匹配 (原始写法与规范化写法取较优者)，返回 (NutrientRecord 或 None, 相似度)。
+        字符相似度之外还要求中心词、烹饪方式与形态词一致 (见 food_query.compatible)，命中后放入内存缓存。
+        """
+        try:
+            reference = get_reference_db(self.reference_db, self.reference_csv)
+        except Exception as e:
+            print(f"Reference DB Error: {e}")
+            return None, 0.0
+        if reference is None:
+            return None, 0.0
+        record, score = None, 0.0
+        for text in dict.fromkeys(t for t in (canonical.raw, canonical.text) if t):
+            # 候选按相似度降序，取第一个满足约束的
+            for candidate, candidate_score in reference.candidates(text, min_score):
+                if compatible(canonical, canonicalize(candidate.name)):
+                    if candidate_score > score:
+                        record, score = candidate, candidate_score
+                    break
+        if record is not None:
+            self._get_memory_cache().put(key, record)
+        return record, score
+
+    def cache_stats(self) -> dict:
+        """内存缓存命中 / 未命中 / 淘汰计数"""
+        return self._get_memory_cache().stats()
+
+    def _load_cache(self, key, memory_check: _MemoryCheck = None):
+        """返回 (NutrientRecord / NegativeEntry / None, 命中层级) (内存 -> SQLite)"""
+        memory = self._get_memory_cache()
+        entry = memory.get(key) if memory_check is None else memory_check.entry
+        if entry is not None:
+            return entry, "memory"
+        try:
+            store = self._get_store()
+            entry = store.get(key) or store.get_miss(key)
+        except Exception as e:
+            print(f"Cache Read Error: {e}")
+            return None, ""
+        if entry is not None:
+            memory.put(key, entry, self._memory_ttl(entry))
+        return entry, "sqlite"
+
+    def _memory_ttl(self, entry):
+        if isinstance(entry, NegativeEntry):
+            policy = self.cache_policies[entry.kind]
+            return policy.fresh_ttl + policy.stale_ttl
+        return None
 
-    def _save_cache(self, key, value):
+    def _save_cache(self, key, record: NutrientRecord):
+        self._get_memory_cache().put(key, record)
         try:
-            current_cache = self._load_cache()
-            current_cache[key] = value
-            with open(self.cache_file, "w", encoding="utf-8") as f:
-                json.dump(current_cache, f, ensure_ascii=False, indent=2)
-        except Exception:
-            pass
+            store = self._get_store()
+            store.put(key, record)
+            store.delete_miss(key)
+        except Exception as e:
+            print(f"Cache Write Error: {e}")
+        self._get_near_index().add(key)
+
+    def _save_miss(self, key, entry: NegativeEntry):
+        self._get_memory_cache().put(key, entry, self._memory_ttl(entry))
+        if entry.kind != "not_found":
+            return
+        try:
+            self._get_store().put_miss(key, entry)
+        except Exception as e:
+            print(f"Cache Write Error: {e}")
+
+    def _schedule_refresh(self, key, search_text):
+        """后台刷新过期条目，调用方继续使用旧值"""
+        refresh_key = (self.cache_db, key)
+        with _store_lock:
+            if refresh_key in _refreshing:
+                return
+            _refreshing.add(refresh_key)
+
+        def refresh():
+            try:
+                record = self._get_client().lookup(search_text)
+                # 上游暂时查不到时保留旧值，不用负结果覆盖正结果
+                if record is not None:
+                    self._save_cache(key, record)
+            except Exception as e:
+                print(f"Background Refresh Error [{key}]: {e}")
+            finally:
+                with _store_lock:
+                    _refreshing.discard(refresh_key)
+
+        self._get_client().submit(refresh)
 
     # ============================================================
     # 单个食物查询逻辑
     # ============================================================
-    def _search_single_food(self, query: str) -> str:
+    @traced("nutrient lookup", "lookup")
+    def _search_single_food(self, query: str):
+        """返回 (clean_query, NutrientRecord 或 None, 状态说明)"""
+        self._log_query(query.strip().lower())
+        lookup = self._prepare(query)
+        result = lookup.result if lookup.result is not None else self._fetch(lookup)
+        if lookup.tier:
+            annotate(cache_tier=lookup.tier)
+        return result
+
+    def _dedupe_key(self, query: str) -> str:
+        """跨调用合并用的键：别名映射 + 规范化后与缓存键一致"""
         clean_query = query.strip().lower()
-        if not clean_query: return ""
+        return canonicalize(resolve_alias(clean_query) or clean_query).key or clean_query
 
-        # 1. 查缓存
-        cache = self._load_cache()
-        if clean_query in cache:
-            return f"[Cache] {cache[clean_query]}"
+    def _fresh(self, cached):
+        """内存缓存条目仍在新鲜期时直接作答 (不进入收集窗口)，返回 (记录, 状态说明) 或 None"""
+        if isinstance(cached, NegativeEntry):
+            if self.cache_policies[cached.kind].state(time.time() - cached.created_at) == "fresh":
+                return None, cached.detail
+        elif cached is not None:
+            if self.cache_policies["found"].state(time.time() - cached.fetched_at) == "fresh":
+                return cached, "Cache"
+        return None
 
-        # 2. 联网查
-        token = self._get_access_token()
-        # 如果没有 Token (比如用户没填Key)，返回模拟数据防止程序崩溃
-        if not token:
-            return f"[{clean_query}]: Auth Failed (Using Mock Data: 100kcal/100g)"
+    def _prepare(self, query: str, memory_check: _MemoryCheck = None) -> _Lookup:
+        """
+        依次查缓存层 (内存 -> SQLite -> 近似重复 -> 本地营养库)，未解析时留给 _fetch 联网。
+        memory_check: 调用方已查过的内存缓存结果 (见 _dispatch)，避免同一查询查两次内存缓存
+        """
+        clean_query = query.strip().lower()
+        lookup = _Lookup(clean_query)
+        if not clean_query:
+            lookup.result = (clean_query, None, "")
+            return lookup
 
-        headers = {"Authorization": f"Bearer {token}"}
+        # 中文 / 拼音食材名先映射为英文，与英文查询共用同一个缓存键
+        search_text = resolve_alias(clean_query) or clean_query
 
-        try:
-            # 步骤A: 搜索 ID
-            search_res = requests.get(
-                self.api_url,
-                headers=headers,
-                params={"method": "foods.search", "search_expression": clean_query, "format": "json", "max_results": 1},
-                timeout=10
-            ).json()
-
-            foods = search_res.get("foods", {}).get("food", [])
-            if not foods: return f"[{clean_query}]: Not Found in Database"
-
-            food_id = foods[0]["food_id"] if isinstance(foods, list) else foods["food_id"]
-
-            # 步骤B: 获取详情
-            detail_res = requests.get(
-                self.api_url,
-                headers=headers,
-                params={"method": "food.get.v2", "food_id": food_id, "format": "json"},
-                timeout=10
-            ).json()
-
-            food_data = detail_res.get("food", {})
-            food_name = food_data.get("food_name", clean_query)
-
-            # 步骤C: 寻找 100g 数据
-            servings = food_data.get("servings", {}).get("serving", [])
-            if isinstance(servings, dict): servings = [servings]
-
-            target = servings[0] if servings else {}
-            for s in servings:
-                if s.get("metric_serving_unit") == "g" and "100" in s.get("metric_serving_amount", ""):
-                    target = s
-                    break
+        # 规范化：词序 / 单复数 / 同义词 / 烹饪方式归并后作为缓存键
+        canonical = canonicalize(search_text)
+        key = canonical.key or clean_query
 
-            # 格式化输出
-            output = (
-                f"{food_name} | "
-                f"Kcal: {target.get('calories', 0)} | "
-                f"P: {target.get('protein', 0)}g | "
-                f"C: {target.get('carbohydrate', 0)}g | "
-                f"F: {target.get('fat', 0)}g (per 100g)"
-            )
+        # 1. 查缓存 (内存 -> SQLite -> 近似重复条目)，按条目类别判断新鲜度
+        status = "Cache"
+        cached, tier = self._load_cache(key, memory_check)
+        if cached is None:
+            near_key, confidence = self._get_near_index().match(canonical)
+            if near_key is not None:
+                cached, _ = self._load_cache(near_key)
+                if cached is not None:
+                    tier = "near"
+                    key = near_key
+                    if confidence < 1.0:
+                        status = f"Cache ~{confidence:.2f}"
 
-            # 3. 写入缓存
-            self._save_cache(clean_query, output)
-            return output
+        lookup.search_text, lookup.canonical, lookup.key, lookup.tier = search_text, canonical, key, tier
+        if isinstance(cached, NegativeEntry):
+            if self.cache_policies[cached.kind].state(time.time() - cached.created_at) != "expired":
+                lookup.result = (clean_query, None, cached.detail)
+                return lookup
+        elif cached is not None:
+            state = self.cache_policies["found"].state(time.time() - cached.fetched_at)
+            if state == "stale":
+                self._schedule_refresh(key, search_text)
+            if state != "expired":
+                lookup.result = (clean_query, cached, status)
+                return lookup
+            lookup.stale = cached
 
+        # 2. 本地离线营养库 (常见主食 / 食材无需联网)
+        if lookup.stale is None:
+            local, score = self._match_reference(key, canonical, self.reference_min_score)
+            if local is not None:
+                lookup.tier = "local"
+                lookup.result = (clean_query, local, f"Local ~{score:.2f}")
+        return lookup
+
+    def _fetch(self, lookup: _Lookup):
+        """联网查询并写回缓存，返回 (clean_query, NutrientRecord 或 None, 状态说明)"""
+        clean_query, key, canonical, stale = lookup.clean_query, lookup.key, lookup.canonical, lookup.stale
+        lookup.tier = "upstream"
+        # 3. 联网查 (共享客户端，相同查询在途时只发一次请求)
+        try:
+            record = self._get_client().lookup(lookup.search_text)
+        except FatSecretAuthError as e:
+            # 如果没有 Token (比如用户没填Key)，返回模拟数据防止程序崩溃
+            print(e)
+            return self._miss(clean_query, key, canonical, "auth_failed",
+                              "Auth Failed (Using Mock Data: 100kcal/100g)", stale)
+        except FatSecretUnavailable as e:
+            # 重试预算已用尽：明确告诉 Agent 不要反复调用工具
+            return self._miss(clean_query, key, canonical, "unavailable",
+                              f"Temporarily Unavailable: {e} (do not retry; estimate with typical values)", stale)
         except Exception as e:
-            return f"[{clean_query}]: API Error {str(e)}"
+            return clean_query, None, f"API Error {str(e)}"
+
+        if record is None:
+            return self._miss(clean_query, key, canonical, "not_found", "Not Found in Database", stale)
+
+        # 4. 写入缓存
+        self._save_cache(key, record)
+        return clean_query, record, ""
+
+    def _log_query(self, clean_query):
+        if not self.query_log_file:
+            return
+        try:
+            with _query_log_lock, open(self.query_log_file, "a", encoding="utf-8") as f:
+                f.write(clean_query + "\n")
+        except OSError as e:
+            print(f"Query Log Error: {e}")
+
+    def _miss(self, clean_query, key, canonical, kind, detail, stale=None):
+        """记录负缓存；如果手里还有过期的旧数据或相近的本地数据，宁可返回它们"""
+        if stale is not None:
+            return clean_query, stale, "Cache"
+        if kind != "not_found":
+            local, score = self._match_reference(key, canonical, self.reference_fallback_score)
+            if local is not None:
+                return clean_query, local, f"Local ~{score:.2f}"
+        self._save_miss(key, NegativeEntry(kind, detail))
+        return clean_query, None, detail
+
+    @staticmethod
+    def _render_result(clean_query, record, status) -> str:
+        """把查询结果渲染成给 LLM 的文本"""
+        if record is None:
+            return f"[{clean_query}]: {status}" if clean_query else ""
+        text = record.render()
+        # 中文 / 拼音查询、本地库模糊匹配：标注原始写法，方便 Agent 对应并判断匹配是否可信
+        if resolve_alias(clean_query) or status.startswith("Local"):
+            text = f"{clean_query} → {text}"
+        return f"[{status}] {text}" if status else text
 
     # ============================================================
     # 执行入口 (并发处理)
     # ============================================================
+    def lookup_records(self, food_list):
+        """并发查询多个食物，返回 [(clean_query, NutrientRecord 或 None, 状态说明)]，供其他工具复用"""
+        dispatcher = self._get_dispatcher()
+        if dispatcher is not None:
+            return self._dispatch(dispatcher, food_list)
+        client = self._get_client()
+        # 每个查询复制一份 contextvars，查询的 span 挂在调用方的 span 下
+        futures = [client.submit(contextvars.copy_context().run, self._search_single_food, food) for food in food_list]
+        return [f.result() for f in futures]
+
+    def _dispatch(self, dispatcher: LookupDispatcher, food_list):
+        """
+        交给微批调度器：与同一窗口内其他会话的查询去重后一起解析。
+        内存缓存中新鲜的条目在调用方线程直接作答，不为热点查询付出窗口等待。
+        """
+        started = time.time_ns()
+        memory = self._get_memory_cache()
+        pending = []
+        for food in food_list:
+            clean_query = food.strip().lower()
+            self._log_query(clean_query)
+            key = self._dedupe_key(food)
+            cached = memory.get(key) if clean_query else None
+            hit = self._fresh(cached)
+            if hit is not None:
+                pending.append((clean_query, hit))
+                record_span("nutrient request", "request", started, time.time_ns(),
+                            query=clean_query, cache_tier="memory", coalesced=False)
+            else:
+                # 已查过的内存条目 (过期 / 待刷新 / 没有) 随查询交给调度器，_prepare 不再重复查内存
+                pending.append((clean_query, dispatcher.submit(food, key, _MemoryCheck(cached))))
+        # 整批共用一个截止时间，总等待不超过 LOOKUP_TIMEOUT
+        done, _ = wait([item for _, item in pending if not isinstance(item, tuple)], timeout=dispatcher.timeout)
+        results = []
+        for clean_query, item in pending:
+            if isinstance(item, tuple):
+                results.append((clean_query, *item))
+                continue
+            if item not in done:
+                results.append((clean_query, None, "Lookup Timed Out (do not retry; estimate with typical values)"))
+                continue
+            try:
+                resolution = item.result()
+            except Exception as e:
+                results.append((clean_query, None, f"API Error {str(e)}"))
+                continue
+            # 合并的查询可能来自别名 (鸡蛋 / egg)，显示调用方自己的写法
+            _, found, status = resolution.value
+            results.append((clean_query, found, status))
+            record_span("nutrient request", "request", started, resolution.finished_ns,
+                        query=clean_query, cache_tier=resolution.tier, coalesced=resolution.coalesced)
+        return results
+
+    @traced("tool Search FatSecret Nutrition Data", "tool")
     def _run(self, query: str) -> str:
         """支持一次性查询多个，逗号分隔"""
         # 防止 None 输入
         if not query:
             return "Please provide valid food names."
 
-        food_list = [f.strip() for f in query.split(',') if f.strip()]
+        # 兼容中文全角逗号 / 顿号分隔
+        food_list = split_queries(query)
 
         if not food_list:
             return "Please provide food names."
 
-        results = []
-        # 使用5个线程并发查询
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(executor.map(self._search_single_food, food_list))
+        # 在客户端线程池中并发查询
+        results = self.lookup_records(food_list)
 
-        return "\n".join(results)
\ No newline at end of file
+        return "\n".join(self._render_result(*r) for r in results)
@@ -0,0 +1,41 @@
+from typing import Type
+from crewai.tools import BaseTool
+from pydantic import BaseModel, Field
+from instrumentation import traced
+from nutrition_math import build_calculation_report
+
+
+# ============================================================
+# 1. 输入参数定义
+# ============================================================
+class NutritionCalculatorInput(BaseModel):
+    gender: str = Field(..., description="'男' / '女' (or 'male' / 'female').")
+    age: int = Field(..., description="Age in years.")
+    height: float = Field(..., description="Height in cm.")
+    weight: float = Field(..., description="Weight in kg.")
+    job_desc: str = Field("", description="Occupation and work intensity, e.g. '程序员，996久坐'.")
+    health_issues: str = Field("", description="Medical conditions / abnormal checkup results.")
+    goals: str = Field("", description="Goals, e.g. '减脂' or '增肌'.")
+    formula: str = Field("mifflin", description="'mifflin' (Mifflin-St Jeor) or 'harris' (Harris-Benedict).")
+
+
+# ============================================================
+# 2. 营养处方计算工具
+# ============================================================
+class NutritionCalculatorTool(BaseTool):
+    name: str = "Calculate Nutrition Prescription"
+    description: str = (
+        "Deterministically computes BMI, BMR, TDEE, daily calorie target, macro grams, "
+        "exchange servings (1 serving = 90 kcal) and condition-specific limits (sodium, GI, purine) "
+        "from basic profile data. Returns a Markdown report."
+    )
+    args_schema: Type[BaseModel] = NutritionCalculatorInput
+
+    @traced("tool Calculate Nutrition Prescription", "tool")
+    def _run(self, gender: str, age: int, height: float, weight: float, job_desc: str = "",
+             health_issues: str = "", goals: str = "", formula: str = "mifflin") -> str:
+        profile = {
+            "gender": gender, "age": age, "height": height, "weight": weight,
+            "job_desc": job_desc, "health_issues": health_issues, "goals": goals,
+        }
+        return build_calculation_report(profile, formula)
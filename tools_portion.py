@@ -0,0 +1,153 @@
+from typing import List, Optional, Type
+import numpy as np
+from crewai.tools import BaseTool
+from pydantic import BaseModel, Field
+from instrumentation import traced
+from tools_fatsecret import FatSecretSearchTool
+
+# 食物交换份：1 份 = 90 kcal
+KCAL_PER_SERVING = 90.0
+# 宏量营养素相对热量的权重 (热量误差最重要)
+MACRO_WEIGHT = 0.6
+# 单个食材的重量上限 (g)：高能量密度 (油脂 / 坚果) 与低能量密度 (蔬菜) 食材单独限制
+DEFAULT_MAX_GRAMS = 400.0
+DENSE_MAX_GRAMS = 30.0
+DENSE_KCAL_PER_100G = 500.0
+LIGHT_MAX_GRAMS = 250.0
+LIGHT_KCAL_PER_100G = 60.0
+
+
+def max_grams(kcal_per_100g: float) -> float:
+    if kcal_per_100g >= DENSE_KCAL_PER_100G:
+        return DENSE_MAX_GRAMS
+    if kcal_per_100g < LIGHT_KCAL_PER_100G:
+        return LIGHT_MAX_GRAMS
+    return DEFAULT_MAX_GRAMS
+
+
+# ============================================================
+# 1. 输入参数定义
+# ============================================================
+class MealPortionTarget(BaseModel):
+    meal: str = Field(..., description="Meal name, e.g. '早餐' or 'Lunch'.")
+    ingredients: List[str] = Field(..., description="Candidate ingredients for this meal, e.g. ['rice', 'chicken breast'].")
+    servings: Optional[float] = Field(None, description="Exchange servings for this meal (1 serving = 90 kcal).")
+    kcal: Optional[float] = Field(None, description="Calorie target for this meal. Overrides servings.")
+    protein_g: Optional[float] = Field(None, description="Protein target in grams.")
+    carbs_g: Optional[float] = Field(None, description="Carbohydrate target in grams.")
+    fat_g: Optional[float] = Field(None, description="Fat target in grams.")
+
+
+class PortionSolverInput(BaseModel):
+    meals: List[MealPortionTarget] = Field(..., description="One entry per meal with its targets and candidate ingredients.")
+
+
+# ============================================================
+# 2. 批量约束最小二乘求解
+# ============================================================
+def solve_portions(per_gram: np.ndarray, targets: np.ndarray, weights: np.ndarray,
+                   upper: np.ndarray, ridge: float = 3e-6, iterations: int = 400) -> np.ndarray:
+    """
+    一次求解所有餐次的食材克数 (带上下界的加权最小二乘，FISTA 投影梯度)。
+    per_gram: [M, 4, K] 每克 kcal / P / C / F
+    targets:  [M, 4]    每餐目标
+    weights:  [M, 4]    每个目标的权重 (0 表示不约束)
+    upper:    [M, K]    每个食材的克数上限 (0 表示该位置无食材)
+    返回 [M, K] 克数
+    """
+    m, _, k = per_gram.shape
+    weighted = per_gram * weights[:, :, None]
+    b = targets * weights
+
+    # 初始点：按热量均分到各食材
+    active = upper > 0
+    n_active = np.maximum(active.sum(axis=1, keepdims=True), 1)
+    kcal_per_g = np.where(per_gram[:, 0, :] > 0, per_gram[:, 0, :], 1.0)
+    x0 = np.clip(targets[:, :1] / n_active / kcal_per_g, 0, upper) * active
+
+    hessian = np.einsum("mik,mil->mkl", weighted, weighted) + ridge * np.eye(k)[None]
+    linear = np.einsum("mik,mi->mk", weighted, b) + ridge * x0
+    step = 1.0 / np.linalg.eigvalsh(hessian)[:, -1:]
+
+    x = y = x0
+    t = 1.0
+    for _ in range(iterations):
+        grad = np.einsum("mkl,ml->mk", hessian, y) - linear
+        x_next = np.clip(y - step * grad, 0, upper)
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        y = x_next + ((t - 1) / t_next) * (x_next - x)
+        x, t = x_next, t_next
+    return x
+
+
+# ============================================================
+# 3. 份量计算工具
+# ============================================================
+class PortionSolverTool(BaseTool):
+    name: str = "Solve Ingredient Portions"
+    description: str = (
+        "Computes exact gram amounts of candidate ingredients so that each meal hits its "
+        "calorie (or exchange-serving, 1 serving = 90 kcal) and macro targets. "
+        "Nutrition data is looked up automatically. "
+        "Provide the argument 'meals': a list of {meal, ingredients, servings or kcal, protein_g, carbs_g, fat_g}."
+    )
+    args_schema: Type[BaseModel] = PortionSolverInput
+
+    # 复用 FatSecret 工具的缓存层获取每 100g 营养数据
+    nutrient_tool: FatSecretSearchTool
+
+    @traced("tool Solve Ingredient Portions", "tool")
+    def _run(self, meals) -> str:
+        meals = [m if isinstance(m, MealPortionTarget) else MealPortionTarget(**m) for m in meals or []]
+        if not meals:
+            return "Please provide at least one meal."
+
+        # 1. 一次性查询所有食材
+        names = list(dict.fromkeys(i.strip() for meal in meals for i in meal.ingredients if i.strip()))
+        records = {q: r for q, r, _ in self.nutrient_tool.lookup_records(names)}
+        records = {name: records.get(name.lower()) for name in names}
+
+        # 2. 组装批量矩阵
+        k = max(len(meal.ingredients) for meal in meals)
+        per_gram = np.zeros((len(meals), 4, k))
+        upper = np.zeros((len(meals), k))
+        targets = np.zeros((len(meals), 4))
+        weights = np.zeros((len(meals), 4))
+        missing = set()
+        for i, meal in enumerate(meals):
+            kcal = meal.kcal if meal.kcal is not None else (meal.servings or 0) * KCAL_PER_SERVING
+            goals = (kcal, meal.protein_g, meal.carbs_g, meal.fat_g)
+            for j, goal in enumerate(goals):
+                if goal:
+                    targets[i, j] = goal
+                    weights[i, j] = (1.0 if j == 0 else MACRO_WEIGHT) / max(goal, 1.0)
+            for j, name in enumerate(meal.ingredients):
+                record = records.get(name.strip())
+                if record is None or record.kcal <= 0:
+                    missing.add(name.strip())
+                    continue
+                per_gram[i, :, j] = (record.kcal / 100, record.protein / 100, record.carbs / 100, record.fat / 100)
+                upper[i, j] = max_grams(record.kcal)
+
+        # 3. 求解并取整到 5g
+        grams = np.round(solve_portions(per_gram, targets, weights, upper) / 5) * 5
+        totals = np.einsum("mik,mk->mi", per_gram, grams)
+
+        # 4. 输出表格
+        lines = ["| 餐次 | 食材 | 生重(g) | 热量(kcal) | 蛋白质(g) | 碳水(g) | 脂肪(g) |",
+                 "|---|---|---|---|---|---|---|"]
+        for i, meal in enumerate(meals):
+            for j, name in enumerate(meal.ingredients):
+                if upper[i, j] == 0 or grams[i, j] == 0:
+                    continue
+                kcal, p, c, f = per_gram[i, :, j] * grams[i, j]
+                lines.append(f"| {meal.meal} | {name.strip()} | {grams[i, j]:.0f} | {kcal:.0f} | {p:.1f} | {c:.1f} | {f:.1f} |")
+            kcal, p, c, f = totals[i]
+            target_text = " / ".join(
+                f"{label}{targets[i, j]:.0f}" for j, label in enumerate(("kcal ", "P ", "C ", "F ")) if weights[i, j]
+            )
+            lines.append(f"| {meal.meal} | **合计** (目标: {target_text or '无'}) | | "
+                         f"**{kcal:.0f}** | **{p:.1f}** | **{c:.1f}** | **{f:.1f}** |")
+        if missing:
+            lines.append(f"\nNo nutrition data (excluded): {', '.join(sorted(missing))}")
+        return "\n".join(lines)